@@ -0,0 +1,332 @@
+"""Compressed, partitioned archive of daily attendance files.
+
+"Create New Sheet" used to rename every attendance_*.csv into a new
+archive_<timestamp> directory, and nothing was ever compacted. After a few
+years, attendance/ held thousands of plain CSV files and hundreds of
+directories that every scan and report had to walk. Finished days are now
+rolled into one directory per month:
+
+    attendance/
+        attendance_2024-03-04.csv           today and the last few days, live
+        archive/
+            2024-02/
+                manifest.json               days, parts, row counts and checksums
+                attendance_2024-02-01.20240302T000000.csv.gz
+                ...
+
+A roll is crash-safe. Each live file is first renamed into archive/.staging,
+which is atomic and leaves marks that arrive later to a fresh file. The staged
+files are then compressed in parallel. Each month's manifest is replaced
+atomically, and that replacement is the commit point: files not listed in a
+manifest do not exist as far as readers are concerned. A roll interrupted
+at any step is finished by the next one, without losing or duplicating rows.
+
+    python attendance_archive.py roll              # days older than attendance_live_days
+    python attendance_archive.py roll --all        # everything, including today
+    python attendance_archive.py prune             # months past attendance_retention_days
+    python attendance_archive.py show 2024-02-01
+"""
+import csv
+import gzip
+import hashlib
+import itertools
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+import metrics
+
+FORMAT = 1
+ARCHIVE_DIR = 'archive'
+STAGING_DIR = '.staging'
+MANIFEST = 'manifest.json'
+LIVE_FILE = re.compile(r'^attendance_(\d{4}-\d{2}-\d{2})\.csv$')
+# attendance_<day>.<tag>.csv, the tag keeping two rolls of one day apart
+STAGED_FILE = re.compile(r'^attendance_(\d{4}-\d{2}-\d{2})\.([\w.-]+)\.csv$')
+# Directories written by the old "Create New Sheet"
+LEGACY_DIR = re.compile(r'^archive_\d{8}_\d{6}$')
+
+
+def period_of(day):
+    """Partition of a 'YYYY-MM-DD' day: its month."""
+    return day[:7]
+
+
+def _replace_json(path, value):
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(value, f, indent=2, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def compress(source, target):
+    """gzip `source` into `target` atomically; returns the part's manifest entry."""
+    rows = -1  # Minus the header
+    tmp_path = target + '.tmp'
+    with open(source, 'rb') as f, open(tmp_path, 'wb') as raw:
+        with gzip.GzipFile(filename='', fileobj=raw, mode='wb', mtime=0) as out:
+            for line in f:
+                if not line.strip():
+                    continue
+                out.write(line)
+                rows += 1
+        raw.flush()
+        os.fsync(raw.fileno())
+    entry = {'file': os.path.basename(target), 'rows': max(rows, 0), 'bytes': os.path.getsize(tmp_path),
+             'sha256': sha256(tmp_path)}
+    os.replace(tmp_path, target)
+    return entry
+
+
+class AttendanceArchive:
+    def __init__(self, directory, workers=4, live_days=7, retention_days=0):
+        """Roll the daily files of `directory` into its archive/ subdirectory.
+
+        live_days:      finished days kept as plain CSV (0 rolls every day before today).
+        retention_days: archived months older than this are deleted (0 keeps them).
+        """
+        self.directory = os.path.abspath(directory)
+        self.root = os.path.join(self.directory, ARCHIVE_DIR)
+        self.staging = os.path.join(self.root, STAGING_DIR)
+        self.workers = max(1, workers)
+        self.live_days = live_days
+        self.retention_days = retention_days
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, cfg):
+        return cls(cfg.attendance_dir, cfg.workers, cfg.attendance_live_days, cfg.attendance_retention_days)
+
+    def manifest_path(self, period):
+        return os.path.join(self.root, period, MANIFEST)
+
+    def manifest(self, period):
+        try:
+            with open(self.manifest_path(period), encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'format': FORMAT, 'period': period, 'days': {}}
+
+    def periods(self):
+        """Archived months, oldest first."""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(entry.name for entry in os.scandir(self.root)
+                      if entry.is_dir() and not entry.name.startswith('.')
+                      and os.path.exists(os.path.join(entry.path, MANIFEST)))
+
+    def stage(self, everything=False, live_lock=None):
+        """Rename finished daily files (and old archive_* directories) into staging."""
+        os.makedirs(self.staging, exist_ok=True)
+        cutoff = (date.today() - timedelta(days=self.live_days)).isoformat()
+        tag = datetime.now().strftime('%Y%m%dT%H%M%S')
+        staged = 0
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_dir() and LEGACY_DIR.match(entry.name):
+                    staged += self.stage_legacy(entry)
+                    continue
+                match = LIVE_FILE.match(entry.name)
+                if not match or not entry.is_file():
+                    continue
+                day = match.group(1)
+                if not everything and day >= cutoff:
+                    continue
+                target = self.staged_path(day, tag)
+                if live_lock is not None:
+                    # Marks may still arrive (today, or a back-filled date): swap between two
+                    with live_lock:
+                        os.replace(entry.path, target)
+                else:
+                    os.replace(entry.path, target)
+                staged += 1
+        return staged
+
+    def staged_path(self, day, tag):
+        """A staging name no earlier roll of `day` used, staged or archived."""
+        listed = {part['file'] for part in self.manifest(period_of(day))['days'].get(day, [])}
+        for n in itertools.count():
+            name = 'attendance_{}.{}{}.csv'.format(day, tag, '-{}'.format(n) if n else '')
+            path = os.path.join(self.staging, name)
+            if not os.path.exists(path) and name + '.gz' not in listed:
+                return path
+
+    def stage_legacy(self, entry):
+        staged = 0
+        with os.scandir(entry.path) as files:
+            for item in files:
+                match = LIVE_FILE.match(item.name)
+                if match and item.is_file():
+                    os.replace(item.path, self.staged_path(match.group(1), entry.name))
+                    staged += 1
+        try:
+            os.rmdir(entry.path)
+        except OSError:
+            pass  # Something else was kept in it
+        return staged
+
+    def roll(self, everything=False, live_lock=None):
+        """Archive finished days (all days with `everything`); returns {period: days rolled}.
+
+        live_lock: the AttendanceStore lock, held while each live file is swapped out.
+        """
+        with self.lock, metrics.timer('attendance.archive_roll'):
+            self.stage(everything, live_lock)
+            staged = {}
+            with os.scandir(self.staging) as entries:
+                for entry in entries:
+                    match = STAGED_FILE.match(entry.name)
+                    if match and entry.is_file():
+                        staged.setdefault(period_of(match.group(1)), []).append((match.group(1), entry.path))
+            if not staged:
+                return {}
+
+            rolled = {period: self.commit(period, files) for period, files in sorted(staged.items())}
+            metrics.incr('attendance.archived_days', sum(rolled.values()))
+            return rolled
+
+    def commit(self, period, files):
+        """Compress one month's staged files and commit them to its manifest."""
+        directory = os.path.join(self.root, period)
+        os.makedirs(directory, exist_ok=True)
+        manifest = self.manifest(period)
+        listed = {part['file'] for parts in manifest['days'].values() for part in parts}
+
+        pending = []
+        for day, path in files:
+            name = os.path.basename(path) + '.gz'
+            if name in listed:
+                # Committed before a crash; only the staged copy was left
+                os.remove(path)
+            else:
+                pending.append((day, path, name))
+        if not pending:
+            return 0
+
+        # zlib releases the GIL, so parts compress in parallel too
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            parts = list(pool.map(lambda job: (job[0], compress(job[1], os.path.join(directory, job[2]))),
+                                  pending))
+        for day, part in parts:
+            manifest['days'].setdefault(day, []).append(part)
+            manifest['days'][day].sort(key=lambda p: p['file'])
+        manifest['updated'] = time.strftime('%Y-%m-%dT%H:%M:%S%z')
+        manifest['rows'] = sum(p['rows'] for day_parts in manifest['days'].values() for p in day_parts)
+        _replace_json(self.manifest_path(period), manifest)
+
+        for _, path, _ in pending:
+            os.remove(path)
+        self.sweep(directory, manifest)
+        return len({day for day, _ in parts})
+
+    def sweep(self, directory, manifest):
+        """Delete parts a crash left behind without a manifest entry."""
+        listed = {part['file'] for parts in manifest['days'].values() for part in parts}
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name != MANIFEST and entry.name not in listed and not entry.name.endswith('.tmp'):
+                    os.remove(entry.path)
+
+    def prune(self, today=None):
+        """Delete archived months that ended more than retention_days ago; returns them."""
+        if self.retention_days <= 0:
+            return []
+        cutoff = period_of(((today or date.today()) - timedelta(days=self.retention_days)).isoformat())
+        removed = []
+        with self.lock:
+            for period in self.periods():
+                if period >= cutoff:
+                    break
+                path = os.path.join(self.root, period)
+                # Renamed first, so a half-deleted month is never read
+                trash = os.path.join(self.root, '.trash-{}-{}'.format(period, os.getpid()))
+                os.replace(path, trash)
+                shutil.rmtree(trash, ignore_errors=True)
+                removed.append(period)
+        return removed
+
+    def read(self, day):
+        """Archived rows of a 'YYYY-MM-DD' day, as dicts keyed by the CSV header."""
+        manifest = self.manifest(period_of(day))
+        rows = []
+        for part in manifest['days'].get(day, []):
+            with gzip.open(os.path.join(self.root, period_of(day), part['file']), 'rt',
+                           newline='', encoding='utf-8') as f:
+                rows.extend(csv.DictReader(f))
+        return rows
+
+    def verify(self, period):
+        """Parts of a month that are missing or fail their checksum."""
+        bad = []
+        for parts in self.manifest(period)['days'].values():
+            for part in parts:
+                path = os.path.join(self.root, period, part['file'])
+                if not os.path.exists(path) or sha256(path) != part['sha256']:
+                    bad.append(part['file'])
+        return bad
+
+
+def main():
+    import argparse
+    import config
+
+    parser = argparse.ArgumentParser(description='Roll, prune and read the attendance archive')
+    parser.add_argument('command', choices=['roll', 'prune', 'show', 'list', 'verify'])
+    parser.add_argument('day', nargs='?', help='Day to show (YYYY-MM-DD) or month to verify (YYYY-MM)')
+    parser.add_argument('--all', action='store_true', help='roll: archive every day, including today')
+    settings = ('attendance_dir', 'workers', 'attendance_live_days', 'attendance_retention_days')
+    config.add_arguments(parser, *settings)
+    args = parser.parse_args()
+    try:
+        cfg = config.from_args(args, *settings)
+    except ValueError as e:
+        print(f"Configuration error: {str(e)}")
+        raise SystemExit(1)
+    archive = AttendanceArchive.from_config(cfg)
+
+    if args.command == 'roll':
+        rolled = archive.roll(everything=args.all)
+        for period, days in rolled.items():
+            print(f"{period}: {days} days archived")
+        print(f"Archived {sum(rolled.values())} days into {archive.root}")
+    elif args.command == 'prune':
+        removed = archive.prune()
+        print(f"Deleted {len(removed)} archived months" + (f": {', '.join(removed)}" if removed else ''))
+    elif args.command == 'list':
+        for period in archive.periods():
+            manifest = archive.manifest(period)
+            print(f"{period}: {len(manifest['days'])} days, {manifest.get('rows', 0)} marks")
+    elif args.command == 'show':
+        if not args.day:
+            parser.error('show needs a day (YYYY-MM-DD)')
+        rows = archive.read(args.day)
+        for row in rows:
+            print(f"{row['Name']}: {row['Time']}")
+        print(f"{len(rows)} marks archived for {args.day}")
+    elif args.command == 'verify':
+        periods = [args.day] if args.day else archive.periods()
+        bad = [(period, part) for period in periods for part in archive.verify(period)]
+        for period, part in bad:
+            print(f"{period}: {part} is missing or corrupt")
+        print(f"Verified {len(periods)} months, {len(bad)} bad parts")
+        if bad:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""Write-behind shipping of attendance marks to a central DynamoDB table.
+
+Marks are appended to a local log (fsynced JSON lines) on the marking thread,
+which never waits on the network. A background thread ships pending marks in
+batch_write_item calls and records how far the log has been shipped in a
+small offset file. When the network is down the log simply grows; it is
+replayed on the next flush, including after a restart.
+
+Every mark carries a MarkId generated when it was logged, so a batch that is
+sent twice (a crash between writing and committing the offset) overwrites
+the same items instead of duplicating them.
+"""
+import json
+import os
+import random
+import threading
+import time
+import uuid
+
+import metrics
+
+SYNC_LOG = 'sync_log.jsonl'
+# batch_write_item accepts at most 25 put requests per call
+BATCH_SIZE = 25
+MAX_BACKOFF = 300.0
+
+
+class AttendanceLog:
+    def __init__(self, path):
+        """Append-only JSON lines of marks, plus the byte offset already shipped."""
+        self.path = os.path.abspath(path)
+        self.offset_path = self.path + '.offset'
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.file = open(self.path, 'ab')
+        # A crash mid-append leaves a partial line; end it so the next record
+        # starts on its own line and only the torn one is dropped
+        size = self.file.tell()
+        if size:
+            with open(self.path, 'rb') as f:
+                f.seek(size - 1)
+                if f.read(1) != b'\n':
+                    self.file.write(b'\n')
+                    self.file.flush()
+
+    def append(self, record):
+        line = (json.dumps(record, sort_keys=True) + '\n').encode('utf-8')
+        with metrics.timer('attendance.log'), self.lock:
+            self.file.write(line)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def committed(self):
+        try:
+            with open(self.offset_path, encoding='utf-8') as f:
+                offset = int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+        return offset if offset <= os.path.getsize(self.path) else 0
+
+    def pending(self, limit=BATCH_SIZE):
+        """Up to `limit` unshipped records and the offset just past them."""
+        offset = self.committed()
+        records = []
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            while len(records) < limit:
+                line = f.readline()
+                if not line.endswith(b'\n'):
+                    break  # Still being written
+                offset += len(line)
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    if line.strip():
+                        print(f"Skipping unreadable attendance log line at byte {offset - len(line)}")
+        return records, offset
+
+    def commit(self, offset):
+        """Record that everything before `offset` has been shipped."""
+        with self.lock:
+            # Fully shipped: start the log afresh so it doesn't grow forever.
+            # The offset is reset before truncating, so a crash in between
+            # resends marks (harmless) rather than skipping new ones
+            compact = offset >= self.file.tell()
+            tmp_path = self.offset_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(str(0 if compact else offset))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.offset_path)
+            if compact:
+                self.file.truncate(0)
+
+    def close(self):
+        self.file.close()
+
+
+class AttendanceSync:
+    def __init__(self, dynamodb, table_name, log, interval=5.0, max_attempts=5, source=''):
+        """Ship marks from `log` to `table_name` every `interval` seconds in the background."""
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+        self.log = log
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.source = source
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        self.flush_lock = threading.Lock()
+        self.thread = None
+
+    def record(self, name, date_str, time_str):
+        """Log a mark for shipping; returns once it is on local disk."""
+        self.log.append({
+            'MarkId': uuid.uuid4().hex,
+            'Name': name,
+            'Date': date_str,
+            'Time': time_str,
+            'Source': self.source,
+            'Recorded': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        })
+        self.wake.set()
+
+    def item(self, record):
+        return {key: {'S': str(value)} for key, value in record.items()}
+
+    def write(self, records):
+        """batch_write_item the records, retrying unprocessed items with backoff."""
+        requests = [{'PutRequest': {'Item': self.item(record)}} for record in records]
+        for attempt in range(self.max_attempts):
+            with metrics.timer('dynamodb.batch_write_item'):
+                response = self.dynamodb.batch_write_item(RequestItems={self.table_name: requests})
+            requests = response.get('UnprocessedItems', {}).get(self.table_name, [])
+            if not requests:
+                return
+            metrics.incr('attendance.sync_unprocessed', len(requests))
+            time.sleep(random.uniform(0, min(MAX_BACKOFF, 0.1 * 2 ** attempt)))
+        raise RuntimeError(f"{len(requests)} attendance marks still unprocessed after {self.max_attempts} attempts")
+
+    def flush(self):
+        """Ship everything pending, returning the number of marks written."""
+        shipped = 0
+        with self.flush_lock:
+            while True:
+                records, offset = self.log.pending(BATCH_SIZE)
+                if not records:
+                    if offset != self.log.committed():
+                        self.log.commit(offset)  # Only unreadable lines were left
+                    return shipped
+                self.write(records)
+                self.log.commit(offset)
+                shipped += len(records)
+                metrics.incr('attendance.synced', len(records))
+
+    def run(self):
+        failures = 0
+        while not self.stopping.is_set():
+            try:
+                self.flush()
+                failures = 0
+                delay = self.interval
+            except Exception as e:
+                # Network loss, throttling or a missing table: keep the log and retry later
+                failures += 1
+                delay = min(MAX_BACKOFF, self.interval * 2 ** failures)
+                metrics.incr('attendance.sync_error')
+                print(f"Attendance sync failed, retrying in {delay:.0f}s: {str(e)}")
+            if failures:
+                # New marks must not cut the backoff short
+                self.stopping.wait(delay)
+            else:
+                self.wake.wait(delay)
+            self.wake.clear()
+
+    def start(self):
+        """Start the background thread; marks logged by earlier runs are shipped first."""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='attendance-sync', daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        """Stop the thread after one last attempt to ship; unshipped marks stay in the log."""
+        if self.thread is not None:
+            self.stopping.set()
+            self.wake.set()
+            self.thread.join(timeout)
+            self.thread = None
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"Attendance marks left for the next run: {str(e)}")
+        self.log.close()
+
+
+def main():
+    """Ship marks left in an attendance directory's log, e.g. from a kiosk that went offline."""
+    import argparse
+    import config
+
+    parser = argparse.ArgumentParser(description='Ship pending attendance marks to DynamoDB')
+    config.add_arguments(parser, 'attendance_dir', 'attendance_table')
+    args = parser.parse_args()
+    try:
+        cfg = config.from_args(args, 'attendance_dir', 'attendance_table')
+    except ValueError as e:
+        print(f"Configuration error: {str(e)}")
+        raise SystemExit(1)
+    if not cfg.attendance_table:
+        print("Set attendance_table (or FACE_ATTENDANCE_TABLE) to the attendance table first")
+        raise SystemExit(1)
+
+    log = AttendanceLog(os.path.join(cfg.attendance_dir, SYNC_LOG))
+    sync = AttendanceSync(cfg.client('dynamodb'), cfg.attendance_table, log, max_attempts=cfg.max_attempts)
+    try:
+        print(f"Shipped {sync.flush()} attendance marks to {cfg.attendance_table}")
+    except Exception as e:
+        print(f"Error shipping attendance marks: {str(e)}")
+        raise SystemExit(1)
+    finally:
+        log.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+"""Batch recognition over image folders, globs and video files.
+
+Decoding runs in a background thread, recognition requests run concurrently
+through a rate-limited pool, and results stream to a JSONL or CSV file as
+they complete. Completed items are appended to a checkpoint file so an
+interrupted run picks up where it left off:
+
+    python batch.py photos/ --output results.jsonl
+    python batch.py "cctv/*.mp4" --stride 25 --output cctv.csv --mark-attendance --date 2024-03-04
+    python batch.py photos/ --output results.jsonl --resume
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import queue
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import cv2
+
+import config
+from encoding import encode_frame, load_image_bytes
+from engine import ENGINE_SETTINGS, AttendanceStore, RecognitionEngine
+from ratelimit import TokenBucket
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.webm', '.m4v')
+
+_DONE = object()
+
+
+def expand_inputs(inputs):
+    """Resolve directories, globs and files into a sorted list of media paths."""
+    paths = []
+    for entry in inputs:
+        if os.path.isdir(entry):
+            for root, _, files in os.walk(entry):
+                paths.extend(os.path.join(root, f) for f in files)
+        elif any(c in entry for c in '*?['):
+            paths.extend(glob.glob(entry, recursive=True))
+        else:
+            paths.append(entry)
+    media = [p for p in paths if p.lower().endswith(IMAGE_EXTENSIONS + VIDEO_EXTENSIONS)]
+    return sorted(set(media))
+
+
+def iter_items(paths, stride, skip=lambda item_id: False):
+    """Yield (item_id, path, frame_number, image_bytes) for every image and sampled frame.
+
+    Items for which skip(item_id) is true are not decoded or encoded at all.
+    """
+    for path in paths:
+        if path.lower().endswith(VIDEO_EXTENSIONS):
+            cap = cv2.VideoCapture(path)
+            if not cap.isOpened():
+                yield path, path, None, None
+                continue
+            frame_number = 0
+            try:
+                while True:
+                    if frame_number % stride == 0:
+                        item_id = "{}#{}".format(path, frame_number)
+                        if skip(item_id):
+                            if not cap.grab():
+                                break
+                        else:
+                            ret, frame = cap.read()
+                            if not ret:
+                                break
+                            yield item_id, path, frame_number, encode_frame(frame)
+                    elif not cap.grab():
+                        # grab() skips a frame without decoding it
+                        break
+                    frame_number += 1
+            finally:
+                cap.release()
+        elif not skip(path):
+            try:
+                image_bytes = load_image_bytes(path)
+            except Exception:
+                image_bytes = None
+            yield path, path, None, image_bytes
+
+
+class Checkpoint:
+    def __init__(self, path):
+        """Append-only log of completed item ids."""
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.done = set(line.rstrip('\n') for line in f if line.strip())
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def __contains__(self, item_id):
+        return item_id in self.done
+
+    def add(self, item_id):
+        self.file.write(item_id + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class ResultWriter:
+    CSV_FIELDS = ['item', 'source', 'frame', 'status', 'names', 'top_confidence', 'latency_ms', 'error']
+
+    def __init__(self, path, append):
+        """Write results as JSONL, or CSV when the path ends in .csv."""
+        self.is_csv = path.lower().endswith('.csv')
+        exists = append and os.path.exists(path) and os.path.getsize(path) > 0
+        self.file = open(path, 'a' if append else 'w', newline='', encoding='utf-8')
+        if self.is_csv:
+            self.writer = csv.DictWriter(self.file, fieldnames=self.CSV_FIELDS)
+            if not exists:
+                self.writer.writeheader()
+
+    def write(self, row):
+        if self.is_csv:
+            matches = row.get('matches', [])
+            self.writer.writerow({
+                'item': row['item'],
+                'source': row['source'],
+                'frame': row['frame'],
+                'status': row['status'],
+                'names': ';'.join(m['name'] for m in matches if m.get('name')),
+                'top_confidence': max((m['confidence'] for m in matches), default=''),
+                'latency_ms': row.get('latency_ms', ''),
+                'error': row.get('error', ''),
+            })
+        else:
+            self.file.write(json.dumps(row) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class BatchRunner:
+    def __init__(self, engine, writer, checkpoint, workers=8, rate=0, mark=False, date=None):
+        self.engine = engine
+        self.writer = writer
+        self.checkpoint = checkpoint
+        self.workers = workers
+        self.limiter = TokenBucket(rate)
+        self.mark = mark
+        self.date = date
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.skipped = 0
+        # (person_id, date) already marked; frames of one recording repeat people
+        self.marked = set()
+        # date -> names the attendance store already had, so a resumed run doesn't mark them again
+        self.present = {}
+
+    def _skip(self, item_id):
+        if item_id in self.checkpoint:
+            self.skipped += 1
+            return True
+        return False
+
+    def _decode(self, paths, stride, items):
+        try:
+            for item in iter_items(paths, stride, self._skip):
+                items.put(item)
+        finally:
+            items.put(_DONE)
+
+    def _recognize(self, item_id, path, frame_number, image_bytes):
+        if image_bytes is None:
+            row = {'status': 'error', 'error': 'Could not decode image', 'matches': []}
+        else:
+            self.limiter.acquire()
+            row = self.engine.recognize_bytes(image_bytes, date=self.date, mark=False)
+            if self.mark and row['status'] == 'matched':
+                self._mark(row)
+        row.update({'item': item_id, 'source': path, 'frame': frame_number})
+
+        with self.lock:
+            self.writer.write(row)
+            # Errors are left out of the checkpoint so a resumed run retries them
+            if row['status'] != 'error':
+                self.checkpoint.add(item_id)
+            self.counts[row['status']] = self.counts.get(row['status'], 0) + 1
+            total = sum(self.counts.values())
+            if total % 100 == 0:
+                print("Processed {} items {}".format(total, self.counts), file=sys.stderr)
+
+    def _mark(self, row):
+        """Mark each matched person once per date, however many frames show them.
+
+        The engine's cooldown runs on wall-clock time, not footage time, so it
+        can't tell one sighting from the next while back-filling. People with a
+        row for the date before this run started (an interrupted run, say) are
+        not marked again.
+        """
+        date = self.date or datetime.now()
+        day = date.strftime('%Y-%m-%d')
+        for match in row['matches']:
+            key = (match['person_id'], day)
+            with self.lock:
+                if key in self.marked or match['name'] in self._present(date, day):
+                    continue
+                self.marked.add(key)
+            try:
+                match['date'], match['time'] = self.engine.attendance.mark(match['name'], date)
+                match['attendance'] = True
+            except Exception as e:
+                match['error'] = f"Error marking attendance: {str(e)}"
+                with self.lock:
+                    # Left for a later frame of the same person to retry
+                    self.marked.discard(key)
+
+    def _present(self, date, day):
+        if day not in self.present:
+            self.present[day] = {row['Name'] for row in self.engine.attendance.read(date)}
+        return self.present[day]
+
+    def run(self, paths, stride):
+        # Bounded so decoding stays only a little ahead of the API calls
+        items = queue.Queue(maxsize=self.workers * 4)
+        decoder = threading.Thread(target=self._decode, args=(paths, stride, items),
+                                   name='batch-decode', daemon=True)
+        decoder.start()
+
+        in_flight = threading.BoundedSemaphore(self.workers * 2)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while True:
+                item = items.get()
+                if item is _DONE:
+                    break
+                in_flight.acquire()
+                future = pool.submit(self._recognize, *item)
+                future.add_done_callback(lambda f: in_flight.release())
+        decoder.join()
+        return self.counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Batch face recognition over images and videos')
+    parser.add_argument('inputs', nargs='+', help='Directories, globs, image or video files')
+    parser.add_argument('--output', required=True, help='Results file (.jsonl or .csv)')
+    parser.add_argument('--checkpoint', help='Checkpoint file (default: <output>.checkpoint)')
+    parser.add_argument('--resume', action='store_true', help='Skip items completed by a previous run')
+    parser.add_argument('--stride', type=int, default=30, help='Use every Nth video frame')
+    parser.add_argument('--mark-attendance', action='store_true', help='Mark attendance for matches')
+    parser.add_argument('--date', help='Attendance date (YYYY-MM-DD) for back-filling')
+    config.add_arguments(parser, *ENGINE_SETTINGS, 'workers', 'rate', 'attendance_dir', 'attendance_table')
+    args = parser.parse_args()
+
+    cfg = config.from_args(args, *ENGINE_SETTINGS, 'workers', 'rate', 'attendance_dir', 'attendance_table')
+    cfg.configure_metrics()
+
+    paths = expand_inputs(args.inputs)
+    if not paths:
+        print("No images or videos found")
+        sys.exit(1)
+
+    checkpoint_path = args.checkpoint or args.output + '.checkpoint'
+    if not args.resume and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    # Adaptive retry mode backs off client-side when the service throttles
+    client_options = {
+        'retries': {'max_attempts': max(10, cfg.max_attempts), 'mode': 'adaptive'},
+        'max_pool_connections': max(cfg.max_pool_connections, cfg.workers),
+    }
+    engine = RecognitionEngine.from_config(
+        cfg,
+        cfg.client('rekognition', **client_options),
+        cfg.client('dynamodb', **client_options),
+        AttendanceStore.from_config(cfg) if args.mark_attendance else None,
+        resilient=False
+    )
+    date = datetime.strptime(args.date, '%Y-%m-%d') if args.date else None
+
+    checkpoint = Checkpoint(checkpoint_path)
+    writer = ResultWriter(args.output, append=args.resume)
+    runner = BatchRunner(engine, writer, checkpoint, cfg.workers, cfg.rate,
+                         args.mark_attendance, date)
+    try:
+        print("Processing {} files...".format(len(paths)), file=sys.stderr)
+        counts = runner.run(paths, max(1, args.stride))
+        print("Done: {} (skipped {} already processed)".format(counts, runner.skipped), file=sys.stderr)
+    except KeyboardInterrupt:
+        print("Interrupted; rerun with --resume to continue", file=sys.stderr)
+        sys.exit(130)
+    finally:
+        writer.close()
+        checkpoint.close()
+        if engine.attendance is not None:
+            engine.attendance.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,401 @@
+"""Recognition accuracy regression benchmark over the bundled fixtures.
+
+benchmarks.run measures how fast enrollment and recognition are; this checks
+they still recognize the right people. It enrolls one photo per identity
+with DirectEnroller, then recognizes every fixture through RecognitionEngine
+(the GUI and kiosk path: encode_frame, search, rank, policy, identity lookup).
+Each fixture is recognized as it is and after synthetic augmentations:
+blur, downscaling, rotation, JPEG recompression and sensor noise. Every
+result is scored against the fixture's label:
+
+    same-photo   the enrolled photo itself, augmented
+    other-photo  a different photo of an enrolled identity
+    impostor     an identity that was held out of the gallery
+
+The report gives accuracy, false accepts, false rejects and
+misidentifications per augmentation, next to throughput and latency. A
+change to the encode, crop or cache paths can then be checked for accuracy
+loss as well as speed:
+
+    python -m benchmarks.accuracy --output baseline.json
+    python -m benchmarks.accuracy --compare baseline.json --max-drop 2
+    python -m benchmarks.accuracy --target aws --bucket my-bucket --augment original blur-3 jpeg-15
+
+The stand-in scores similarity by image signature, so it tracks how much
+an augmentation or a change to frame encoding alters the bytes that are
+searched, and only recognizes the enrolled photo itself. Other photos of a
+person need a real face model: with --target aws, faces are enrolled into a
+scratch collection that is deleted afterwards, along with their identity
+records and archived images.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import cv2
+import numpy as np
+
+import config
+import normalize
+from benchmarks.fake_aws import FakeAWS, LatencyModel
+from benchmarks.run import BUCKET, ENROLLED, fixture, git_revision
+from benchmarks.stats import LatencyRecorder
+from engine import AttendanceStore, ConfidencePolicy, RecognitionEngine, TTLCache
+from enrollment import DirectEnroller, EnrollmentRejected
+from shards import ShardMap
+
+# image1-6 are three identities with two photos each
+LABELS = dict([(name, full_name) for name, full_name in ENROLLED] + [
+    ('image1.jpg', 'Fixture A'), ('image2.jpg', 'Fixture A'),
+    ('image3.jpg', 'Fixture B'), ('image4.jpg', 'Fixture B'),
+    ('image5.jpg', 'Fixture C'), ('image6.jpg', 'Fixture C'),
+])
+# The photo enrolled for each identity; the others are probes only
+GALLERY = [name for name, _ in ENROLLED] + ['image1.jpg', 'image3.jpg', 'image5.jpg']
+# Identities left out of the gallery, so their photos must not match anyone
+HOLDOUT = ['Fixture C']
+ARCHIVE_PREFIX = 'accuracy-bench/'
+
+
+def blur(sigma):
+    return lambda frame: cv2.GaussianBlur(frame, (0, 0), sigma)
+
+
+def scale(factor):
+    return lambda frame: cv2.resize(frame, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+
+
+def rotate(degrees):
+    def apply(frame):
+        height, width = frame.shape[:2]
+        matrix = cv2.getRotationMatrix2D((width / 2.0, height / 2.0), degrees, 1.0)
+        return cv2.warpAffine(frame, matrix, (width, height), borderMode=cv2.BORDER_REPLICATE)
+    return apply
+
+
+def jpeg(quality):
+    def apply(frame):
+        _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        return cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+    return apply
+
+
+def noise(sigma, seed=0):
+    def apply(frame):
+        # Seeded per frame size, so runs see the same noise
+        rng = np.random.default_rng(seed + frame.shape[0] * 31 + frame.shape[1])
+        noisy = frame.astype(np.float32) + rng.normal(0.0, sigma, frame.shape).astype(np.float32)
+        return np.clip(noisy, 0, 255).astype(np.uint8)
+    return apply
+
+
+AUGMENTATIONS = [
+    ('original', None),
+    ('blur-1.5', blur(1.5)),
+    ('blur-3', blur(3.0)),
+    ('scale-0.5', scale(0.5)),
+    ('scale-0.25', scale(0.25)),
+    ('rotate+10', rotate(10)),
+    ('rotate-20', rotate(-20)),
+    ('jpeg-40', jpeg(40)),
+    ('jpeg-15', jpeg(15)),
+    ('noise-8', noise(8.0)),
+]
+
+
+def image_bytes(path):
+    """Fixture bytes as DirectEnroller takes them, normalized if over the IndexFaces limits."""
+    with open(path, 'rb') as f:
+        body = f.read()
+    with io.BytesIO(body) as image:
+        if normalize.needs_normalization(image, len(body)):
+            return normalize.normalize_image(image)
+    return body
+
+
+def kind_of(name, enrolled):
+    label = LABELS[name]
+    if label not in enrolled:
+        return 'impostor'
+    return 'same-photo' if name in GALLERY else 'other-photo'
+
+
+def score(event, label, kind):
+    """Outcome of one recognition: correct, false_accept, false_reject, misidentified or error."""
+    status = event['status']
+    if status == 'error':
+        return 'error'
+    matched = event['matches'][0]['name'] if status == 'matched' and event['matches'] else None
+    if kind == 'impostor':
+        return 'false_accept' if matched else 'correct'
+    if matched is None:
+        return 'false_reject'
+    return 'correct' if matched == label else 'misidentified'
+
+
+def summarize(outcomes):
+    counts = Counter(outcomes)
+    total = len(outcomes)
+    scored = total - counts['error']
+    return {
+        'probes': total,
+        'accuracy': round(100.0 * counts['correct'] / scored, 2) if scored else 0.0,
+        'false_accept': counts['false_accept'],
+        'false_reject': counts['false_reject'],
+        'misidentified': counts['misidentified'],
+        'errors': counts['error'],
+    }
+
+
+class Bench:
+    def __init__(self, rekognition, dynamodb, s3, cfg, bucket, table, collection, workers=1):
+        """Enroll the gallery into `collection` and recognize augmented probes against it."""
+        self.rekognition = rekognition
+        self.dynamodb = dynamodb
+        self.s3 = s3
+        self.bucket = bucket
+        self.table = table
+        self.collection = collection
+        self.workers = max(1, workers)
+        self.enroller = DirectEnroller(
+            rekognition, dynamodb, s3, table, bucket, ShardMap(collection), cfg.quality_filter,
+            limits={'min_sharpness': cfg.min_sharpness, 'min_brightness': cfg.min_brightness,
+                    'max_yaw': cfg.max_yaw, 'max_pitch': cfg.max_pitch})
+        self.workdir = tempfile.mkdtemp(prefix='accuracy-')
+        self.engine = RecognitionEngine(
+            rekognition, dynamodb, AttendanceStore(self.workdir),
+            collection_id=collection, table_name=table, max_faces=cfg.max_faces,
+            policy=ConfidencePolicy(cfg.accept_threshold, cfg.reject_threshold, cfg.margin),
+            cache=TTLCache(cfg.name_cache_size, cfg.name_cache_ttl) if cfg.name_cache_size > 0 else None)
+        self.recorder = LatencyRecorder()
+        self.enrolled = {}  # FaceId -> archive key
+
+    def enroll(self, holdout):
+        """Enroll one photo per identity not held out; returns the enrolled labels."""
+        labels = set()
+        for name in GALLERY:
+            label = LABELS[name]
+            if label in holdout:
+                continue
+            try:
+                with self.recorder.measure('enroll'):
+                    face_id = self.enroller.enroll(image_bytes(fixture(name)), label, ARCHIVE_PREFIX + name)
+            except EnrollmentRejected as e:
+                print("Could not enroll {} as {}: {}".format(name, label, e))
+                continue
+            self.enrolled[face_id] = ARCHIVE_PREFIX + name
+            labels.add(label)
+        self.enroller.wait()
+        return labels
+
+    def probes(self, augmentations, enrolled):
+        frames = {name: cv2.imread(fixture(name)) for name in LABELS}
+        for augment_name, augment in augmentations:
+            for name, frame in sorted(frames.items()):
+                yield augment_name, name, kind_of(name, enrolled), augment(frame) if augment else frame
+
+    def recognize(self, probe):
+        augment_name, name, kind, frame = probe
+        try:
+            with self.recorder.measure('recognize'), self.recorder.measure('recognize:' + augment_name):
+                event = self.engine.recognize_frame(frame, mark=False)
+        except Exception as e:
+            event = {'status': 'error', 'error': str(e), 'matches': []}
+        return augment_name, name, kind, event
+
+    def run(self, augmentations, holdout):
+        enroll_started = time.perf_counter()
+        enrolled = self.enroll(holdout)
+        enroll_time = time.perf_counter() - enroll_started
+
+        probes = list(self.probes(augmentations, enrolled))
+        started = time.perf_counter()
+        if self.workers > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                results = list(pool.map(self.recognize, probes))
+        else:
+            results = [self.recognize(probe) for probe in probes]
+        wall_time = time.perf_counter() - started
+
+        outcomes = defaultdict(list)
+        failures = []
+        for augment_name, name, kind, event in results:
+            outcome = score(event, LABELS[name], kind)
+            for key in ('all', 'augment:' + augment_name, 'kind:' + kind):
+                outcomes[key].append(outcome)
+            if outcome != 'correct':
+                failures.append({'augment': augment_name, 'image': name, 'kind': kind, 'outcome': outcome,
+                                 'status': event['status'],
+                                 'matched': [m['name'] for m in event.get('matches', [])],
+                                 'error': event.get('error')})
+
+        report = {
+            'enrolled': sorted(enrolled),
+            'accuracy': summarize(outcomes['all']),
+            'by_augmentation': {},
+            'by_kind': {key[5:]: summarize(value) for key, value in sorted(outcomes.items())
+                        if key.startswith('kind:')},
+            'enroll': self.recorder.summary('enroll', enroll_time),
+            'recognize': self.recorder.summary('recognize', wall_time),
+            'failures': failures,
+        }
+        for augment_name, _ in augmentations:
+            summary = summarize(outcomes['augment:' + augment_name])
+            latency = self.recorder.summary('recognize:' + augment_name)
+            summary.update(p50_ms=latency['p50_ms'], p95_ms=latency['p95_ms'])
+            report['by_augmentation'][augment_name] = summary
+        return report
+
+    def cleanup(self, drop_collection):
+        """Remove what the run enrolled; the scratch collection too when `drop_collection`."""
+        for face_id, key in self.enrolled.items():
+            with contextlib.suppress(Exception):
+                self.dynamodb.delete_item(TableName=self.table, Key={'RekognitionId': {'S': face_id}})
+            with contextlib.suppress(Exception):
+                self.s3.delete_object(Bucket=self.bucket, Key=key)
+        if drop_collection:
+            with contextlib.suppress(Exception):
+                self.rekognition.delete_collection(CollectionId=self.collection)
+        self.engine.attendance.close()
+
+
+def print_report(report):
+    print("{:<12} {:>6} {:>9} {:>6} {:>6} {:>6} {:>5} {:>9} {:>9}".format(
+        'augment', 'probes', 'accuracy', 'FA', 'FR', 'misid', 'err', 'p50', 'p95'))
+    for name, row in report['by_augmentation'].items():
+        print("{:<12} {:>6} {:>8.1f}% {:>6} {:>6} {:>6} {:>5} {:>7.1f}ms {:>7.1f}ms".format(
+            name, row['probes'], row['accuracy'], row['false_accept'], row['false_reject'],
+            row['misidentified'], row['errors'], row['p50_ms'], row['p95_ms']))
+    for kind, row in report['by_kind'].items():
+        print("{:<12} {:>6} {:>8.1f}%".format(kind, row['probes'], row['accuracy']))
+    total, recognize = report['accuracy'], report['recognize']
+    print("\nAccuracy {:.1f}% over {} probes ({} false accepts, {} false rejects, {} misidentified)".format(
+        total['accuracy'], total['probes'], total['false_accept'], total['false_reject'], total['misidentified']))
+    print("Recognition {:.1f}/s  p50={:.2f}ms  p95={:.2f}ms  p99={:.2f}ms; enrollment p50={:.2f}ms".format(
+        recognize['throughput_per_s'], recognize['p50_ms'], recognize['p95_ms'], recognize['p99_ms'],
+        report['enroll']['p50_ms']))
+
+
+def compare(current, baseline, max_drop):
+    """Print accuracy changes against a previous run; False if any fell by more than `max_drop` points."""
+    print("\nChange vs {} ({})".format(baseline['meta']['revision'], baseline['meta']['timestamp']))
+    ok = True
+    rows = [(name, row, baseline.get('by_augmentation', {}).get(name))
+            for name, row in current['by_augmentation'].items()]
+    if baseline['meta'].get('augmentations') == current['meta']['augmentations']:
+        # Overall accuracy only compares like with like
+        rows.insert(0, ('all', current['accuracy'], baseline.get('accuracy')))
+    for name, row, old in rows:
+        if not old:
+            continue
+        change = round(row['accuracy'] - old['accuracy'], 2) + 0.0
+        flag = ''
+        if -change > max_drop:
+            ok = False
+            flag = '  REGRESSION'
+        print("{:<12} accuracy {:+.1f} pts{}".format(name, change, flag))
+    old = baseline.get('recognize', {})
+    if old.get('p50_ms'):
+        print("{:<12} p50 {:+.1f}%  throughput {:+.1f}%".format(
+            'recognize', (current['recognize']['p50_ms'] - old['p50_ms']) * 100.0 / old['p50_ms'],
+            (current['recognize']['throughput_per_s'] - old['throughput_per_s']) * 100.0
+            / old['throughput_per_s'] if old.get('throughput_per_s') else 0.0))
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recognition accuracy and throughput over augmented fixtures')
+    parser.add_argument('--target', choices=['fake', 'aws'], default='fake',
+                        help='Run against the in-process stand-in or the configured AWS account')
+    parser.add_argument('--augment', nargs='*', choices=[name for name, _ in AUGMENTATIONS],
+                        help='Augmentations to run (default: all)')
+    parser.add_argument('--holdout', nargs='*', default=HOLDOUT,
+                        help='Identities left out of the gallery and probed as impostors')
+    parser.add_argument('--workers', type=int, default=1, help='Concurrent recognitions')
+    parser.add_argument('--scratch-collection',
+                        help='Collection to enroll into and keep (default: a new <collection>-accuracy-<time>, '
+                             'deleted afterwards)')
+    parser.add_argument('--latency-scale', type=float, default=0.0,
+                        help='Multiplier for injected latency with --target fake')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for injected latency')
+    parser.add_argument('--output', help='Results JSON path (default: benchmarks/results/accuracy-<rev>-<time>.json)')
+    parser.add_argument('--compare', help='Previous results JSON to compare against')
+    parser.add_argument('--max-drop', type=float, default=0.0,
+                        help='With --compare, exit 1 if accuracy fell by more than this many points')
+    parser.add_argument('--verbose', action='store_true', help='Show output from the code under test')
+    settings = ('bucket', 'table', 'collection', 'accept_threshold', 'reject_threshold', 'margin', 'max_faces')
+    config.add_arguments(parser, *settings)
+    args = parser.parse_args()
+    try:
+        cfg = config.from_args(args, *settings)
+    except ValueError as e:
+        print(f"Configuration error: {str(e)}")
+        raise SystemExit(1)
+    if args.target == 'aws' and not cfg.bucket:
+        parser.error("--bucket (or FACE_RECOGNITION_BUCKET) is required with --target aws")
+
+    augmentations = [a for a in AUGMENTATIONS if not args.augment or a[0] in args.augment]
+    collection = args.scratch_collection or '{}-accuracy-{}'.format(
+        cfg.collection, datetime.now().strftime('%Y%m%d%H%M%S'))
+    if args.target == 'fake':
+        latency = LatencyModel(scale=args.latency_scale, seed=args.seed) if args.latency_scale > 0 else None
+        # No quotas: throttling is benchmarks.run's and replay's business, not accuracy's
+        fake = FakeAWS(latency=latency, tps_limits={}, seed=args.seed)
+        clients = fake.rekognition, fake.dynamodb, fake.s3
+        bucket = cfg.bucket or BUCKET
+    else:
+        clients = cfg.client('rekognition'), cfg.client('dynamodb'), cfg.client('s3')
+        bucket = cfg.bucket
+
+    bench = Bench(*clients, cfg, bucket, cfg.table, collection, args.workers)
+    print("Enrolling {} identities into {} and recognizing {} probes against {}".format(
+        len(set(LABELS[name] for name in GALLERY) - set(args.holdout)), collection,
+        len(LABELS) * len(augmentations), args.target))
+    quiet = io.StringIO() if not args.verbose else sys.stdout
+    try:
+        with contextlib.redirect_stdout(quiet):
+            report = bench.run(augmentations, set(args.holdout))
+    finally:
+        bench.cleanup(drop_collection=not args.scratch_collection)
+    print_report(report)
+
+    report['meta'] = {
+        'revision': git_revision(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'target': args.target,
+        'collection': collection,
+        'workers': args.workers,
+        'holdout': sorted(args.holdout),
+        'augmentations': [name for name, _ in augmentations],
+        'policy': {'accept': cfg.accept_threshold, 'reject': cfg.reject_threshold, 'margin': cfg.margin},
+    }
+    output = args.output
+    if not output:
+        results_dir = os.path.join(ROOT, 'benchmarks', 'results')
+        os.makedirs(results_dir, exist_ok=True)
+        output = os.path.join(results_dir, "accuracy-{}-{}.json".format(
+            report['meta']['revision'], datetime.now().strftime('%Y%m%d_%H%M%S')))
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print("\nResults written to {}".format(output))
+
+    if args.compare:
+        with open(args.compare) as f:
+            if not compare(report, json.load(f), args.max_drop):
+                raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
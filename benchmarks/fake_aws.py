@@ -0,0 +1,485 @@
+"""In-process stand-in for the S3, DynamoDB and Rekognition clients.
+
+The fakes implement only the calls this project makes, keep everything in
+memory and count every API call. Latency and throttling can be injected per
+operation so benchmarks see realistic service behaviour without touching AWS.
+"""
+import io
+import random
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+
+import boto3
+import numpy as np
+from botocore.exceptions import ClientError
+from PIL import Image
+
+import identity
+
+# Rough service-side latencies in milliseconds, measured from a kiosk in us-east-1
+DEFAULT_LATENCY_MS = {
+    'search_faces_by_image': 250,
+    'index_faces': 400,
+    'compare_faces': 300,
+    'detect_faces': 200,
+    'describe_collection': 40,
+    'delete_faces': 60,
+    'list_faces': 80,
+    'get_item': 8,
+    'put_item': 10,
+    'delete_item': 10,
+    'batch_write_item': 25,
+    'batch_get_item': 15,
+    'scan': 30,
+    'query': 12,
+    'describe_table': 20,
+    'upload_fileobj': 60,
+    'put_object': 50,
+    'get_object': 30,
+    'head_object': 15,
+    'list_objects_v2': 40,
+    'delete_object': 20,
+    'copy_object': 40,
+}
+
+# Default request-rate quotas (transactions per second) per operation
+DEFAULT_TPS_LIMITS = {
+    'search_faces_by_image': 50,
+    'index_faces': 50,
+    'compare_faces': 50,
+    'detect_faces': 50,
+}
+
+SIGNATURE_SIZE = 16
+
+
+def image_signature(image_bytes):
+    """Return a perceptual hash of the image, or None if it cannot be decoded.
+
+    The hash is a 16x16 average hash of the grayscale image. It survives
+    re-encoding and mild resizing, which is what a real face embedding would
+    also shrug off, so it is a fair stand-in for matching.
+    """
+    try:
+        image = Image.open(io.BytesIO(bytes(image_bytes))).convert('L')
+    except Exception:
+        return None
+    pixels = np.asarray(image.resize((SIGNATURE_SIZE, SIGNATURE_SIZE)), dtype=np.float32)
+    # A flat image has no face in it as far as the fake is concerned
+    if pixels.std() < 2.0:
+        return None
+    return pixels > pixels.mean()
+
+
+def similarity(sig_a, sig_b):
+    """Percentage of matching bits between two signatures."""
+    return float(np.count_nonzero(sig_a == sig_b)) * 100.0 / sig_a.size
+
+
+class LatencyModel:
+    def __init__(self, latency_ms=None, scale=1.0, jitter=0.25, seed=None):
+        """Per-operation latency with log-normal jitter, scaled by `scale`."""
+        self.latency_ms = dict(DEFAULT_LATENCY_MS)
+        if latency_ms:
+            self.latency_ms.update(latency_ms)
+        self.scale = scale
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def delay(self, operation):
+        base = self.latency_ms.get(operation, 10) * self.scale
+        if base <= 0:
+            return 0.0
+        with self.lock:
+            factor = self.random.lognormvariate(0, self.jitter)
+        return base * factor / 1000.0
+
+
+class FakeAWS:
+    def __init__(self, latency=None, throttle_rate=0.0, tps_limits=None, seed=0):
+        """Shared state and call accounting for the fake clients.
+
+        latency:       LatencyModel, or None for no injected latency
+        throttle_rate: probability that any call fails with ThrottlingException
+        tps_limits:    per-operation requests/second quota; calls above it throttle
+        """
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.tps_limits = DEFAULT_TPS_LIMITS if tps_limits is None else tps_limits
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.throttled = Counter()
+        self.windows = defaultdict(deque)
+
+        self.s3 = FakeS3(self)
+        self.dynamodb = FakeDynamoDB(self)
+        self.rekognition = FakeRekognition(self)
+
+    def client(self, service_name, *args, **kwargs):
+        return getattr(self, service_name)
+
+    def call(self, operation, error_factory=None):
+        """Account for one API call, then apply throttling and latency."""
+        now = time.monotonic()
+        with self.lock:
+            self.calls[operation] += 1
+            throttle = self.random.random() < self.throttle_rate
+            limit = self.tps_limits.get(operation)
+            if limit:
+                window = self.windows[operation]
+                while window and now - window[0] >= 1.0:
+                    window.popleft()
+                if len(window) >= limit:
+                    throttle = True
+                else:
+                    window.append(now)
+            if throttle:
+                self.throttled[operation] += 1
+
+        if self.latency is not None:
+            time.sleep(self.latency.delay(operation))
+
+        if throttle:
+            factory = error_factory or ClientError
+            raise factory(
+                {'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'},
+                 'ResponseMetadata': {'HTTPStatusCode': 400}},
+                operation
+            )
+
+    def snapshot(self):
+        with self.lock:
+            return Counter(self.calls)
+
+    @contextmanager
+    def patched(self):
+        """Route boto3.client() and boto3.Session().client() to the fakes."""
+        fake = self
+
+        class FakeSession:
+            def __init__(self, *args, **kwargs):
+                pass
+
+            def client(self, service_name, *args, **kwargs):
+                return fake.client(service_name)
+
+            def resource(self, *args, **kwargs):
+                raise NotImplementedError("FakeAWS only provides clients")
+
+        original_client = boto3.client
+        original_session = boto3.Session
+        boto3.client = fake.client
+        boto3.Session = FakeSession
+        try:
+            yield self
+        finally:
+            boto3.client = original_client
+            boto3.Session = original_session
+
+    def seed_gallery(self, collection_id, table_name, people):
+        """Index (image_path, full_name) pairs without counting API calls."""
+        face_ids = {}
+        for image_path, full_name in people:
+            person_id = identity.person_id(full_name)
+            with open(image_path, 'rb') as f:
+                face_id = self.rekognition.add_face(collection_id, f.read(), person_id)
+            self.dynamodb.table(table_name)[face_id] = {
+                'RekognitionId': {'S': face_id},
+                'FullName': {'S': full_name},
+                'PersonId': {'S': person_id}
+            }
+            face_ids[face_id] = full_name
+        return face_ids
+
+
+def _error_class(name):
+    return type(name, (ClientError,), {})
+
+
+def _client_error(cls, code, message, operation):
+    return cls(
+        {'Error': {'Code': code, 'Message': message},
+         'ResponseMetadata': {'HTTPStatusCode': 400}},
+        operation
+    )
+
+
+def _ok(**fields):
+    fields['ResponseMetadata'] = {'HTTPStatusCode': 200}
+    return fields
+
+
+class _Exceptions:
+    def __init__(self, *names):
+        for name in names:
+            setattr(self, name, _error_class(name))
+
+
+class FakeS3:
+    def __init__(self, aws):
+        self.aws = aws
+        self.objects = {}
+        self.exceptions = _Exceptions('NoSuchKey', 'NoSuchBucket')
+
+    def _store(self, bucket, key, body, metadata):
+        # S3 lower-cases user metadata keys
+        metadata = {k.lower(): v for k, v in (metadata or {}).items()}
+        self.objects[(bucket, key)] = (bytes(body), metadata)
+
+    def _get(self, bucket, key, operation):
+        try:
+            return self.objects[(bucket, key)]
+        except KeyError:
+            raise _client_error(self.exceptions.NoSuchKey, 'NoSuchKey',
+                                'The specified key does not exist.', operation)
+
+    def upload_fileobj(self, fileobj, bucket, key, ExtraArgs=None):
+        self.aws.call('upload_fileobj')
+        extra = ExtraArgs or {}
+        self._store(bucket, key, fileobj.read(), extra.get('Metadata'))
+
+    def put_object(self, Bucket, Key, Body=b'', Metadata=None, **kwargs):
+        self.aws.call('put_object')
+        if hasattr(Body, 'read'):
+            Body = Body.read()
+        self._store(Bucket, Key, Body, Metadata)
+        return _ok(ETag=uuid.uuid4().hex)
+
+    def head_object(self, Bucket, Key):
+        self.aws.call('head_object')
+        body, metadata = self._get(Bucket, Key, 'HeadObject')
+        return _ok(ContentLength=len(body), Metadata=dict(metadata))
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self.aws.call('get_object')
+        body, metadata = self._get(Bucket, Key, 'GetObject')
+        return _ok(Body=io.BytesIO(body), ContentLength=len(body), Metadata=dict(metadata))
+
+    def delete_object(self, Bucket, Key):
+        self.aws.call('delete_object')
+        self.objects.pop((Bucket, Key), None)
+        return _ok()
+
+    def copy_object(self, Bucket, Key, CopySource, **kwargs):
+        self.aws.call('copy_object')
+        body, metadata = self._get(CopySource['Bucket'], CopySource['Key'], 'CopyObject')
+        if kwargs.get('MetadataDirective') == 'REPLACE':
+            metadata = kwargs.get('Metadata')
+        self._store(Bucket, Key, body, metadata)
+        return _ok()
+
+    def list_objects_v2(self, Bucket, Prefix='', MaxKeys=1000, ContinuationToken=None, StartAfter='', **kwargs):
+        self.aws.call('list_objects_v2')
+        keys = sorted(k for b, k in self.objects if b == Bucket and k.startswith(Prefix) and k > StartAfter)
+        start = int(ContinuationToken) if ContinuationToken else 0
+        page = keys[start:start + MaxKeys]
+        response = _ok(
+            KeyCount=len(page),
+            Contents=[{'Key': k, 'Size': len(self.objects[(Bucket, k)][0])} for k in page],
+            IsTruncated=start + MaxKeys < len(keys)
+        )
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = str(start + MaxKeys)
+        return response
+
+
+class FakeDynamoDB:
+    def __init__(self, aws):
+        self.aws = aws
+        self.tables = defaultdict(dict)
+        self.exceptions = _Exceptions('ResourceNotFoundException',
+                                      'ProvisionedThroughputExceededException',
+                                      'ConditionalCheckFailedException')
+
+    def table(self, name):
+        return self.tables[name]
+
+    @staticmethod
+    def _key(key):
+        # Composite keys are flattened into a tuple in attribute-name order
+        values = tuple(list(key[name].values())[0] for name in sorted(key))
+        return values[0] if len(values) == 1 else values
+
+    @staticmethod
+    def _key_of(item, key_names):
+        return FakeDynamoDB._key({name: item[name] for name in key_names})
+
+    def _throttle(self, operation):
+        self.aws.call(operation, self.exceptions.ProvisionedThroughputExceededException)
+
+    def describe_table(self, TableName):
+        self.aws.call('describe_table')
+        return _ok(Table={'TableName': TableName, 'ItemCount': len(self.tables[TableName])})
+
+    def put_item(self, TableName, Item, **kwargs):
+        self._throttle('put_item')
+        # Items in this project always lead with their hash key
+        self.tables[TableName][self._key_of(Item, [next(iter(Item))])] = Item
+        return _ok()
+
+    def get_item(self, TableName, Key, **kwargs):
+        self._throttle('get_item')
+        item = self.tables[TableName].get(self._key(Key))
+        return _ok(Item=item) if item is not None else _ok()
+
+    def delete_item(self, TableName, Key, **kwargs):
+        self._throttle('delete_item')
+        self.tables[TableName].pop(self._key(Key), None)
+        return _ok()
+
+    def scan(self, TableName, Limit=None, ExclusiveStartKey=None, **kwargs):
+        self._throttle('scan')
+        items = list(self.tables[TableName].values())
+        start = ExclusiveStartKey['_offset'] if ExclusiveStartKey else 0
+        end = len(items) if Limit is None else start + Limit
+        response = _ok(Items=items[start:end], Count=len(items[start:end]))
+        if end < len(items):
+            response['LastEvaluatedKey'] = {'_offset': end}
+        return response
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        self._throttle('batch_write_item')
+        for table_name, requests in RequestItems.items():
+            for request in requests:
+                if 'PutRequest' in request:
+                    item = request['PutRequest']['Item']
+                    self.tables[table_name][self._key_of(item, [next(iter(item))])] = item
+                elif 'DeleteRequest' in request:
+                    self.tables[table_name].pop(self._key(request['DeleteRequest']['Key']), None)
+        return _ok(UnprocessedItems={})
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        self._throttle('batch_get_item')
+        responses = {}
+        for table_name, request in RequestItems.items():
+            table = self.tables[table_name]
+            found = [table.get(self._key(key)) for key in request['Keys']]
+            responses[table_name] = [item for item in found if item is not None]
+        return _ok(Responses=responses, UnprocessedKeys={})
+
+
+class FakeRekognition:
+    def __init__(self, aws):
+        self.aws = aws
+        self.collections = defaultdict(dict)
+        self.lock = threading.Lock()
+        self.exceptions = _Exceptions('InvalidParameterException',
+                                      'ResourceNotFoundException',
+                                      'ResourceAlreadyExistsException',
+                                      'ThrottlingException',
+                                      'ProvisionedThroughputExceededException')
+
+    def _throttle(self, operation):
+        self.aws.call(operation, self.exceptions.ThrottlingException)
+
+    def _image_bytes(self, image):
+        if 'Bytes' in image:
+            return image['Bytes']
+        s3_object = image['S3Object']
+        return self.aws.s3.objects[(s3_object['Bucket'], s3_object['Name'])][0]
+
+    def _signature(self, image, operation):
+        signature = image_signature(self._image_bytes(image))
+        if signature is None:
+            raise _client_error(self.exceptions.InvalidParameterException,
+                                'InvalidParameterException',
+                                'There are no faces in the image. Should be at least 1.',
+                                operation)
+        return signature
+
+    def add_face(self, collection_id, image_bytes, external_id=None):
+        signature = image_signature(image_bytes)
+        if signature is None:
+            raise ValueError("No face found in {}".format(external_id))
+        face_id = str(uuid.uuid4())
+        with self.lock:
+            self.collections[collection_id][face_id] = (signature, external_id)
+        return face_id
+
+    def create_collection(self, CollectionId):
+        self._throttle('create_collection')
+        with self.lock:
+            if CollectionId in self.collections:
+                raise _client_error(self.exceptions.ResourceAlreadyExistsException,
+                                    'ResourceAlreadyExistsException',
+                                    'The collection already exists.', 'CreateCollection')
+            self.collections[CollectionId] = {}
+        return _ok(StatusCode=200, CollectionArn='aws:rekognition:fake:collection/' + CollectionId)
+
+    def describe_collection(self, CollectionId):
+        self._throttle('describe_collection')
+        return _ok(FaceCount=len(self.collections[CollectionId]), FaceModelVersion='7.0')
+
+    def index_faces(self, CollectionId, Image, ExternalImageId=None, **kwargs):
+        self._throttle('index_faces')
+        signature = image_signature(self._image_bytes(Image))
+        if signature is None:
+            return _ok(FaceRecords=[], UnindexedFaces=[], FaceModelVersion='7.0')
+        face_id = str(uuid.uuid4())
+        with self.lock:
+            self.collections[CollectionId][face_id] = (signature, ExternalImageId)
+        face = {
+            'FaceId': face_id,
+            'ImageId': str(uuid.uuid4()),
+            'BoundingBox': {'Width': 0.5, 'Height': 0.5, 'Left': 0.25, 'Top': 0.25},
+            'Confidence': 99.9
+        }
+        if ExternalImageId:
+            face['ExternalImageId'] = ExternalImageId
+        return _ok(
+            FaceRecords=[{'Face': face, 'FaceDetail': {'Confidence': 99.9}}],
+            UnindexedFaces=[],
+            FaceModelVersion='7.0'
+        )
+
+    def search_faces_by_image(self, CollectionId, Image, MaxFaces=80, FaceMatchThreshold=80, **kwargs):
+        self._throttle('search_faces_by_image')
+        signature = self._signature(Image, 'SearchFacesByImage')
+        with self.lock:
+            faces = list(self.collections[CollectionId].items())
+        matches = []
+        for face_id, (stored, external_id) in faces:
+            score = similarity(signature, stored)
+            if score >= FaceMatchThreshold:
+                face = {'FaceId': face_id, 'Confidence': 99.9}
+                if external_id:
+                    face['ExternalImageId'] = external_id
+                matches.append({'Similarity': score, 'Face': face})
+        matches.sort(key=lambda m: m['Similarity'], reverse=True)
+        return _ok(
+            SearchedFaceBoundingBox={'Width': 0.5, 'Height': 0.5, 'Left': 0.25, 'Top': 0.25},
+            SearchedFaceConfidence=99.9,
+            FaceMatches=matches[:MaxFaces],
+            FaceModelVersion='7.0'
+        )
+
+    def compare_faces(self, SourceImage, TargetImage, SimilarityThreshold=80, **kwargs):
+        self._throttle('compare_faces')
+        source = self._signature(SourceImage, 'CompareFaces')
+        target = image_signature(self._image_bytes(TargetImage))
+        matches, unmatched = [], []
+        if target is not None:
+            score = similarity(source, target)
+            face = {'BoundingBox': {'Width': 0.5, 'Height': 0.5, 'Left': 0.25, 'Top': 0.25},
+                    'Confidence': 99.9}
+            if score >= SimilarityThreshold:
+                matches.append({'Similarity': score, 'Face': face})
+            else:
+                unmatched.append(face)
+        return _ok(
+            SourceImageFace={'BoundingBox': {'Width': 0.5, 'Height': 0.5, 'Left': 0.25, 'Top': 0.25},
+                             'Confidence': 99.9},
+            FaceMatches=matches,
+            UnmatchedFaces=unmatched
+        )
+
+    def delete_faces(self, CollectionId, FaceIds):
+        self._throttle('delete_faces')
+        with self.lock:
+            deleted = [f for f in FaceIds if self.collections[CollectionId].pop(f, None)]
+        return _ok(DeletedFaces=deleted)
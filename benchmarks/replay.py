@@ -0,0 +1,293 @@
+"""Open-loop replay of recorded recognition/enrollment traffic.
+
+A trace is a JSONL file with one request per line:
+
+    {"ts": 0.0, "op": "recognize", "image": "image1.jpg"}
+    {"ts": 0.4, "op": "enroll", "image": "rajiv.jpg", "name": "Rajiv Upadhyay"}
+
+`ts` is seconds from the start of the trace (an ISO timestamp also works).
+Requests are dispatched at their scheduled time regardless of how many are
+still in flight, so a slow service shows up as queueing delay instead of a
+quietly reduced arrival rate. Latency is measured from the scheduled time.
+
+    python -m benchmarks.replay generate --pattern monday --duration 120 -o monday.jsonl
+    python -m benchmarks.replay run monday.jsonl --rate 2 --workers 16
+    python -m benchmarks.replay run monday.jsonl --target aws --bucket my-bucket
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.fake_aws import FakeAWS, LatencyModel
+from benchmarks.run import BUCKET, ENROLLED, PROBES, fixture, git_revision, load_modules
+from benchmarks.stats import Histogram, LatencyRecorder
+
+
+def parse_ts(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(value).timestamp()
+
+
+def load_trace(path):
+    """Read a JSONL trace, returning requests sorted by offset from the first one."""
+    requests = []
+    with open(path, encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+                requests.append({
+                    'ts': parse_ts(entry['ts']),
+                    'op': entry.get('op', 'recognize'),
+                    'image': entry['image'],
+                    'name': entry.get('name'),
+                })
+            except (ValueError, KeyError) as e:
+                raise ValueError("{}:{}: invalid trace entry ({})".format(path, line_no, e))
+    requests.sort(key=lambda r: r['ts'])
+    if requests:
+        start = requests[0]['ts']
+        for request in requests:
+            request['ts'] -= start
+    return requests
+
+
+def generate_trace(pattern, duration, base_rate, peak_rate, seed):
+    """Synthesize a trace as a Poisson process with a time-varying rate.
+
+    'steady' keeps base_rate throughout. 'monday' models a check-in spike:
+    the rate ramps to peak_rate over the first quarter, holds for a quarter,
+    then decays back to base_rate.
+    """
+    rng = random.Random(seed)
+    people = dict(ENROLLED)
+
+    def rate_at(t):
+        if pattern == 'steady':
+            return base_rate
+        phase = t / duration
+        if phase < 0.25:
+            return base_rate + (peak_rate - base_rate) * phase / 0.25
+        if phase < 0.5:
+            return peak_rate
+        return peak_rate - (peak_rate - base_rate) * min(1.0, (phase - 0.5) / 0.25)
+
+    # Thinning: draw at the peak rate and keep each arrival with p = rate(t)/peak
+    ceiling = max(base_rate, peak_rate)
+    t = 0.0
+    trace = []
+    while True:
+        t += rng.expovariate(ceiling)
+        if t >= duration:
+            break
+        if rng.random() > rate_at(t) / ceiling:
+            continue
+        # Roughly one enrollment per hundred check-ins
+        if rng.random() < 0.01:
+            image = rng.choice(list(people))
+            trace.append({'ts': round(t, 4), 'op': 'enroll', 'image': image, 'name': people[image]})
+        else:
+            trace.append({'ts': round(t, 4), 'op': 'recognize', 'image': rng.choice(PROBES)})
+    return trace
+
+
+class Replayer:
+    def __init__(self, modules, rekognition, dynamodb, bucket, workers):
+        self.cli = modules['test']
+        self.system = modules['main'].FaceRecognitionSystem(bucket)
+        self.rekognition = rekognition
+        self.dynamodb = dynamodb
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.recorder = LatencyRecorder()
+        self.histograms = {}
+        self.service = LatencyRecorder()
+        self.lock = threading.Lock()
+        self.max_in_flight = 0
+        self.in_flight = 0
+
+    def resolve(self, image):
+        return image if os.path.isabs(image) else fixture(image)
+
+    def execute(self, request):
+        path = self.resolve(request['image'])
+        if request['op'] == 'recognize':
+            self.cli.recognize(self.cli.load_image_bytes(path), self.rekognition, self.dynamodb)
+        elif request['op'] == 'enroll':
+            if self.system.upload_face(path, request['name'] or os.path.basename(path)) is False:
+                raise RuntimeError("upload failed")
+        else:
+            raise ValueError("Unknown operation: {}".format(request['op']))
+
+    def handle(self, request, scheduled):
+        op = request['op']
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            with self.service.measure(op):
+                self.execute(request)
+        except Exception:
+            with self.recorder.lock:
+                self.recorder.errors[op] += 1
+            return
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+        finished = time.perf_counter()
+        with self.recorder.lock:
+            self.recorder.durations[op].append(finished - scheduled)
+        self.histograms[op].record(finished - scheduled)
+
+    def replay(self, trace, rate):
+        """Dispatch every request at ts / rate, open-loop."""
+        for op in set(r['op'] for r in trace):
+            self.histograms[op] = Histogram()
+        max_lag = 0.0
+        start = time.perf_counter()
+        for request in trace:
+            scheduled = start + request['ts'] / rate
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            max_lag = max(max_lag, time.perf_counter() - scheduled)
+            self.pool.submit(self.handle, request, scheduled)
+        self.pool.shutdown(wait=True)
+        return time.perf_counter() - start, max_lag
+
+
+def run(args):
+    trace = load_trace(args.trace)
+    if args.limit:
+        trace = trace[:args.limit]
+    if not trace:
+        print("Trace is empty")
+        return None
+
+    if args.target == 'fake':
+        latency = LatencyModel(scale=args.latency_scale, seed=args.seed) if args.latency_scale > 0 else None
+        fake = FakeAWS(latency=latency, throttle_rate=args.throttle_rate, seed=args.seed)
+        fake.seed_gallery('facerecognition_collection', 'facerecognition',
+                          [(fixture(name), full_name) for name, full_name in ENROLLED])
+        modules = load_modules(fake)
+        rekognition, dynamodb = fake.rekognition, fake.dynamodb
+        bucket = args.bucket or BUCKET
+    else:
+        fake = None
+        modules = load_modules()
+        cli = modules['test']
+        rekognition, dynamodb = cli.rekognition, cli.dynamodb
+        bucket = args.bucket
+
+    with fake.patched() if fake else contextlib.nullcontext():
+        replayer = Replayer(modules, rekognition, dynamodb, bucket, args.workers)
+    span = trace[-1]['ts'] / args.rate
+    print("Replaying {} requests over {:.1f}s ({}x) against {}".format(
+        len(trace), span, args.rate, args.target))
+
+    before = fake.snapshot() if fake else None
+    quiet = io.StringIO() if not args.verbose else sys.stdout
+    patch = fake.patched() if fake else contextlib.nullcontext()
+    with patch, contextlib.redirect_stdout(quiet):
+        wall_time, max_lag = replayer.replay(trace, args.rate)
+
+    operations = {}
+    for op in sorted(replayer.histograms):
+        summary = replayer.recorder.summary(op, wall_time)
+        summary['service_time'] = replayer.service.summary(op, wall_time)
+        summary['histogram_ms'] = replayer.histograms[op].buckets()
+        operations[op] = summary
+        print("{:<10} n={:<6} err={:<5} ({:5.1%})  p50={:>9.2f}ms  p95={:>9.2f}ms  p99={:>9.2f}ms".format(
+            op, summary['count'], summary['errors'], summary['error_rate'],
+            summary['p50_ms'], summary['p95_ms'], summary['p99_ms']))
+
+    print("Offered {:.2f} req/s, completed in {:.1f}s, max in flight {}, max dispatch lag {:.1f}ms".format(
+        len(trace) / span if span else float('inf'), wall_time,
+        replayer.max_in_flight, max_lag * 1000.0))
+
+    return {
+        'meta': {
+            'revision': git_revision(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'trace': os.path.abspath(args.trace),
+            'requests': len(trace),
+            'rate': args.rate,
+            'workers': args.workers,
+            'target': args.target,
+            'latency_scale': args.latency_scale,
+            'throttle_rate': args.throttle_rate,
+        },
+        'wall_time_s': round(wall_time, 3),
+        'max_in_flight': replayer.max_in_flight,
+        'max_dispatch_lag_ms': round(max_lag * 1000.0, 3),
+        'operations': operations,
+        'api_calls': dict(fake.snapshot() - before) if fake else {},
+        'throttled': dict(fake.throttled) if fake else {},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay recognition traffic from a JSONL trace')
+    subparsers = parser.add_subparsers(dest='command', help='Commands')
+
+    run_parser = subparsers.add_parser('run', help='Replay a trace')
+    run_parser.add_argument('trace', help='Path to the JSONL trace')
+    run_parser.add_argument('--rate', type=float, default=1.0, help='Replay speed multiplier (2 = twice as fast)')
+    run_parser.add_argument('--workers', type=int, default=8, help='Worker pool size')
+    run_parser.add_argument('--limit', type=int, help='Only replay the first N requests')
+    run_parser.add_argument('--target', choices=['fake', 'aws'], default='fake',
+                            help='Replay against the in-process stand-in or real AWS')
+    run_parser.add_argument('--bucket', help='S3 bucket for enroll requests')
+    run_parser.add_argument('--latency-scale', type=float, default=1.0,
+                            help='Multiplier for injected latency with --target fake')
+    run_parser.add_argument('--throttle-rate', type=float, default=0.0,
+                            help='Probability that a call is throttled with --target fake')
+    run_parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    run_parser.add_argument('--output', help='Write results JSON to this path')
+    run_parser.add_argument('--verbose', action='store_true', help='Show output from the code under test')
+
+    gen_parser = subparsers.add_parser('generate', help='Synthesize a trace')
+    gen_parser.add_argument('--pattern', choices=['steady', 'monday'], default='monday')
+    gen_parser.add_argument('--duration', type=float, default=300.0, help='Trace length in seconds')
+    gen_parser.add_argument('--base-rate', type=float, default=0.5, help='Requests/second outside the spike')
+    gen_parser.add_argument('--peak-rate', type=float, default=10.0, help='Requests/second at the peak')
+    gen_parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    gen_parser.add_argument('-o', '--output', required=True, help='Trace path to write')
+
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        trace = generate_trace(args.pattern, args.duration, args.base_rate, args.peak_rate, args.seed)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            for entry in trace:
+                f.write(json.dumps(entry) + "\n")
+        print("Wrote {} requests to {}".format(len(trace), args.output))
+    elif args.command == 'run':
+        if args.target == 'aws' and not args.bucket and not os.getenv('FACE_RECOGNITION_BUCKET'):
+            parser.error("--bucket (or FACE_RECOGNITION_BUCKET) is required with --target aws")
+        args.bucket = args.bucket or os.getenv('FACE_RECOGNITION_BUCKET')
+        results = run(args)
+        if results and args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+            print("Results written to {}".format(args.output))
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
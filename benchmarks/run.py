@@ -0,0 +1,284 @@
+"""Offline benchmark harness for the enrollment and recognition paths.
+
+Runs every entry point against the in-process AWS stand-in in fake_aws.py
+using the bundled image fixtures, and writes throughput, latency percentiles
+and API call counts per operation to a JSON file.
+
+    python -m benchmarks.run --iterations 5 --workers 4
+    python -m benchmarks.run --latency-scale 0 --output baseline.json
+    python -m benchmarks.run --compare baseline.json
+"""
+import argparse
+import contextlib
+import importlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import cv2
+
+from benchmarks.fake_aws import FakeAWS, LatencyModel
+from benchmarks.stats import LatencyRecorder
+
+BUCKET = 'bench-bucket'
+
+# Fixtures with a known identity, named as in putimages.py
+ENROLLED = [
+    ('rajiv.jpg', 'Rajiv Upadhyay'),
+    ('vishal.jpg', 'Vishal Dubey'),
+    ('amitesh.jpg', 'Amitesh Yadav'),
+]
+PROBES = [name for name, _ in ENROLLED] + ['image{}.jpg'.format(i) for i in range(1, 7)]
+
+
+def fixture(name):
+    return os.path.join(ROOT, name)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return 'unknown'
+
+
+def load_module(name, filename):
+    """Import a top-level script by path (test.py would clash with the stdlib package)."""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_modules(fake=None):
+    """Import the entry points, wiring their module-level clients to `fake` if given."""
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    patch = fake.patched() if fake is not None else contextlib.nullcontext()
+    with patch:
+        modules = {
+            'main': importlib.import_module('main'),
+            'lamdafunction': importlib.import_module('lamdafunction'),
+            'test': load_module('recognize_cli', 'test.py'),
+        }
+    if fake is not None:
+        # Modules may have been imported before patching; point them at the fakes
+        for module in modules.values():
+            for service in ('s3', 'dynamodb', 'rekognition'):
+                if hasattr(module, service):
+                    setattr(module, service, fake.client(service))
+    return modules
+
+
+def checked(fn):
+    """Treat a False return (the repo's error convention) as a failure."""
+    def run():
+        if fn() is False:
+            raise RuntimeError("operation reported failure")
+    return run
+
+
+# --------------- Scenarios ------------------
+# Each scenario returns the list of work items for one iteration.
+
+def scenario_upload(fake, modules, workdir):
+    system = modules['main'].FaceRecognitionSystem(BUCKET)
+    return [checked(lambda p=fixture(name), n=full_name: system.upload_face(p, n))
+            for name, full_name in ENROLLED]
+
+
+def scenario_list(fake, modules, workdir):
+    system = modules['main'].FaceRecognitionSystem(BUCKET)
+    return [checked(system.list_faces)]
+
+
+def scenario_lambda(fake, modules, workdir):
+    handler = modules['lamdafunction'].lambda_handler
+
+    def invoke(key):
+        event = {'Records': [{'s3': {'bucket': {'name': BUCKET}, 'object': {'key': key}}}]}
+        return lambda: handler(event, None)
+
+    return [invoke(name) for name, _ in ENROLLED]
+
+
+def scenario_lambda_sqs(fake, modules, workdir):
+    lamdafunction = modules['lamdafunction']
+    event = lamdafunction.make_sqs_event(BUCKET, [name for name, _ in ENROLLED])
+
+    def invoke():
+        result = lamdafunction.lambda_handler(event, None)
+        if result['batchItemFailures']:
+            raise RuntimeError("{} messages failed".format(len(result['batchItemFailures'])))
+
+    return [invoke]
+
+
+def scenario_recognize_cli(fake, modules, workdir):
+    cli = modules['test']
+
+    def recognize(path):
+        return lambda: cli.recognize(cli.load_image_bytes(path), fake.rekognition, fake.dynamodb)
+
+    return [recognize(fixture(name)) for name in PROBES]
+
+
+def scenario_recognize_gui(fake, modules, workdir):
+    # The GUI and the kiosk daemon both recognize through RecognitionEngine
+    from engine import AttendanceStore, RecognitionEngine
+    engine = RecognitionEngine(fake.rekognition, fake.dynamodb, AttendanceStore(workdir))
+    frames = [cv2.imread(fixture(name)) for name in PROBES]
+
+    def recognize(frame):
+        def run():
+            result = engine.recognize_frame(frame)
+            if result['status'] == 'error':
+                raise RuntimeError(result['error'])
+        return run
+
+    return [recognize(frame) for frame in frames]
+
+
+SCENARIOS = [
+    ('upload_face', scenario_upload),
+    ('lambda_handler', scenario_lambda),
+    ('lambda_handler_sqs_batch', scenario_lambda_sqs),
+    ('list_faces', scenario_list),
+    ('recognize_cli', scenario_recognize_cli),
+    ('recognize_gui', scenario_recognize_gui),
+]
+
+
+def run_scenario(name, items, recorder, workers):
+    """Run the work items, returning wall time in seconds."""
+    def timed(item):
+        try:
+            with recorder.measure(name):
+                item()
+        except Exception:
+            pass
+
+    start = time.perf_counter()
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(timed, items))
+    else:
+        for item in items:
+            timed(item)
+    return time.perf_counter() - start
+
+
+def run(args):
+    latency = None
+    if args.latency_scale > 0:
+        latency = LatencyModel(scale=args.latency_scale, seed=args.seed)
+    fake = FakeAWS(latency=latency, throttle_rate=args.throttle_rate, seed=args.seed)
+
+    # Seed the collection the recognition paths search
+    fake.seed_gallery('facerecognition_collection', 'facerecognition',
+                      [(fixture(name), full_name) for name, full_name in ENROLLED])
+
+    modules = load_modules(fake)
+    recorder = LatencyRecorder()
+    selected = [s for s in SCENARIOS if not args.only or s[0] in args.only]
+    operations = {}
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, build in selected:
+            wall_time = 0.0
+            before = fake.snapshot()
+            count = 0
+            quiet = io.StringIO() if not args.verbose else sys.stdout
+            with fake.patched(), contextlib.redirect_stdout(quiet):
+                for _ in range(args.iterations):
+                    items = build(fake, modules, workdir)
+                    count += len(items)
+                    wall_time += run_scenario(name, items, recorder, args.workers)
+            calls = fake.snapshot() - before
+            summary = recorder.summary(name, wall_time)
+            summary['api_calls'] = dict(sorted(calls.items()))
+            summary['api_calls_per_op'] = {
+                op: round(n / float(count), 3) for op, n in sorted(calls.items())
+            } if count else {}
+            operations[name] = summary
+            print("{:<26} n={:<5} err={:<3} {:>9.1f}/s  p50={:>8.2f}ms  p95={:>8.2f}ms  p99={:>8.2f}ms".format(
+                name, summary['count'], summary['errors'], summary['throughput_per_s'],
+                summary['p50_ms'], summary['p95_ms'], summary['p99_ms']))
+
+    return {
+        'meta': {
+            'revision': git_revision(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'iterations': args.iterations,
+            'workers': args.workers,
+            'latency_scale': args.latency_scale,
+            'throttle_rate': args.throttle_rate,
+            'seed': args.seed,
+        },
+        'operations': operations,
+        'throttled': dict(fake.throttled),
+    }
+
+
+def compare(current, baseline):
+    """Print per-operation deltas against a previous results file."""
+    print("\nChange vs {} ({})".format(baseline['meta']['revision'], baseline['meta']['timestamp']))
+    for name, summary in current['operations'].items():
+        old = baseline['operations'].get(name)
+        if not old:
+            continue
+        deltas = []
+        for field in ('throughput_per_s', 'p50_ms', 'p95_ms', 'p99_ms'):
+            if old[field]:
+                deltas.append("{} {:+.1f}%".format(field, (summary[field] - old[field]) * 100.0 / old[field]))
+        print("{:<26} {}".format(name, "  ".join(deltas)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline face recognition benchmarks')
+    parser.add_argument('--iterations', type=int, default=3, help='Repetitions of each scenario')
+    parser.add_argument('--workers', type=int, default=1, help='Concurrent workers per scenario')
+    parser.add_argument('--latency-scale', type=float, default=1.0,
+                        help='Multiplier for injected service latency (0 disables it)')
+    parser.add_argument('--throttle-rate', type=float, default=0.0,
+                        help='Probability that a call is throttled')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for latency and throttling')
+    parser.add_argument('--only', nargs='*', help='Scenario names to run')
+    parser.add_argument('--output', help='Results JSON path (default: benchmarks/results/<rev>-<time>.json)')
+    parser.add_argument('--compare', help='Previous results JSON to compare against')
+    parser.add_argument('--verbose', action='store_true', help='Show output from the code under test')
+    args = parser.parse_args()
+
+    results = run(args)
+
+    output = args.output
+    if not output:
+        results_dir = os.path.join(ROOT, 'benchmarks', 'results')
+        os.makedirs(results_dir, exist_ok=True)
+        output = os.path.join(results_dir, "{}-{}.json".format(
+            results['meta']['revision'], datetime.now().strftime('%Y%m%d_%H%M%S')))
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print("\nResults written to {}".format(output))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
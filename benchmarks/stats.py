@@ -0,0 +1,99 @@
+"""Latency recording and summary statistics for the benchmark suite."""
+import bisect
+import math
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(math.ceil(pct / 100.0 * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+
+def summarize(durations, errors=0, wall_time=None):
+    """Summarize a list of durations in seconds as a JSON-friendly dict."""
+    values = sorted(durations)
+    wall_time = wall_time if wall_time is not None else sum(values)
+    count = len(values)
+    return {
+        'count': count,
+        'errors': errors,
+        'error_rate': errors / float(count + errors) if count + errors else 0.0,
+        'wall_time_s': round(wall_time, 6),
+        'throughput_per_s': round(count / wall_time, 3) if wall_time > 0 else 0.0,
+        'mean_ms': round(sum(values) / count * 1000.0, 3) if count else 0.0,
+        'p50_ms': round(percentile(values, 50) * 1000.0, 3),
+        'p95_ms': round(percentile(values, 95) * 1000.0, 3),
+        'p99_ms': round(percentile(values, 99) * 1000.0, 3),
+        'max_ms': round(values[-1] * 1000.0, 3) if count else 0.0,
+    }
+
+
+class LatencyRecorder:
+    def __init__(self):
+        """Thread-safe collection of per-operation durations and errors."""
+        self.lock = threading.Lock()
+        self.durations = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    @contextmanager
+    def measure(self, operation):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            with self.lock:
+                self.errors[operation] += 1
+            raise
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.durations[operation].append(elapsed)
+
+    def summary(self, operation, wall_time=None):
+        with self.lock:
+            return summarize(self.durations[operation], self.errors[operation], wall_time)
+
+
+class Histogram:
+    def __init__(self, min_ms=0.5, max_ms=60000.0, buckets_per_decade=10):
+        """Log-bucketed latency histogram with fixed memory, in milliseconds."""
+        self.bounds = []
+        bound = min_ms
+        step = 10 ** (1.0 / buckets_per_decade)
+        while bound < max_ms:
+            self.bounds.append(bound)
+            bound *= step
+        self.bounds.append(max_ms)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        index = bisect.bisect_left(self.bounds, seconds * 1000.0)
+        with self.lock:
+            self.counts[index] += 1
+            self.total += 1
+
+    def percentile(self, pct):
+        """Upper bound of the bucket holding the given percentile."""
+        with self.lock:
+            if not self.total:
+                return 0.0
+            target = pct / 100.0 * self.total
+            seen = 0
+            for i, count in enumerate(self.counts):
+                seen += count
+                if seen >= target and count:
+                    return self.bounds[i] if i < len(self.bounds) else float('inf')
+        return float('inf')
+
+    def buckets(self):
+        """Non-empty buckets as [(upper_bound_ms, count)]."""
+        with self.lock:
+            return [(round(self.bounds[i], 3) if i < len(self.bounds) else 'inf', count)
+                    for i, count in enumerate(self.counts) if count]
@@ -0,0 +1,338 @@
+"""Camera backend probing and capture-format negotiation.
+
+Left to itself, OpenCV opens a camera with whichever backend comes first and
+the driver's default format. On Linux kiosks that usually means uncompressed
+YUYV at a low resolution, and a queue of several frames, so every read is
+already stale. open_camera tries the backends this platform offers
+(DirectShow or Media Foundation, V4L2 or GStreamer, AVFoundation; FFmpeg or
+GStreamer for files and streams). For each one it asks for MJPG, the target
+resolution and frame rate, and a one-frame buffer, and measures it briefly.
+The fastest one is used.
+The winner is cached per device and settings, so the probe only runs the
+first time a camera is opened:
+
+    python camera.py --source 0               # probe and print every candidate
+    python camera.py --source door.mp4 --reprobe
+"""
+import json
+import os
+import sys
+import threading
+import time
+
+import cv2
+
+import metrics
+
+CACHE_PATH = 'camera_cache.json'
+# Frames timed per candidate, after a few dropped while the camera settles
+PROBE_FRAMES = 20
+WARMUP_FRAMES = 3
+
+# Backends for a local device per platform, best first
+DEVICE_BACKENDS = {
+    'win32': ('dshow', 'msmf'),
+    'linux': ('v4l2', 'gstreamer'),
+    'darwin': ('avfoundation',),
+}
+# Backends for video files and stream URLs
+STREAM_BACKENDS = ('ffmpeg', 'gstreamer')
+BACKEND_IDS = {
+    'any': 'CAP_ANY', 'dshow': 'CAP_DSHOW', 'msmf': 'CAP_MSMF', 'v4l2': 'CAP_V4L2',
+    'gstreamer': 'CAP_GSTREAMER', 'avfoundation': 'CAP_AVFOUNDATION', 'ffmpeg': 'CAP_FFMPEG',
+}
+# MJPG moves a fraction of YUYV's data over USB, so it reaches higher
+# resolutions and frame rates; '' leaves the driver's default
+FOURCCS = ('MJPG', 'YUYV', '')
+
+# Settings gui.py and kiosk.py accept as command-line overrides
+CAMERA_SETTINGS = ('camera_width', 'camera_height', 'camera_fps', 'camera_fourcc', 'camera_backend',
+                   'camera_buffer', 'camera_probe', 'camera_cache')
+
+
+def is_device(source):
+    return isinstance(source, int) or (isinstance(source, str) and source.isdigit())
+
+
+def backend_available(name):
+    api = getattr(cv2, BACKEND_IDS[name], None)
+    if api is None:
+        return False
+    if name == 'any':
+        return True
+    registry = getattr(cv2, 'videoio_registry', None)
+    # hasBackend tells built-in backends apart from ones only listed
+    return registry is None or not hasattr(registry, 'hasBackend') or registry.hasBackend(api)
+
+
+def fourcc_name(value):
+    """The four characters of a CAP_PROP_FOURCC value, or '' if it is not a code."""
+    value = int(value)
+    name = ''.join(chr((value >> 8 * i) & 0xFF) for i in range(4))
+    return name if value > 0 and name.isprintable() else ''
+
+
+class CameraOptions:
+    def __init__(self, width=1280, height=720, fps=30.0, fourcc='auto', backend='auto',
+                 buffer_size=1, probe=True, cache_path=CACHE_PATH):
+        """Capture format to negotiate with a camera.
+
+        width, height, fps: target format, 0 keeps the driver's default.
+        fourcc:  'auto' tries MJPG, then YUYV, then the driver's default;
+                 'default' never sets one.
+        backend: 'auto' tries this platform's backends, or one of BACKEND_IDS.
+        probe:   benchmark the candidates and use the fastest (cached in
+                 `cache_path`); otherwise use the first that delivers frames.
+        """
+        if backend != 'auto' and backend not in BACKEND_IDS:
+            raise ValueError("Unknown camera backend {!r}; use auto or one of {}".format(
+                backend, ', '.join(sorted(BACKEND_IDS))))
+        if fourcc not in ('auto', 'default') and len(fourcc) != 4:
+            raise ValueError("Camera FOURCC must be four characters, auto or default: {!r}".format(fourcc))
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.fourcc = fourcc
+        self.backend = backend
+        self.buffer_size = buffer_size
+        self.probe = probe
+        self.cache_path = cache_path
+
+    @classmethod
+    def from_config(cls, cfg):
+        return cls(cfg.camera_width, cfg.camera_height, cfg.camera_fps, cfg.camera_fourcc,
+                   cfg.camera_backend, cfg.camera_buffer, cfg.camera_probe, cfg.camera_cache)
+
+    def key(self, source):
+        """Cache key: the same device asked for the same format on the same platform."""
+        return '{}|{}|{}x{}@{:g}|{}|{}'.format(sys.platform, source, self.width, self.height,
+                                               self.fps, self.backend, self.fourcc)
+
+    def candidates(self, source):
+        """(backend, fourcc) pairs to try for `source`, best guess first."""
+        if self.backend != 'auto':
+            backends = (self.backend,)
+        elif is_device(source):
+            backends = DEVICE_BACKENDS.get(sys.platform, ()) + ('any',)
+        else:
+            backends = STREAM_BACKENDS + ('any',)
+        if not is_device(source) or self.fourcc == 'default':
+            fourccs = ('',)  # A file's format is whatever it was recorded in
+        elif self.fourcc == 'auto':
+            fourccs = FOURCCS
+        else:
+            fourccs = (self.fourcc.upper(),)
+        return [(backend, fourcc) for backend in backends if backend_available(backend)
+                for fourcc in fourccs]
+
+
+def open_capture(source, backend, fourcc, options):
+    """A VideoCapture with the format applied, or None if the backend can't open `source`."""
+    if is_device(source):
+        source = int(source)
+    cap = cv2.VideoCapture(source, getattr(cv2, BACKEND_IDS[backend]))
+    if not cap.isOpened():
+        cap.release()
+        return None
+    if is_device(source):
+        # FOURCC first: V4L2 drivers offer different sizes per format
+        if fourcc:
+            cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+        if options.width and options.height:
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, options.width)
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, options.height)
+        if options.fps:
+            cap.set(cv2.CAP_PROP_FPS, options.fps)
+    if options.buffer_size:
+        # Queued frames are lag: with one, a read returns the newest frame
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, options.buffer_size)
+    return cap
+
+
+def measure(cap, frames=PROBE_FRAMES):
+    """What a capture actually delivers, or None if it delivers nothing."""
+    started = time.perf_counter()
+    ret, frame = cap.read()
+    if not ret or frame is None:
+        return None
+    first_frame_ms = (time.perf_counter() - started) * 1000.0
+    for _ in range(WARMUP_FRAMES):
+        cap.read()
+    read = 0
+    started = time.perf_counter()
+    for _ in range(frames):
+        ret, frame_read = cap.read()
+        if not ret or frame_read is None:
+            break  # A short file
+        read += 1
+    elapsed = time.perf_counter() - started
+    return {
+        'width': frame.shape[1],
+        'height': frame.shape[0],
+        'format': fourcc_name(cap.get(cv2.CAP_PROP_FOURCC)),
+        'fps': round(read / elapsed, 1) if read and elapsed > 0 else 0.0,
+        'first_frame_ms': round(first_frame_ms, 1),
+    }
+
+
+def rank_key(result, options):
+    """Sort key for probe results: the target size, then frame rate, then time to first frame."""
+    size_miss = 0.0
+    if options.width and options.height:
+        target = float(options.width * options.height)
+        size_miss = round(abs(result['width'] * result['height'] - target) / target, 2)
+    fps = min(result['fps'], options.fps) if options.fps else result['fps']
+    return size_miss, -round(fps), result['first_frame_ms']
+
+
+def probe(source, options, log=None):
+    """Benchmark every candidate format; returns (best or None, all results)."""
+    results = []
+    seen = set()
+    with metrics.timer('camera.probe'):
+        for backend, fourcc in options.candidates(source):
+            cap = open_capture(source, backend, fourcc, options)
+            if cap is None:
+                if log:
+                    log("{:<12} {:<7} could not open".format(backend, fourcc or 'default'))
+                continue
+            try:
+                # Drivers that ignore a request end up in a format already timed
+                actual = (fourcc_name(cap.get(cv2.CAP_PROP_FOURCC)), int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                          int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), cap.getBackendName())
+                if is_device(source) and actual in seen:
+                    continue
+                seen.add(actual)
+                result = measure(cap)
+            finally:
+                cap.release()
+            if result is None:
+                if log:
+                    log("{:<12} {:<7} delivered no frames".format(backend, fourcc or 'default'))
+                continue
+            result.update(backend=backend, fourcc=fourcc)
+            results.append(result)
+            if log:
+                log("{:<12} {:<7} {}x{} {:<4} {:6.1f} fps, first frame {:.0f} ms".format(
+                    backend, fourcc or 'default', result['width'], result['height'],
+                    result['format'] or '-', result['fps'], result['first_frame_ms']))
+    results.sort(key=lambda result: rank_key(result, options))
+    return (results[0] if results else None), results
+
+
+class FormatCache:
+    def __init__(self, path):
+        """Probe winners by CameraOptions.key, as JSON at `path`."""
+        self.path = path
+        self.lock = threading.Lock()
+
+    def _read(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, key):
+        with self.lock:
+            return self._read().get(key)
+
+    def put(self, key, value):
+        with self.lock:
+            entries = self._read()
+            if value is None:
+                entries.pop(key, None)
+            else:
+                entries[key] = value
+            # Capture processes of a multi-stream kiosk may write at once
+            tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entries, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+
+class PrimedCapture:
+    """A VideoCapture whose first read() returns the frame open_camera checked it with."""
+
+    def __init__(self, cap, frame):
+        self.cap = cap
+        self.frame = frame
+
+    def read(self):
+        frame, self.frame = self.frame, None
+        if frame is not None:
+            return True, frame
+        return self.cap.read()
+
+    def __getattr__(self, name):
+        return getattr(self.cap, name)
+
+
+def open_camera(source=0, options=None, reprobe=False):
+    """Open a camera index, video file or stream URL in its fastest format and check it delivers frames."""
+    options = options or CameraOptions()
+    if is_device(source):
+        source = int(source)
+    cache = FormatCache(options.cache_path) if options.probe and options.cache_path else None
+    key = options.key(source)
+
+    chosen = None
+    if options.probe:
+        chosen = cache.get(key) if cache is not None and not reprobe else None
+        if chosen is None:
+            chosen, _ = probe(source, options)
+            if chosen is not None and cache is not None:
+                cache.put(key, chosen)
+
+    candidates = options.candidates(source)
+    if chosen is not None:
+        candidates.insert(0, (chosen['backend'], chosen['fourcc']))
+    for i, (backend, fourcc) in enumerate(candidates):
+        cap = open_capture(source, backend, fourcc, options)
+        if cap is not None:
+            ret, frame = cap.read()
+            if ret and frame is not None:
+                # Handed back, so a video file does not lose its first frame
+                return PrimedCapture(cap, frame)
+            cap.release()
+        if i == 0 and chosen is not None and cache is not None:
+            # The cached format stopped working (new camera, driver update): probe next time
+            cache.put(key, None)
+    raise Exception("Could not open camera {}!".format(source))
+
+
+def main():
+    import argparse
+    import config
+
+    parser = argparse.ArgumentParser(description='Probe camera backends and capture formats')
+    parser.add_argument('--source', default='0', help='Camera index, video file or stream URL')
+    parser.add_argument('--reprobe', action='store_true', help='Ignore and replace the cached result')
+    config.add_arguments(parser, *CAMERA_SETTINGS)
+    args = parser.parse_args()
+    try:
+        options = CameraOptions.from_config(config.from_args(args, *CAMERA_SETTINGS))
+    except ValueError as e:
+        print(f"Configuration error: {str(e)}")
+        raise SystemExit(1)
+
+    source = int(args.source) if is_device(args.source) else args.source
+    key = options.key(source)
+    cache = FormatCache(options.cache_path) if options.cache_path else None
+    cached = cache.get(key) if cache is not None else None
+    if cached is not None and not args.reprobe:
+        print(f"Cached: {cached['backend']} {cached['fourcc'] or 'default'} "
+              f"{cached['width']}x{cached['height']} {cached['fps']} fps (--reprobe to measure again)")
+        return
+    best, _ = probe(source, options, log=print)
+    if best is None:
+        print(f"No backend delivered frames from {source}")
+        raise SystemExit(1)
+    if cache is not None:
+        cache.put(key, best)
+    print(f"Using {best['backend']} {best['fourcc'] or 'default'} {best['width']}x{best['height']} "
+          f"at {best['fps']} fps")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""Configuration shared by every entry point.
+
+Settings are loaded once, in increasing order of precedence, from:
+
+1. the defaults below,
+2. an INI file: FACE_CONFIG, --config, or ./facerecognition.ini if present.
+   [default] applies everywhere and a profile section such as [prod] is
+   layered on top when selected with FACE_PROFILE or --config-profile,
+3. environment variables: FACE_<SETTING> (e.g. FACE_READ_TIMEOUT), plus the
+   older names listed with each setting,
+4. command-line flags named after a setting (e.g. --workers).
+
+    [default]
+    region = us-east-1
+    collection = facerecognition_collection
+
+    [eu-site]
+    region = eu-west-1
+    shards = 4
+    read_timeout = 5
+
+Every value is converted to its declared type when loaded, so a typo or a
+bad number fails at startup rather than on the first API call.
+"""
+import argparse
+import configparser
+import os
+
+import boto3
+from botocore.config import Config as BotoConfig
+
+import metrics
+
+DEFAULT_PATH = 'facerecognition.ini'
+
+
+def _bool(value):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ('1', 'true', 'yes', 'on'):
+        return True
+    if text in ('0', 'false', 'no', 'off', ''):
+        return False
+    raise ValueError("expected a boolean, got {!r}".format(value))
+
+
+def _list(value):
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [part.strip() for part in str(value).split(',') if part.strip()]
+
+
+class Setting:
+    def __init__(self, name, kind, default, help, env=()):
+        """One typed setting; `env` lists older variable names still honoured."""
+        self.name = name
+        self.kind = kind
+        self.default = default
+        self.help = help
+        self.env = ('FACE_' + name.upper(),) + tuple(env)
+
+    def parse(self, value):
+        if self.kind is bool:
+            return _bool(value)
+        if self.kind is list:
+            return _list(value)
+        return self.kind(value)
+
+
+SETTINGS = [
+    # AWS resources
+    Setting('region', str, 'us-east-1', 'AWS region for every client', ['AWS_REGION']),
+    Setting('bucket', str, '', 'S3 bucket enrollment images are uploaded to', ['FACE_RECOGNITION_BUCKET']),
+    Setting('collection', str, 'facerecognition_collection',
+            'Rekognition collection (the base name when sharded)', ['COLLECTION_ID']),
+    Setting('table', str, 'facerecognition', 'DynamoDB identity table',
+            ['FACE_RECOGNITION_TABLE', 'DYNAMODB_TABLE']),
+    Setting('shards', int, 1, 'Hash shards per site'),
+    Setting('sites', list, [], 'Every site with its own shards, comma separated; searches without a site cover only these'),
+    Setting('site', str, '', 'Site whose shards this client searches (all when empty)'),
+    Setting('attendance_dir', str, 'attendance', 'Directory for attendance CSV files'),
+    Setting('attendance_table', str, '', 'DynamoDB table attendance marks are shipped to (empty keeps them local)'),
+    Setting('attendance_live_days', int, 7, 'Finished days kept as plain CSV before they are archived'),
+    Setting('attendance_retention_days', int, 0, 'Days archived attendance is kept (0 keeps it forever)'),
+
+    # Recognition
+    Setting('max_faces', int, 5, 'Candidates requested per search'),
+    Setting('accept_threshold', float, 95.0, 'Similarity accepted without a second check'),
+    Setting('reject_threshold', float, 80.0, 'Similarity below which matches are ignored'),
+    Setting('margin', float, 5.0, 'Lead over the next person required to accept'),
+    Setting('kiosk_cooldown', float, 60.0, 'Seconds before a kiosk marks the same person again'),
+
+    # Performance
+    Setting('workers', int, 8, 'Concurrent requests for batch jobs and maintenance commands'),
+    Setting('rate', float, 0.0, 'Requests per second for batch jobs (0 for no limit)'),
+    Setting('kiosk_workers', int, 4, 'Recognition threads shared by kiosk streams'),
+    Setting('kiosk_rate', float, 5.0, 'Recognition requests per second across kiosk streams'),
+    Setting('search_workers', int, 16, 'Threads fanning a search out to shards'),
+    Setting('connect_timeout', float, 5.0, 'Seconds to establish an AWS connection'),
+    Setting('read_timeout', float, 10.0, 'Seconds to wait for an AWS response'),
+    Setting('max_attempts', int, 5, 'Attempts per AWS call, including the first'),
+    Setting('retry_mode', str, 'standard', 'botocore retry mode: legacy, standard or adaptive'),
+    Setting('max_pool_connections', int, 10, 'HTTP connections kept per client'),
+    Setting('name_cache_size', int, 1024, 'Face id to identity records cached per process (0 disables)'),
+    Setting('name_cache_ttl', float, 300.0, 'Seconds a cached identity record stays valid'),
+    Setting('identity_snapshot', str, '',
+            'S3 prefix identity snapshots are published under (empty looks faces up in DynamoDB)'),
+    Setting('identity_snapshot_bucket', str, '',
+            'S3 bucket identity snapshots are published to; not the enrollment bucket, whose uploads invoke the Lambda'),
+    Setting('identity_snapshot_interval', float, 30.0, 'Seconds between checks for a newer identity snapshot'),
+    Setting('identity_snapshot_cache', str, 'identity_snapshot.jsonl.gz',
+            'Local copy of the identity snapshot, used when S3 is unreachable at startup'),
+    Setting('attendance_sync_interval', float, 5.0, 'Seconds between attendance shipments to DynamoDB'),
+    Setting('request_deadline', float, 3.0,
+            'Seconds a search or identity lookup may take in total, retries included (0 for no limit)'),
+    Setting('hedge_quantile', float, 0.95,
+            'Recent latency quantile after which a duplicate request is sent (0 disables hedging)'),
+    Setting('hedge_min_delay', float, 0.05, 'Shortest wait in seconds before sending a duplicate request'),
+    Setting('breaker_failures', int, 5, 'Consecutive failures that open a circuit breaker (0 disables it)'),
+    Setting('breaker_reset', float, 30.0, 'Seconds an open circuit breaker fails fast before a probe call'),
+    Setting('deferred_dir', str, '',
+            'Directory frames are queued in while the service is down (empty fails fast instead)'),
+    Setting('deferred_max', int, 1000, 'Most frames kept in the deferred queue'),
+
+    # Camera
+    Setting('camera_width', int, 1280, 'Capture width to negotiate (0 keeps the driver default)'),
+    Setting('camera_height', int, 720, 'Capture height to negotiate (0 keeps the driver default)'),
+    Setting('camera_fps', float, 30.0, 'Capture frame rate to negotiate (0 keeps the driver default)'),
+    Setting('camera_fourcc', str, 'auto', "Capture format such as MJPG or YUYV; 'auto' probes, 'default' sets none"),
+    Setting('camera_backend', str, 'auto', "OpenCV capture backend such as v4l2 or dshow; 'auto' probes"),
+    Setting('camera_buffer', int, 1, 'Frames the driver may queue (fewer means less lag, 0 keeps the default)'),
+    Setting('camera_probe', bool, True, 'Benchmark backends and formats on first use and keep the fastest'),
+    Setting('camera_cache', str, 'camera_cache.json', 'File the probed format per camera is cached in'),
+
+    # Enrollment
+    Setting('normalize_images', bool, False, 'Normalize uploads in the enrollment Lambda',
+            ['NORMALIZE_IMAGES']),
+    Setting('quality_filter', str, 'AUTO', 'IndexFaces QualityFilter', ['ENROLL_QUALITY_FILTER']),
+    Setting('min_sharpness', float, 20.0, 'Lowest Rekognition sharpness enrolled', ['ENROLL_MIN_SHARPNESS']),
+    Setting('min_brightness', float, 20.0, 'Lowest Rekognition brightness enrolled', ['ENROLL_MIN_BRIGHTNESS']),
+    Setting('max_yaw', float, 35.0, 'Largest head yaw enrolled, in degrees', ['ENROLL_MAX_YAW']),
+    Setting('max_pitch', float, 30.0, 'Largest head pitch enrolled, in degrees', ['ENROLL_MAX_PITCH']),
+
+    # Observability
+    Setting('metrics', str, '', "Metrics sink: 'prom:<path>' or 'statsd:<host>:<port>'"),
+    Setting('metrics_interval', float, 10.0, 'Seconds between metrics flushes'),
+    Setting('results_log_lines', int, 1000, 'Lines the GUI results panel keeps in memory'),
+    Setting('results_log_file', str, 'results.log',
+            'Rotating file with the full history of the GUI results panel (empty keeps none)'),
+]
+
+_BY_NAME = {setting.name: setting for setting in SETTINGS}
+
+
+class Config:
+    def __init__(self, values=None, sources=None):
+        """Settings as attributes; `sources` records where each value came from."""
+        self.sources = dict(sources or {})
+        for setting in SETTINGS:
+            setattr(self, setting.name, setting.default)
+            self.sources.setdefault(setting.name, 'default')
+        for name, value in (values or {}).items():
+            setattr(self, name, value)
+
+    def update(self, values, source):
+        """Apply raw values from one source, converting them to their types."""
+        for name, value in values.items():
+            setting = _BY_NAME.get(name)
+            if setting is None:
+                raise ValueError("Unknown setting '{}' in {}".format(name, source))
+            try:
+                setattr(self, name, setting.parse(value))
+            except (TypeError, ValueError) as e:
+                raise ValueError("Invalid value for '{}' in {}: {}".format(name, source, e))
+            self.sources[name] = source
+
+    def as_dict(self):
+        return {setting.name: getattr(self, setting.name) for setting in SETTINGS}
+
+    def client(self, service, **overrides):
+        """A boto3 client using the configured region, timeouts, retries and pool size."""
+        options = {
+            'connect_timeout': self.connect_timeout,
+            'read_timeout': self.read_timeout,
+            'retries': {'max_attempts': self.max_attempts, 'mode': self.retry_mode},
+            'max_pool_connections': self.max_pool_connections,
+        }
+        options.update(overrides)
+        return boto3.client(service, region_name=self.region, config=BotoConfig(**options))
+
+    def configure_metrics(self):
+        """Enable the metrics sink once; later calls are no-ops."""
+        if self.metrics and not metrics.enabled():
+            metrics.configure(self.metrics, self.metrics_interval)
+
+
+def read_file(path, profile=None):
+    """Raw values from the [default] section and, if given, the profile section."""
+    parser = configparser.ConfigParser()
+    if not parser.read(path, encoding='utf-8'):
+        raise ValueError("Cannot read config file: {}".format(path))
+    values = dict(parser.defaults())
+    if parser.has_section('default'):
+        values.update(parser.items('default'))
+    if profile:
+        if not parser.has_section(profile):
+            raise ValueError("Profile [{}] not found in {}".format(profile, path))
+        values.update(parser.items(profile))
+    return values
+
+
+def load(path=None, profile=None, overrides=None, environ=None):
+    """Build a Config from defaults, file, environment and explicit overrides."""
+    environ = os.environ if environ is None else environ
+    cfg = Config()
+
+    path = path or environ.get('FACE_CONFIG') or (DEFAULT_PATH if os.path.exists(DEFAULT_PATH) else None)
+    profile = profile or environ.get('FACE_PROFILE')
+    if path:
+        cfg.update(read_file(path, profile), path + (' [{}]'.format(profile) if profile else ''))
+    elif profile:
+        raise ValueError("FACE_PROFILE/--config-profile given but no config file found")
+
+    for setting in SETTINGS:
+        # Earlier names in the list win
+        for var in reversed(setting.env):
+            if var in environ:
+                cfg.update({setting.name: environ[var]}, '$' + var)
+
+    if overrides:
+        cfg.update({k: v for k, v in overrides.items() if v is not None}, 'command line')
+    return cfg
+
+
+_config = None
+
+
+def get():
+    """The process-wide configuration, loaded on first use."""
+    global _config
+    if _config is None:
+        _config = load()
+    return _config
+
+
+def add_arguments(parser, *names):
+    """Add --config/--config-profile plus a flag for each named setting."""
+    parser.add_argument('--config', help='Config file (default: $FACE_CONFIG or ./{})'.format(DEFAULT_PATH))
+    parser.add_argument('--config-profile', help='Profile section of the config file (default: $FACE_PROFILE)')
+    for name in names:
+        setting = _BY_NAME[name]
+        flag = '--' + name.replace('_', '-')
+        if setting.kind is bool:
+            # --no-<flag> turns off a setting the file or environment turned on
+            parser.add_argument(flag, action=argparse.BooleanOptionalAction, default=None, help=setting.help)
+        else:
+            kind = str if setting.kind is list else setting.kind
+            parser.add_argument(flag, type=kind, default=None, help=setting.help)
+
+
+def from_args(args, *names):
+    """Load the process-wide configuration, letting the named flags override it."""
+    global _config
+    overrides = {name: getattr(args, name, None) for name in names}
+    _config = load(getattr(args, 'config', None), getattr(args, 'config_profile', None), overrides)
+    return _config
+
+
+def main():
+    """Print the effective configuration and where each value came from."""
+    parser = argparse.ArgumentParser(description='Show the effective configuration')
+    add_arguments(parser)
+    args = parser.parse_args()
+    try:
+        cfg = from_args(args)
+    except ValueError as e:
+        print(f"Configuration error: {str(e)}")
+        raise SystemExit(1)
+    width = max(len(setting.name) for setting in SETTINGS)
+    for setting in SETTINGS:
+        value = getattr(cfg, setting.name)
+        if isinstance(value, list):
+            value = ','.join(value)
+        print("{:<{}}  {!s:<28}  {}".format(setting.name, width, value, cfg.sources[setting.name]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,556 @@
+"""Headless capture -> detect -> recognize -> attend pipeline.
+
+Everything here works without a display: the Tk GUI and the kiosk daemon are
+both thin consumers of RecognitionEngine and AttendanceStore.
+"""
+import csv
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import cv2
+
+import identity
+import metrics
+from attendance_archive import AttendanceArchive
+from attendance_sync import SYNC_LOG, AttendanceLog, AttendanceSync
+from encoding import encode_frame
+from resilience import CircuitBreaker, DeferredQueue, Hedger, is_failure
+from shards import ShardMap, ShardedSearcher
+from snapshot import SnapshotSync
+
+ATTENDANCE_HEADER = ['Name', 'Date', 'Time']
+
+
+class AttendanceStore:
+    def __init__(self, directory="attendance", sync=None, archiver=None):
+        """Daily attendance CSV files (attendance_YYYY-MM-DD.csv) in one directory.
+
+        Writes are serialized, so one store can take marks from several streams.
+        With an AttendanceSync, every mark is also shipped to DynamoDB in the
+        background. Finished days are rolled into the AttendanceArchive.
+        """
+        self.directory = os.path.abspath(directory)
+        self.lock = threading.Lock()
+        self.sync = sync
+        self.archiver = archiver or AttendanceArchive(self.directory)
+        self.rolled_on = None
+
+    @classmethod
+    def from_config(cls, cfg, dynamodb=None):
+        """A store in the configured directory, syncing to attendance_table if one is set."""
+        sync = None
+        if cfg.attendance_table:
+            log = AttendanceLog(os.path.join(cfg.attendance_dir, SYNC_LOG))
+            sync = AttendanceSync(dynamodb or cfg.client('dynamodb'), cfg.attendance_table, log,
+                                  interval=cfg.attendance_sync_interval,
+                                  max_attempts=cfg.max_attempts,
+                                  source=cfg.site or socket.gethostname()).start()
+        return cls(cfg.attendance_dir, sync, AttendanceArchive.from_config(cfg))
+
+    def path_for(self, date=None):
+        date = date or datetime.now()
+        return os.path.join(self.directory, f"attendance_{date.strftime('%Y-%m-%d')}.csv")
+
+    def ensure_file(self, date=None):
+        """Create the day's file with headers if it doesn't exist, returning its path."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path_for(date)
+        if not os.path.exists(path):
+            with open(path, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(ATTENDANCE_HEADER)
+        return path
+
+    def mark(self, name, date=None):
+        """Append an attendance row, returning (date_str, time_str)."""
+        date = date or datetime.now()
+        date_str = date.strftime('%Y-%m-%d')
+
+        current_time = datetime.now().strftime('%H:%M:%S')
+        with metrics.timer('attendance.write'), self.lock:
+            # Under the lock, so an archive roll can't take the file in between
+            path = self.ensure_file(date)
+            with open(path, 'a', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow([name, date_str, current_time])
+        if self.sync is not None:
+            self.sync.record(name, date_str, current_time)
+        self.roll_daily()
+        return date_str, current_time
+
+    def roll_daily(self):
+        """Once a day, archive the days past attendance_live_days in the background."""
+        today = datetime.now().date()
+        if self.rolled_on == today:
+            return
+        self.rolled_on = today
+
+        def roll():
+            try:
+                self.archiver.roll(live_lock=self.lock)
+                self.archiver.prune()
+            except Exception as e:
+                # The files stay live and are rolled next time
+                metrics.incr('attendance.archive_error')
+                print(f"Error archiving attendance: {str(e)}")
+
+        threading.Thread(target=roll, name='attendance-archive', daemon=True).start()
+
+    def read(self, date=None):
+        """The day's marks as dicts, from its live file and the archive."""
+        date = date or datetime.now()
+        rows = self.archiver.read(date.strftime('%Y-%m-%d'))
+        path = self.path_for(date)
+        with self.lock:
+            if os.path.exists(path):
+                with open(path, newline='', encoding='utf-8') as f:
+                    rows.extend(csv.DictReader(f))
+        return rows
+
+    def clear(self, date=None):
+        """Replace the day's file with just its header; False if there is no file."""
+        path = self.path_for(date)
+        tmp_path = path + '.tmp'
+        with self.lock:
+            if not os.path.exists(path):
+                return False
+            with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(ATTENDANCE_HEADER)
+            # A crash leaves the old file or the empty one, never half of either
+            os.replace(tmp_path, path)
+        return True
+
+    def archive(self):
+        """Archive every daily file, today's included; returns {month: days archived}."""
+        return self.archiver.roll(everything=True, live_lock=self.lock)
+
+    def close(self):
+        """Ship what can be shipped now; the rest stays logged for the next run."""
+        if self.sync is not None:
+            self.sync.stop()
+            self.sync = None
+
+
+class FaceDetector:
+    def __init__(self, scale_width=320, min_size=40):
+        """Cheap local face detection used to skip API calls on empty frames."""
+        cascade_path = os.path.join(cv2.data.haarcascades, 'haarcascade_frontalface_default.xml')
+        self.cascade = cv2.CascadeClassifier(cascade_path)
+        self.scale_width = scale_width
+        self.min_size = min_size
+
+    def detect(self, frame):
+        """Return face boxes as (x, y, w, h) in frame coordinates."""
+        height, width = frame.shape[:2]
+        scale = min(1.0, self.scale_width / float(width))
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if scale < 1.0:
+            gray = cv2.resize(gray, (int(width * scale), int(height * scale)),
+                              interpolation=cv2.INTER_AREA)
+        min_size = max(1, int(self.min_size * scale))
+        with metrics.timer('detect.local'):
+            faces = self.cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5,
+                                                  minSize=(min_size, min_size))
+        return [tuple(int(v / scale) for v in face) for face in faces]
+
+
+class ConfidencePolicy:
+    def __init__(self, accept=95.0, reject=80.0, margin=5.0, verify=None):
+        """Tiered decision on search results.
+
+        A top match at or above `accept` that leads the best match for any
+        other person by at least `margin` is accepted outright. Below `reject`
+        it is discarded. Anything in between needs a second check before
+        attendance is marked: a second frame that agrees, or a compare_faces
+        against the enrollment image scoring at least `verify` (halfway
+        between the two thresholds by default).
+        """
+        if reject > accept:
+            raise ValueError("reject threshold must not exceed accept threshold")
+        self.accept = accept
+        self.reject = reject
+        self.margin = margin
+        self.verify = verify if verify is not None else (accept + reject) / 2.0
+
+    def lead(self, ranked):
+        """How far the top candidate is ahead of the best different person."""
+        top_similarity, _, top_person = ranked[0]
+        for similarity, _, person in ranked[1:]:
+            if person != top_person:
+                return top_similarity - similarity
+        return float('inf')
+
+    def decide(self, ranked):
+        """ranked: [(similarity, name, person)] best first. Returns 'accept', 'verify' or 'reject'."""
+        if not ranked or ranked[0][1] is None or ranked[0][0] < self.reject:
+            return 'reject'
+        if ranked[0][0] >= self.accept and self.lead(ranked) >= self.margin:
+            return 'accept'
+        return 'verify'
+
+    def confirms(self, person, ranked):
+        """True if a second search clearly agrees on `person`."""
+        return (bool(ranked) and ranked[0][2] == person
+                and ranked[0][0] >= self.reject and self.lead(ranked) >= self.margin)
+
+
+# Settings gui.py, kiosk.py and batch.py accept as command-line overrides
+ENGINE_SETTINGS = ('accept_threshold', 'reject_threshold', 'margin', 'max_faces', 'shards', 'site')
+
+
+class TTLCache:
+    def __init__(self, capacity, ttl):
+        """Thread-safe LRU cache whose entries expire `ttl` seconds after insertion.
+
+        Expired entries stay until evicted, so they can still be served with
+        stale=True while the backing store is unavailable.
+        """
+        self.capacity = capacity
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, stale=False):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if time.monotonic() >= expires and not stale:
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+
+class RecognitionEngine:
+    def __init__(self, rekognition, dynamodb, attendance=None,
+                 collection_id='facerecognition_collection', table_name='facerecognition',
+                 max_faces=5, threshold=80, cooldown=0, policy=None, shards=None, site=None,
+                 cache=None, search_workers=None, search_hedger=None, lookup_hedger=None, deferred=None,
+                 snapshot=None):
+        """Recognize faces in frames and mark attendance for the people found.
+
+        cooldown: seconds during which a person who was just marked is not
+        marked again (0 marks on every recognition, as the GUI always has).
+        policy:   ConfidencePolicy deciding which matches are marked; its reject
+                  threshold is used as the search threshold.
+        shards:   ShardMap for a sharded gallery; searches fan out to the
+                  shards of `site` (every shard without one) in parallel.
+        cache:    optional TTLCache of identity records by face id.
+        search_hedger, lookup_hedger: optional resilience.Hedger for searches
+                  and identity lookups (hedging, deadline, circuit breaker).
+        deferred: optional resilience.DeferredQueue; frames that could not be
+                  recognized because the service was down are spooled there
+                  for recognize_deferred() instead of failing.
+        snapshot: optional snapshot.SnapshotSync; faces in it are resolved
+                  without DynamoDB, the rest through the cache and table.
+        """
+        self.rekognition = rekognition
+        self.dynamodb = dynamodb
+        self.attendance = attendance
+        self.collection_id = collection_id
+        self.table_name = table_name
+        self.max_faces = max_faces
+        self.policy = policy or ConfidencePolicy(accept=max(95.0, threshold), reject=threshold)
+        self.threshold = self.policy.reject
+        self.cooldown = cooldown
+        self.searcher = (ShardedSearcher(rekognition, shards, site, search_workers)
+                         if shards is not None else None)
+        self.cache = cache
+        self.search_hedger = search_hedger
+        self.lookup_hedger = lookup_hedger
+        self.deferred = deferred
+        self.snapshot = snapshot
+        self.last_marked = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, cfg, rekognition, dynamodb, attendance=None, cooldown=0, resilient=True):
+        """An engine for the configured collection, table, policy, shards, cache and snapshot.
+
+        resilient: hedge calls, bound them by request_deadline and trip circuit
+        breakers; off for batch jobs, which care about throughput, not tails.
+        """
+        shards = ShardMap.from_config(cfg)
+        hedgers = {}
+        if resilient:
+            for name in ('rekognition', 'dynamodb'):
+                breaker = (CircuitBreaker(name, cfg.breaker_failures, cfg.breaker_reset)
+                           if cfg.breaker_failures > 0 else None)
+                hedgers[name] = Hedger(name, breaker, cfg.hedge_quantile, cfg.hedge_min_delay,
+                                       cfg.request_deadline)
+        return cls(
+            rekognition, dynamodb, attendance,
+            collection_id=cfg.collection,
+            table_name=cfg.table,
+            max_faces=cfg.max_faces,
+            cooldown=cooldown,
+            policy=ConfidencePolicy(cfg.accept_threshold, cfg.reject_threshold, cfg.margin),
+            shards=shards if shards.sharded(cfg.site) else None,
+            site=cfg.site or None,
+            cache=TTLCache(cfg.name_cache_size, cfg.name_cache_ttl) if cfg.name_cache_size > 0 else None,
+            search_workers=cfg.search_workers,
+            search_hedger=hedgers.get('rekognition'),
+            lookup_hedger=hedgers.get('dynamodb'),
+            deferred=DeferredQueue(cfg.deferred_dir, cfg.deferred_max) if resilient and cfg.deferred_dir else None,
+            snapshot=SnapshotSync.from_config(cfg).start() if cfg.identity_snapshot and cfg.identity_snapshot_bucket else None
+        )
+
+    def encode_frame(self, frame):
+        return encode_frame(frame)
+
+    def _search(self, image_bytes):
+        if self.searcher is not None:
+            return self.searcher.search(image_bytes, self.max_faces, self.threshold)
+        return self.rekognition.search_faces_by_image(
+            CollectionId=self.collection_id,
+            Image={'Bytes': image_bytes},
+            MaxFaces=self.max_faces,
+            FaceMatchThreshold=self.threshold
+        )
+
+    def search(self, image_bytes):
+        with metrics.timer('rekognition.search_faces_by_image'):
+            if self.search_hedger is not None:
+                return self.search_hedger.call(self._search, image_bytes)
+            return self._search(image_bytes)
+
+    def lookup_item(self, face_id):
+        """Return the identity record stored for a face id, or None."""
+        if self.snapshot is not None:
+            item = self.snapshot.get(face_id)
+            if item is not None:
+                return item
+        if self.cache is not None:
+            item = self.cache.get(face_id)
+            if item is not None:
+                metrics.incr('cache.identity_hit')
+                return item
+        request = {'TableName': self.table_name, 'Key': {'RekognitionId': {'S': face_id}}}
+        try:
+            with metrics.timer('dynamodb.get_item'):
+                if self.lookup_hedger is not None:
+                    face_data = self.lookup_hedger.call(self.dynamodb.get_item, **request)
+                else:
+                    face_data = self.dynamodb.get_item(**request)
+        except Exception as e:
+            # While DynamoDB is unavailable, an expired record beats no answer
+            item = self.cache.get(face_id, stale=True) if self.cache is not None and is_failure(e) else None
+            if item is None:
+                raise
+            metrics.incr('cache.identity_stale')
+            return item
+        item = face_data.get('Item')
+        # Misses are not cached, so a newly enrolled face resolves right away
+        if item is not None and self.cache is not None:
+            self.cache.put(face_id, item)
+        return item
+
+    def lookup(self, face_id):
+        """Return the full name stored for a face id, or None."""
+        item = self.lookup_item(face_id)
+        if item is not None:
+            return item['FullName']['S']
+        return None
+
+    def compare(self, image_bytes, item):
+        """Similarity of the probe to the stored enrollment image, or None if there is none."""
+        if item is None or 'ImageKey' not in item:
+            return None
+        with metrics.timer('rekognition.compare_faces'):
+            response = self.rekognition.compare_faces(
+                SourceImage={'Bytes': image_bytes},
+                TargetImage={'S3Object': {'Bucket': item['ImageBucket']['S'],
+                                          'Name': item['ImageKey']['S']}},
+                SimilarityThreshold=self.policy.reject
+            )
+        return max((m['Similarity'] for m in response['FaceMatches']), default=0.0)
+
+    def should_mark(self, person):
+        if self.attendance is None:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            last = self.last_marked.get(person)
+            if last is not None and now - last < self.cooldown:
+                return False
+            self.last_marked[person] = now
+        return True
+
+    def recognize_frame(self, frame, date=None, mark=True, next_frame=None):
+        """Run one frame through the pipeline.
+
+        Returns a JSON-serializable event: status is 'matched', 'uncertain',
+        'no_match', 'no_face', 'deferred' (queued until the service is back)
+        or 'error'. 'matches' holds the accepted
+        person with whether attendance was marked; 'candidates' lists the
+        people considered for an uncertain result.
+
+        next_frame: optional callable returning a fresh frame, used as the
+        second check when the first result is uncertain.
+        """
+        started = time.perf_counter()
+        confirm = None
+        if next_frame is not None:
+            def confirm():
+                frame = next_frame()
+                return None if frame is None else self.encode_frame(frame)
+        with metrics.timer('recognize.total'):
+            event = self._recognize(self.encode_frame(frame), date, mark, confirm)
+        event['timestamp'] = datetime.now().isoformat(timespec='milliseconds')
+        event['latency_ms'] = round((time.perf_counter() - started) * 1000.0, 1)
+        return event
+
+    def recognize_bytes(self, image_bytes, date=None, mark=True, defer=True):
+        """Same as recognize_frame for an already encoded image."""
+        started = time.perf_counter()
+        with metrics.timer('recognize.total'):
+            event = self._recognize(image_bytes, date, mark, defer=defer)
+        event['timestamp'] = datetime.now().isoformat(timespec='milliseconds')
+        event['latency_ms'] = round((time.perf_counter() - started) * 1000.0, 1)
+        return event
+
+    def rank(self, response, items):
+        """[(similarity, name, person)] best first, one entry per person.
+
+        Matches are collapsed to each person's best face before anything is
+        looked up, so a person enrolled with ten photos costs one lookup.
+        Faces enrolled without a person id are told apart by name.
+        Identity records are looked up into `items`.
+        """
+        ranked = []
+        seen = set()
+        for match in identity.collapse(response['FaceMatches']):
+            face_id = match['Face']['FaceId']
+            if face_id not in items:
+                items[face_id] = self.lookup_item(face_id)
+            item = items[face_id]
+            name = item['FullName']['S'] if item is not None else None
+            person = item['PersonId']['S'] if item is not None and 'PersonId' in item else name or face_id
+            if person in seen:
+                continue
+            seen.add(person)
+            ranked.append((match.get('Similarity', match['Face']['Confidence']), name, person))
+        return ranked
+
+    def verify(self, image_bytes, person, item, confirm):
+        """Second check for an uncertain match; returns how it was confirmed, or None."""
+        if confirm is not None:
+            second_bytes = confirm()
+            if second_bytes is not None:
+                try:
+                    second = self.rank(self.search(second_bytes), {})
+                except self.rekognition.exceptions.InvalidParameterException:
+                    second = []
+                return 'frame' if self.policy.confirms(person, second) else None
+        similarity = self.compare(image_bytes, item)
+        if similarity is not None and similarity >= self.policy.verify:
+            return 'compare_faces'
+        return None
+
+    def unavailable(self, image_bytes, date, mark, error, defer=True):
+        """Event for a frame the service could not answer; queued for later when possible."""
+        if defer and self.deferred is not None and is_failure(error):
+            item_id = self.deferred.put(image_bytes, date, mark)
+            if item_id is not None:
+                return {'status': 'deferred', 'deferred_id': item_id, 'error': str(error), 'matches': []}
+        return {'status': 'error', 'error': f"Recognition error: {str(error)}", 'matches': []}
+
+    def recognize_deferred(self, limit=10):
+        """Recognize up to `limit` queued frames, oldest first, returning their events.
+
+        Stops at the first frame the service still cannot answer; it stays
+        queued for the next call.
+        """
+        if self.deferred is None:
+            return []
+        events = []
+        for meta_path in self.deferred.pending()[:limit]:
+            try:
+                image_bytes, date, mark, captured = self.deferred.load(meta_path)
+            except (OSError, ValueError) as e:
+                print(f"Dropping unreadable deferred frame {meta_path}: {str(e)}")
+                self.deferred.remove(meta_path)
+                continue
+            event = self.recognize_bytes(image_bytes, date, mark, defer=False)
+            if event['status'] == 'error':
+                break
+            self.deferred.remove(meta_path)
+            event['captured'] = captured
+            events.append(event)
+            metrics.incr('deferred.recognized')
+        return events
+
+    def _recognize(self, image_bytes, date, mark, confirm=None, defer=True):
+        try:
+            response = self.search(image_bytes)
+        except self.rekognition.exceptions.InvalidParameterException:
+            metrics.incr('recognize.no_face')
+            return {'status': 'no_face', 'matches': []}
+        except Exception as e:
+            return self.unavailable(image_bytes, date, mark, e, defer)
+
+        if not response['FaceMatches']:
+            metrics.incr('recognize.no_match')
+            return {'status': 'no_match', 'matches': []}
+        metrics.incr('recognize.matches', len(response['FaceMatches']))
+
+        # The search describes the largest face in the image; the matches are
+        # candidate identities for it, so at most one person is accepted
+        items = {}
+        try:
+            ranked = self.rank(response, items)
+        except Exception as e:
+            event = self.unavailable(image_bytes, date, mark, e, defer)
+            if event['status'] == 'error':
+                event['error'] = f"Error fetching person details: {str(e)}"
+            return event
+
+        decision = self.policy.decide(ranked)
+        top = max(response['FaceMatches'], key=lambda m: m.get('Similarity', m['Face']['Confidence']))
+        result = {
+            'face_id': top['Face']['FaceId'],
+            'person_id': ranked[0][2],
+            'confidence': top['Face']['Confidence'],
+            'similarity': top.get('Similarity'),
+            'name': ranked[0][1],
+            'attendance': False,
+        }
+
+        if decision == 'reject':
+            metrics.incr('recognize.rejected')
+            return {'status': 'no_match', 'matches': []}
+        if decision == 'verify':
+            metrics.incr('recognize.verify')
+            try:
+                verified_by = self.verify(image_bytes, result['person_id'], items.get(result['face_id']), confirm)
+            except Exception as e:
+                verified_by = None
+                result['error'] = f"Verification error: {str(e)}"
+            if verified_by is None:
+                metrics.incr('recognize.uncertain')
+                candidates = [{'name': name, 'similarity': similarity} for similarity, name, _ in ranked[:3]]
+                return {'status': 'uncertain', 'matches': [], 'candidates': candidates}
+            result['verified_by'] = verified_by
+
+        # The cooldown is per person, so two people sharing a name are both marked
+        if mark and self.should_mark(result['person_id']):
+            try:
+                result['date'], result['time'] = self.attendance.mark(result['name'], date)
+                result['attendance'] = True
+            except Exception as e:
+                result['error'] = f"Error marking attendance: {str(e)}"
+
+        return {'status': 'matched', 'matches': [result]}
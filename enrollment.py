@@ -0,0 +1,211 @@
+"""Enrollment checks shared by the Lambda and the direct enrollment path.
+
+Enrolling through the bucket means upload -> S3 event -> Lambda (perhaps a
+cold start) -> head_object -> index_faces -> put_item: seconds before the
+person can be recognized, and no answer for whoever enrolled them.
+DirectEnroller indexes the image bytes and writes the identity record
+itself, so the FaceId is searchable when it returns. The original is
+archived to the bucket in the background, marked so the Lambda does not
+index it a second time.
+"""
+import mimetypes
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import identity
+import metrics
+
+# Why IndexFaces left a face out, as reported in UnindexedFaces
+UNINDEXED_REASONS = {
+    'EXCEEDS_MAX_FACES': 'more than one face in the image',
+    'EXTREME_POSE': 'face is turned too far from the camera',
+    'LOW_BRIGHTNESS': 'image is too dark',
+    'LOW_SHARPNESS': 'image is blurry',
+    'LOW_CONFIDENCE': 'face could not be detected confidently',
+    'SMALL_BOUNDING_BOX': 'face is too small',
+    'LOW_FACE_QUALITY': 'face quality is too low',
+}
+
+# 'origin' metadata of originals archived after a direct enrollment
+DIRECT_ORIGIN = 'direct'
+
+
+class EnrollmentRejected(ValueError):
+    """The image will never enroll as it is; retrying does not help."""
+
+
+def rejection_reason(response, min_sharpness=20.0, min_brightness=20.0, max_yaw=35.0, max_pitch=30.0):
+    """Why an IndexFaces response should not be enrolled, or None if it is usable.
+
+    Quality scores are 0-100, pose angles in degrees.
+    """
+    unindexed = [reason for face in response.get('UnindexedFaces', [])
+                 for reason in face.get('Reasons', [])]
+    if not response['FaceRecords']:
+        if unindexed:
+            return '; '.join(sorted(set(UNINDEXED_REASONS.get(r, r) for r in unindexed)))
+        return 'no face detected'
+    if 'EXCEEDS_MAX_FACES' in unindexed:
+        return UNINDEXED_REASONS['EXCEEDS_MAX_FACES']
+
+    detail = response['FaceRecords'][0].get('FaceDetail', {})
+    quality = detail.get('Quality', {})
+    pose = detail.get('Pose', {})
+    reasons = []
+    sharpness = quality.get('Sharpness', 100)
+    brightness = quality.get('Brightness', 100)
+    if sharpness < min_sharpness:
+        reasons.append('image is blurry (sharpness {:.0f})'.format(sharpness))
+    if brightness < min_brightness:
+        reasons.append('image is too dark (brightness {:.0f})'.format(brightness))
+    if abs(pose.get('Yaw', 0)) > max_yaw or abs(pose.get('Pitch', 0)) > max_pitch:
+        reasons.append('face is turned too far from the camera')
+    return '; '.join(reasons) or None
+
+
+def identity_item(face_id, full_name, person_id=None, collection_id=None, site=None, bucket=None, key=None):
+    """The DynamoDB identity record for an enrolled face."""
+    item = {
+        'RekognitionId': {'S': face_id},
+        'FullName': {'S': full_name}
+    }
+    if person_id:
+        item['PersonId'] = {'S': person_id}
+    if collection_id:
+        item['CollectionId'] = {'S': collection_id}
+    if site:
+        item['Site'] = {'S': site}
+    if bucket and key:
+        # Kept so uncertain matches can be re-checked with compare_faces
+        item['ImageBucket'] = {'S': bucket}
+        item['ImageKey'] = {'S': key}
+    return item
+
+
+class DirectEnroller:
+    def __init__(self, rekognition, dynamodb, s3, table_name, bucket, shard_map,
+                 quality_filter='AUTO', limits=None, archive_workers=2):
+        """Enroll faces from image bytes, archiving the originals to `bucket` in the background.
+
+        limits: keyword arguments for rejection_reason.
+        """
+        self.rekognition = rekognition
+        self.dynamodb = dynamodb
+        self.s3 = s3
+        self.table_name = table_name
+        self.bucket = bucket
+        self.shard_map = shard_map
+        self.quality_filter = quality_filter
+        self.limits = limits or {}
+        self.archiver = ThreadPoolExecutor(max_workers=archive_workers, thread_name_prefix='enroll-archive')
+        self.archiving = set()
+        self.failed = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, cfg, shard_map, rekognition=None, dynamodb=None, s3=None):
+        return cls(
+            rekognition or cfg.client('rekognition'),
+            dynamodb or cfg.client('dynamodb'),
+            s3 or cfg.client('s3'),
+            cfg.table, cfg.bucket, shard_map, cfg.quality_filter,
+            limits={'min_sharpness': cfg.min_sharpness, 'min_brightness': cfg.min_brightness,
+                    'max_yaw': cfg.max_yaw, 'max_pitch': cfg.max_pitch}
+        )
+
+    def index(self, image_bytes, collection_id, person_id):
+        kwargs = dict(
+            CollectionId=collection_id,
+            Image={'Bytes': image_bytes},
+            ExternalImageId=person_id,
+            MaxFaces=1,
+            QualityFilter=self.quality_filter,
+            DetectionAttributes=['DEFAULT']
+        )
+        with metrics.timer('rekognition.index_faces'):
+            try:
+                return self.rekognition.index_faces(**kwargs)
+            except self.rekognition.exceptions.ResourceNotFoundException:
+                # First face routed to a new shard
+                self.rekognition.create_collection(CollectionId=collection_id)
+                return self.rekognition.index_faces(**kwargs)
+
+    def enroll(self, image_bytes, full_name, key, site=None, person_id=None, original=None):
+        """Index `image_bytes`, record the identity and start archiving `original` as `key`.
+
+        original: the bytes to archive when `image_bytes` is a normalized copy.
+        Returns the FaceId, searchable at once. Raises EnrollmentRejected when
+        the image can't be enrolled.
+        """
+        try:
+            person_id = identity.person_id(full_name, site, person_id)
+        except ValueError as e:
+            raise EnrollmentRejected(str(e))
+        collection_id = self.shard_map.collection_for(full_name, site)
+        try:
+            response = self.index(image_bytes, collection_id, person_id)
+        except self.rekognition.exceptions.InvalidParameterException:
+            raise EnrollmentRejected('no face detected')
+        reason = rejection_reason(response, **self.limits)
+        if reason:
+            # Do not leave a poor face in the collection to cause bad matches
+            rejected = [record['Face']['FaceId'] for record in response['FaceRecords']]
+            if rejected:
+                self.rekognition.delete_faces(CollectionId=collection_id, FaceIds=rejected)
+            metrics.incr('enroll.rejected')
+            raise EnrollmentRejected(reason)
+
+        face_id = response['FaceRecords'][0]['Face']['FaceId']
+        with metrics.timer('dynamodb.put_item'):
+            self.dynamodb.put_item(
+                TableName=self.table_name,
+                Item=identity_item(face_id, full_name, person_id, collection_id, site, self.bucket, key)
+            )
+
+        metadata = {'fullname': full_name, 'personid': person_id, 'origin': DIRECT_ORIGIN, 'faceid': face_id}
+        if site:
+            metadata['site'] = site
+        future = self.archiver.submit(self.archive, key, original if original is not None else image_bytes,
+                                      metadata)
+        with self.lock:
+            self.archiving.add(future)
+        future.add_done_callback(self._archived)
+        return face_id
+
+    def _archived(self, future):
+        # Called by the future and by wait(), whichever comes first; counted once
+        with self.lock:
+            if future not in self.archiving:
+                return
+            self.archiving.remove(future)
+            if future.exception() is not None:
+                self.failed += 1
+
+    def archive(self, key, body, metadata):
+        extra = {}
+        content_type = mimetypes.guess_type(key)[0]
+        if content_type:
+            extra['ContentType'] = content_type
+        try:
+            with metrics.timer('s3.put_object'):
+                self.s3.put_object(Bucket=self.bucket, Key=key, Body=body, Metadata=metadata, **extra)
+        except Exception as e:
+            # The face is enrolled; only compare_faces and migrations miss the original
+            metrics.incr('enroll.archive_failed')
+            print(f"Error archiving {key}: {str(e)}")
+            raise
+
+    def wait(self, timeout=None):
+        """Wait for background archiving; returns the number of originals that failed so far."""
+        with self.lock:
+            pending = list(self.archiving)
+        done, _ = wait(pending, timeout=timeout)
+        for future in done:
+            self._archived(future)
+        with self.lock:
+            return self.failed
+
+    def close(self):
+        failed = self.wait()
+        self.archiver.shutdown()
+        return failed
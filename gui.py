@@ -1,15 +1,35 @@
 import tkinter as tk
-from tkinter import ttk, messagebox
-import boto3
-import io
+from tkinter import ttk, messagebox, simpledialog
+import config
+import enrollment
 from PIL import Image, ImageTk, ImageDraw, ImageFont
 import os
 from datetime import datetime
-import csv
-import pandas as pd
 import cv2
 import numpy as np
 from tkcalendar import DateEntry
+import identity
+import metrics
+import profiling
+import argparse
+import re
+import queue
+import threading
+import quality
+from camera import CAMERA_SETTINGS, CameraOptions, FormatCache, open_camera
+from encoding import encode_frame
+from engine import ENGINE_SETTINGS, AttendanceStore, FaceDetector, RecognitionEngine
+from shards import ShardMap
+from resultlog import LogView, ResultLog
+
+# Self-enrollment: frames grabbed per burst, spacing between them, frames enrolled
+ENROLL_BURST_SIZE = 15
+ENROLL_BURST_INTERVAL_MS = 100
+ENROLL_BEST_K = 3
+# How often frames queued while AWS was unreachable are retried
+DEFERRED_REPLAY_MS = 10000
+# GUI-only settings accepted as command-line overrides
+GUI_SETTINGS = ('results_log_lines', 'results_log_file')
 
 class ModernButton(tk.Button):
     def __init__(self, master=None, **kwargs):
@@ -41,8 +61,10 @@ class ModernButton(tk.Button):
         return f'#{int(min(rgb[0]/256*1.2, 255)):02x}{int(min(rgb[1]/256*1.2, 255)):02x}{int(min(rgb[2]/256*1.2, 255)):02x}'
 
 class FaceRecognitionGUI:
-    def __init__(self, root):
+    def __init__(self, root, profiler=None, cfg=None):
         self.root = root
+        self.config = cfg or config.get()
+        self.profiler = profiler or profiling.NULL_PROFILER
         self.root.title("Face Recognition System")
         self.root.geometry("1200x700")
         self.root.configure(bg='#f0f0f0')
@@ -66,9 +88,18 @@ class FaceRecognitionGUI:
         self.last_capture_time = None
         self.date_picker = None
         self.attendance_file = None
+        self.enroll_frames = None
+        self.enroll_name = None
+        self.enrolling = False
+        self.detector = None
+        
+        # Messages go to a bounded log (full history on disk) rather than piling up in a widget
+        self.results_log = ResultLog(self.config.results_log_lines, self.config.results_log_file or None)
+        self.results_view = None
         
         # Set attendance directory using absolute path
-        self.attendance_dir = os.path.abspath("attendance")
+        self.attendance_dir = os.path.abspath(self.config.attendance_dir)
+        self.attendance = AttendanceStore.from_config(self.config)
         
         # Ensure attendance directory exists with proper permissions
         self.ensure_directory_access()
@@ -82,9 +113,14 @@ class FaceRecognitionGUI:
         
         try:
             # Initialize AWS clients with proper error handling
-            session = boto3.Session(region_name='us-east-1')
-            self.rekognition = session.client('rekognition')
-            self.dynamodb = session.client('dynamodb')
+            self.rekognition = self.config.client('rekognition')
+            self.dynamodb = self.config.client('dynamodb')
+            self.s3 = self.config.client('s3')
+            self.engine = RecognitionEngine.from_config(self.config, self.rekognition, self.dynamodb,
+                                                        self.attendance)
+            # Enrollment indexes frames itself, so new staff are recognized at once
+            self.enroller = enrollment.DirectEnroller.from_config(self.config, ShardMap.from_config(self.config),
+                                                                  self.rekognition, self.dynamodb, self.s3)
             
             # Test AWS connectivity
             self.test_aws_connection()
@@ -95,12 +131,25 @@ class FaceRecognitionGUI:
             root.destroy()
             return
         
+        # Time the callbacks that run on the Tk loop (no-op unless profiling)
+        for name in ('update_camera', 'capture_and_recognize', 'show_attendance_summary'):
+            setattr(self, name, self.profiler.wrap(name, getattr(self, name)))
+        
         # Create widgets first
         self.create_widgets()
         self.apply_styles()
         
+        self.profiler.attach_overlay(self.camera_container)
+        self.profiler.start(self.root)
+        
         # Initialize attendance file after widgets are created
         self.init_attendance_file()
+        
+        # Frames queued while AWS was unreachable are recognized off the Tk thread
+        self.deferred_results = queue.Queue()
+        self.replaying = False
+        if self.engine.deferred is not None:
+            self.root.after(DEFERRED_REPLAY_MS, self.replay_deferred)
 
     def ensure_directory_access(self):
         """Ensure the attendance directory exists and is accessible"""
@@ -130,12 +179,8 @@ class FaceRecognitionGUI:
 
     def init_attendance_file(self):
         try:
-            if self.date_picker is None:
-                today = datetime.now()
-                self.attendance_file = os.path.join(self.attendance_dir, f"attendance_{today.strftime('%Y-%m-%d')}.csv")
-            else:
-                selected_date = self.date_picker.get_date()
-                self.attendance_file = os.path.join(self.attendance_dir, f"attendance_{selected_date.strftime('%Y-%m-%d')}.csv")
+            selected_date = self.date_picker.get_date() if self.date_picker is not None else None
+            self.attendance_file = self.attendance.path_for(selected_date)
             
             # Ensure directory exists and is writable
             self.ensure_directory_access()
@@ -143,9 +188,7 @@ class FaceRecognitionGUI:
             # Create file with headers only if it doesn't exist
             if not os.path.exists(self.attendance_file):
                 try:
-                    with open(self.attendance_file, 'w', newline='', encoding='utf-8') as f:
-                        writer = csv.writer(f)
-                        writer.writerow(['Name', 'Date', 'Time'])
+                    self.attendance.ensure_file(selected_date)
                 except PermissionError:
                     messagebox.showerror(
                         "Permission Error",
@@ -160,29 +203,11 @@ class FaceRecognitionGUI:
 
     def mark_attendance(self, name):
         try:
-            if self.date_picker is None:
-                selected_date = datetime.now()
-            else:
-                selected_date = self.date_picker.get_date()
-            
-            # Format date as string
-            date_str = selected_date.strftime('%Y-%m-%d')
-            self.attendance_file = os.path.join(self.attendance_dir, f"attendance_{date_str}.csv")
-            
-            # Create directory if it doesn't exist
-            os.makedirs(self.attendance_dir, exist_ok=True)
-            
-            # Create file with headers if it doesn't exist
-            if not os.path.exists(self.attendance_file):
-                with open(self.attendance_file, 'w', newline='', encoding='utf-8') as f:
-                    writer = csv.writer(f)
-                    writer.writerow(['Name', 'Date', 'Time'])
+            selected_date = self.selected_date()
+            self.attendance_file = self.attendance.path_for(selected_date)
             
             # Append attendance
-            current_time = datetime.now().strftime('%H:%M:%S')
-            with open(self.attendance_file, 'a', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                writer.writerow([name, date_str, current_time])
+            date_str, current_time = self.attendance.mark(name, selected_date)
             
             self.update_results(f"✅ Marked attendance for {name} on {date_str} at {current_time}")
             return True
@@ -191,46 +216,35 @@ class FaceRecognitionGUI:
             self.update_results(f"Error marking attendance: {str(e)}")
             return False
 
+    def selected_date(self):
+        """Date chosen in the date picker, or today before it exists"""
+        if self.date_picker is None:
+            return datetime.now()
+        return self.date_picker.get_date()
+
     def show_attendance_summary(self):
         try:
             selected_date = self.date_picker.get_date()
             date_str = selected_date.strftime('%Y-%m-%d')
-            attendance_file = os.path.join(self.attendance_dir, f"attendance_{date_str}.csv")
-            
-            if not os.path.exists(attendance_file):
-                self.update_results(f"No attendance records found for {date_str}")
-                return
             
             try:
-                # Read CSV file
-                df = pd.read_csv(attendance_file)
-                
-                # Convert Date column to datetime and format it
-                if 'Date' in df.columns and not df.empty:
-                    df['Date'] = pd.to_datetime(df['Date']).dt.strftime('%Y-%m-%d')
-                
-                if df.empty:
-                    self.update_results(f"No attendance records found for {date_str}")
-                    return
-                
-                # Filter records for selected date
-                df_date = df[df['Date'] == date_str]
-                
-                if df_date.empty:
-                    self.update_results(f"No attendance records found for {date_str}")
-                    return
-                
-                summary = f"Attendance Summary for {date_str}:\n\n"
-                for _, row in df_date.iterrows():
-                    summary += f"{row['Name']}: {row['Time']}\n"
-                
-                total_present = len(df_date)
-                summary += f"\nTotal Present: {total_present}"
-                
-                self.update_results(summary)
-                
+                # Live file and archive alike
+                rows = [row for row in self.attendance.read(selected_date) if row.get('Date') == date_str]
             except Exception as e:
                 self.update_results(f"Error reading attendance file: {str(e)}")
+                return
+            
+            if not rows:
+                self.update_results(f"No attendance records found for {date_str}")
+                return
+            
+            summary = f"Attendance Summary for {date_str}:\n\n"
+            for row in rows:
+                summary += f"{row['Name']}: {row['Time']}\n"
+            
+            summary += f"\nTotal Present: {len(rows)}"
+            
+            self.update_results(summary)
             
         except Exception as e:
             self.update_results(f"Error showing attendance summary: {str(e)}")
@@ -336,6 +350,16 @@ class FaceRecognitionGUI:
         )
         self.capture_btn.pack(side=tk.LEFT, padx=5)
         
+        self.enroll_btn = ModernButton(
+            controls_frame,
+            text="👤 Enroll",
+            command=self.start_enrollment,
+            state='disabled',
+            background=self.colors['warning'],
+            foreground=self.colors['text']
+        )
+        self.enroll_btn.pack(side=tk.LEFT, padx=5)
+        
         # Add View Attendance button
         self.view_btn = ModernButton(
             controls_frame,
@@ -354,9 +378,10 @@ class FaceRecognitionGUI:
                  text="Recognition Results", 
                  style='Subtitle.TLabel').pack(pady=10)
         
-        # Results text area with custom font and colors
-        self.results_text = tk.Text(
+        # Results log with custom font and colors; only the visible rows are in the widget
+        self.results_view = LogView(
             right_frame,
+            self.results_log,
             height=20,
             width=40,
             font=('Consolas', 11),
@@ -366,7 +391,7 @@ class FaceRecognitionGUI:
             padx=10,
             pady=10
         )
-        self.results_text.pack(fill=tk.BOTH, expand=True, padx=10, pady=(0, 10))
+        self.results_view.pack(fill=tk.BOTH, expand=True, padx=10, pady=(0, 10))
         
         # Last capture time label
         self.time_label = ttk.Label(
@@ -415,34 +440,29 @@ class FaceRecognitionGUI:
     def test_aws_connection(self):
         """Test AWS connectivity and required resources"""
         try:
-            # Test Rekognition collection exists
-            self.rekognition.describe_collection(CollectionId='facerecognition_collection')
+            # Test Rekognition collection exists (shards are created as faces are enrolled)
+            if self.engine.searcher is None:
+                self.rekognition.describe_collection(CollectionId=self.config.collection)
             
             # Test DynamoDB table exists
-            self.dynamodb.describe_table(TableName='facerecognition')
+            self.dynamodb.describe_table(TableName=self.config.table)
             
         except self.rekognition.exceptions.ResourceNotFoundException:
-            raise Exception("Rekognition collection 'facerecognition_collection' not found")
+            raise Exception(f"Rekognition collection '{self.config.collection}' not found")
         except self.dynamodb.exceptions.ResourceNotFoundException:
-            raise Exception("DynamoDB table 'facerecognition' not found")
+            raise Exception(f"DynamoDB table '{self.config.table}' not found")
         except Exception as e:
             raise Exception(f"AWS connection test failed: {str(e)}")
 
     def toggle_camera(self):
         if not self.is_camera_on:
             try:
-                # Initialize camera
-                self.cap = cv2.VideoCapture(0, cv2.CAP_DSHOW)  # Try DirectShow backend
-                if not self.cap.isOpened():
-                    # Try default backend if DirectShow fails
-                    self.cap = cv2.VideoCapture(0)
-                    if not self.cap.isOpened():
-                        raise Exception("Could not open camera!")
-                
-                # Test frame capture
-                ret, frame = self.cap.read()
-                if not ret or frame is None:
-                    raise Exception("Could not read from camera!")
+                # Initialize camera; the first start benchmarks the formats, later ones use the cached pick
+                options = CameraOptions.from_config(self.config)
+                if options.probe and FormatCache(options.cache_path).get(options.key(0)) is None:
+                    self.status_label.configure(text="Camera: finding the fastest format...")
+                    self.root.update()
+                self.cap = open_camera(0, options)
                 
                 self.is_camera_on = True
                 self.camera_btn.configure(
@@ -450,6 +470,7 @@ class FaceRecognitionGUI:
                     background=self.colors['danger']
                 )
                 self.capture_btn['state'] = 'normal'
+                self.enroll_btn['state'] = 'disabled' if self.enrolling else 'normal'
                 self.status_label.configure(text="Camera: ON")
                 self.update_camera()
                 
@@ -469,6 +490,8 @@ class FaceRecognitionGUI:
             background=self.colors['primary']
         )
         self.capture_btn['state'] = 'disabled'
+        self.enroll_btn['state'] = 'disabled'
+        self.enroll_frames = None
         self.status_label.configure(text="Camera: OFF")
         # Display camera icon
         self.camera_label.configure(image=self.camera_icon)
@@ -477,27 +500,29 @@ class FaceRecognitionGUI:
     def update_camera(self):
         if self.is_camera_on and self.cap is not None:
             try:
-                ret, frame = self.cap.read()
+                with metrics.timer('camera.capture'):
+                    ret, frame = self.cap.read()
                 if ret and frame is not None:
                     self.current_frame = frame
                     
-                    # Convert BGR to RGB
-                    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    
-                    # Convert to PIL Image
-                    image = Image.fromarray(frame_rgb)
-                    
-                    # Resize frame while maintaining aspect ratio
-                    width, height = image.size
-                    max_size = 500
-                    scale = min(max_size/width, max_size/height)
-                    new_width = int(width * scale)
-                    new_height = int(height * scale)
-                    image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                    
-                    photo = ImageTk.PhotoImage(image)
-                    self.camera_label.configure(image=photo)
-                    self.camera_label.image = photo
+                    with metrics.timer('camera.render'), self.profiler.timer('frame_render'):
+                        # Convert BGR to RGB
+                        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                        
+                        # Convert to PIL Image
+                        image = Image.fromarray(frame_rgb)
+                        
+                        # Resize frame while maintaining aspect ratio
+                        width, height = image.size
+                        max_size = 500
+                        scale = min(max_size/width, max_size/height)
+                        new_width = int(width * scale)
+                        new_height = int(height * scale)
+                        image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+                        
+                        photo = ImageTk.PhotoImage(image)
+                        self.camera_label.configure(image=photo)
+                        self.camera_label.image = photo
                 else:
                     raise Exception("Failed to capture frame")
                 
@@ -507,6 +532,13 @@ class FaceRecognitionGUI:
                 messagebox.showerror("Camera Error", f"Camera error: {str(e)}")
                 self.stop_camera()
     
+    def read_frame(self):
+        """Grab a fresh frame for a second look at an uncertain match."""
+        if self.cap is None:
+            return None
+        ret, frame = self.cap.read()
+        return frame if ret else None
+    
     def capture_and_recognize(self):
         if self.current_frame is None:
             messagebox.showerror("Error", "No frame captured!")
@@ -519,90 +551,176 @@ class FaceRecognitionGUI:
                 text=f"Last capture: {self.last_capture_time.strftime('%H:%M:%S')}"
             )
             
-            # Convert frame to bytes
-            frame_rgb = cv2.cvtColor(self.current_frame, cv2.COLOR_BGR2RGB)
-            img = Image.fromarray(frame_rgb)
-            img_byte_arr = io.BytesIO()
-            img.save(img_byte_arr, format='JPEG')
-            image_bytes = img_byte_arr.getvalue()
-            
-            # Clear previous results
-            self.results_text.delete(1.0, tk.END)
-            self.results_text.insert(tk.END, "🔍 Processing...\n\n")
+            # Each capture starts a new block in the results log
+            self.update_results(f"\n🔍 Processing capture at {self.last_capture_time.strftime('%H:%M:%S')}...\n")
+            self.results_view.flush()
             self.root.update()
             
-            try:
-                # Search faces in Rekognition
-                response = self.rekognition.search_faces_by_image(
-                    CollectionId='facerecognition_collection',
-                    Image={'Bytes': image_bytes},
-                    MaxFaces=5,
-                    FaceMatchThreshold=80
-                )
-                
-            except self.rekognition.exceptions.InvalidParameterException:
-                self.results_text.delete(1.0, tk.END)
-                self.results_text.insert(tk.END, "❌ No face detected in the image. Please try again.\n")
-                return
-            except Exception as e:
-                self.results_text.delete(1.0, tk.END)
-                self.results_text.insert(tk.END, f"❌ Recognition error: {str(e)}\n")
-                return
-            
-            # Clear processing message
-            self.results_text.delete(1.0, tk.END)
+            result = self.engine.recognize_frame(self.current_frame, date=self.selected_date(),
+                                                 next_frame=self.read_frame)
             
             # Process results
-            if not response['FaceMatches']:
-                self.results_text.insert(tk.END, "❌ No matching faces found.\n")
+            if result['status'] == 'no_face':
+                self.update_results("❌ No face detected in the image. Please try again.")
+                return
+            if result['status'] == 'error':
+                self.update_results(f"❌ {result['error']}")
+                return
+            if result['status'] == 'deferred':
+                self.update_results("⏳ Recognition service is unavailable. "
+                                    "This capture will be recognized when it is back.")
+                return
+            if result['status'] == 'no_match':
+                self.update_results("❌ No matching faces found.")
+                return
+            if result['status'] == 'uncertain':
+                self.update_results("⚠️ Not sure who this is. Please face the camera and try again.\n")
+                for candidate in result['candidates']:
+                    if candidate['name'] is not None:
+                        self.update_results(f"   {candidate['name']}: {candidate['similarity']:.2f}%")
                 return
                 
-            self.results_text.insert(tk.END, "✅ Matching Faces Found:\n")
-            self.results_text.insert(tk.END, "=" * 40 + "\n\n")
+            self.update_results("✅ Matching Faces Found:")
+            self.update_results("=" * 40 + "\n")
             
-            for match in response['FaceMatches']:
-                face_id = match['Face']['FaceId']
-                confidence = match['Face']['Confidence']
-                
-                try:
-                    # Get person details from DynamoDB
-                    face_data = self.dynamodb.get_item(
-                        TableName='facerecognition',
-                        Key={'RekognitionId': {'S': face_id}}
-                    )
-                    
-                    if 'Item' in face_data:
-                        name = face_data['Item']['FullName']['S']
-                        self.results_text.insert(tk.END, f"👤 Name: {name}\n")
-                        self.results_text.insert(tk.END, f"📊 Confidence: {confidence:.2f}%\n")
-                        
-                        # Mark attendance
-                        if self.mark_attendance(name):
-                            self.results_text.insert(tk.END, "✅ Attendance Marked\n")
-                        else:
-                            self.results_text.insert(tk.END, "ℹ️ Already marked present\n")
-                        
-                        self.results_text.insert(tk.END, "-" * 40 + "\n\n")
-                    
-                except Exception as e:
-                    self.results_text.insert(tk.END, f"❌ Error fetching person details: {str(e)}\n")
+            for match in result['matches']:
+                if match['name'] is None:
+                    if 'error' in match:
+                        self.update_results(f"❌ {match['error']}")
                     continue
+                
+                self.update_results(f"👤 Name: {match['name']}")
+                self.update_results(f"📊 Confidence: {match['confidence']:.2f}%")
+                
+                if match['attendance']:
+                    self.update_results(f"✅ Marked attendance for {match['name']} on {match['date']} at {match['time']}")
+                elif 'error' in match:
+                    self.update_results(f"❌ {match['error']}")
+                else:
+                    self.update_results("ℹ️ Already marked present")
+                
+                self.update_results("-" * 40 + "\n")
             
             # Show attendance summary
             self.show_attendance_summary()
                 
         except Exception as e:
-            self.results_text.delete(1.0, tk.END)
-            self.results_text.insert(tk.END, f"❌ Error: {str(e)}\n")
+            self.update_results(f"❌ Error: {str(e)}")
+    
+    def replay_deferred(self):
+        """Report deferred recognitions that finished, then start another round."""
+        while True:
+            try:
+                result = self.deferred_results.get_nowait()
+            except queue.Empty:
+                break
+            for match in result['matches']:
+                if match['attendance']:
+                    self.update_results(f"✅ Marked attendance for {match['name']} on {match['date']} "
+                                        f"(captured {result['captured']})")
+        
+        if not self.replaying:
+            self.replaying = True
+            
+            def worker():
+                try:
+                    for result in self.engine.recognize_deferred():
+                        self.deferred_results.put(result)
+                finally:
+                    self.replaying = False
+            
+            threading.Thread(target=worker, name='deferred-replay', daemon=True).start()
+        self.root.after(DEFERRED_REPLAY_MS, self.replay_deferred)
+    
+    def start_enrollment(self):
+        """Grab a burst of frames for self-enrollment; the best ones are enrolled."""
+        if not self.config.bucket:
+            messagebox.showerror("Enrollment Error",
+                                 "Set the enrollment bucket first (bucket in facerecognition.ini "
+                                 "or FACE_RECOGNITION_BUCKET).")
+            return
+        name = simpledialog.askstring("Enroll", "Full name of the person in front of the camera:",
+                                      parent=self.root)
+        if not name or not name.strip():
+            return
+        
+        self.enroll_name = name.strip()
+        self.enroll_frames = []
+        self.enroll_btn['state'] = 'disabled'
+        self.update_results(f"\n📸 Enrolling {self.enroll_name}: look at the camera and hold still...")
+        self.collect_enrollment_frame()
+    
+    def collect_enrollment_frame(self):
+        if self.enroll_frames is None:
+            # Camera was stopped mid-burst
+            return
+        if self.current_frame is not None:
+            self.enroll_frames.append(self.current_frame.copy())
+        if len(self.enroll_frames) < ENROLL_BURST_SIZE:
+            self.root.after(ENROLL_BURST_INTERVAL_MS, self.collect_enrollment_frame)
+        else:
+            self.finish_enrollment()
+    
+    def finish_enrollment(self):
+        frames, self.enroll_frames = self.enroll_frames, None
+        self.enrolling = True
+        # index_faces and put_item cost a round trip per frame; keep them off the Tk thread
+        threading.Thread(target=self.enroll_burst, args=(frames, self.enroll_name, self.config.site or None),
+                         name='enroll', daemon=True).start()
+    
+    def enroll_burst(self, frames, name, site):
+        """Enroll the best frames of a burst on a worker thread, posting progress to the Tk thread."""
+        def report(message):
+            self.root.after(0, self.update_results, message)
+        
+        try:
+            if self.detector is None:
+                self.detector = FaceDetector(min_size=quality.MIN_FACE_SIZE)
+            best = quality.select_best(frames, ENROLL_BEST_K, self.detector)
+            if not best:
+                report("❌ No usable face in the burst. Check the lighting, face the camera and try again.")
+                return
+            
+            report(f"⏳ Enrolling {len(best)} of {len(frames)} frames...")
+            
+            # Every frame of the burst is attached to the same person
+            person_id = identity.person_id(name, site)
+            slug = re.sub(r'[^A-Za-z0-9]+', '-', person_id)
+            stamp = datetime.now().strftime('%Y%m%d%H%M%S')
+            enrolled = 0
+            for i, (frame, frame_quality) in enumerate(best):
+                # Indexed now; the frame is archived to the bucket in the background
+                try:
+                    self.enroller.enroll(encode_frame(frame), name, f"enroll/{slug}-{stamp}-{i}.jpg",
+                                         site=site, person_id=person_id)
+                except enrollment.EnrollmentRejected as e:
+                    report(f"⚠️ Frame {i + 1} rejected: {str(e)}")
+                    continue
+                enrolled += 1
+                report(f"✅ Frame {i + 1}: quality {frame_quality['score']:.2f} "
+                       f"(sharpness {frame_quality['sharpness']:.0f})")
+            if enrolled:
+                report(f"Enrolled {name} with {enrolled} images")
+            else:
+                report(f"❌ No frame of {name} could be enrolled. Try again.")
+        except Exception as e:
+            report(f"❌ Error enrolling images: {str(e)}")
+        finally:
+            self.root.after(0, self.enrollment_done)
+    
+    def enrollment_done(self):
+        self.enrolling = False
+        self.enroll_btn['state'] = 'normal' if self.is_camera_on else 'disabled'
     
     def __del__(self):
         self.stop_camera()
 
     def update_results(self, message):
-        """Helper method to update results text area"""
-        if hasattr(self, 'results_text'):
-            self.results_text.insert(tk.END, message + "\n")
-            self.results_text.see(tk.END)  # Scroll to the end
+        """Add a message to the results log; the panel redraws at most once per frame"""
+        if self.results_view is not None:
+            self.results_view.append(message)
+        else:
+            self.results_log.append(message)
 
     def create_camera_icon(self):
         """Create a camera icon for display when camera is off"""
@@ -848,7 +966,7 @@ class FaceRecognitionGUI:
         
         ttk.Label(
             option2_frame,
-            text="Archives all existing attendance records and starts fresh.\nOld records are safely stored in a timestamped archive folder.",
+            text="Archives all existing attendance records and starts fresh.\nOld records are compressed into monthly folders under archive/.",
             foreground=self.colors['text'],
             justify=tk.LEFT
         ).pack(anchor=tk.W, pady=(5, 10))
@@ -887,22 +1005,13 @@ class FaceRecognitionGUI:
     def clear_current_attendance(self):
         """Clear all values from current attendance sheet except headers"""
         try:
-            if self.date_picker is None:
-                selected_date = datetime.now()
-            else:
-                selected_date = self.date_picker.get_date()
-            
+            selected_date = self.selected_date()
             date_str = selected_date.strftime('%Y-%m-%d')
-            attendance_file = os.path.join(self.attendance_dir, f"attendance_{date_str}.csv")
             
-            if not os.path.exists(attendance_file):
+            # Truncate to only headers
+            if not self.attendance.clear(selected_date):
                 return False
             
-            # Create new file with only headers
-            with open(attendance_file, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                writer.writerow(['Name', 'Date', 'Time'])
-            
             self.update_results(f"Attendance sheet cleared for {date_str}")
             return True
             
@@ -913,18 +1022,12 @@ class FaceRecognitionGUI:
     def create_new_attendance_sheet(self):
         """Create a new attendance sheet with timestamp"""
         try:
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            new_dir = os.path.join(self.attendance_dir, f"archive_{timestamp}")
-            os.makedirs(new_dir, exist_ok=True)
+            # Roll every attendance file into the compressed archive
+            rolled = self.attendance.archive()
             
-            # Move all existing attendance files to archive
-            for file in os.listdir(self.attendance_dir):
-                if file.startswith('attendance_') and file.endswith('.csv'):
-                    old_path = os.path.join(self.attendance_dir, file)
-                    new_path = os.path.join(new_dir, file)
-                    os.rename(old_path, new_path)
-            
-            self.update_results(f"Previous attendance files archived to: archive_{timestamp}")
+            months = ', '.join(rolled) or 'nothing to archive'
+            self.update_results(f"Archived {sum(rolled.values())} days of attendance to "
+                                f"{self.attendance.archiver.root} ({months})")
             
             # Initialize new attendance file
             self.init_attendance_file()
@@ -935,9 +1038,35 @@ class FaceRecognitionGUI:
             return False
 
 def main():
+    parser = argparse.ArgumentParser(description='Face Recognition System GUI')
+    parser.add_argument('--profile', action='store_true',
+                        help='Record event-loop lag and callback timings, with a live overlay')
+    parser.add_argument('--profile-output', default='gui_profile.pstats',
+                        help='Where to write cProfile stats on exit')
+    parser.add_argument('--profile-buffer', type=int, default=2000,
+                        help='Samples kept per callback')
+    config.add_arguments(parser, *ENGINE_SETTINGS, *CAMERA_SETTINGS, *GUI_SETTINGS)
+    args = parser.parse_args()
+    
+    cfg = config.from_args(args, *ENGINE_SETTINGS, *CAMERA_SETTINGS, *GUI_SETTINGS)
+    cfg.configure_metrics()
+    profiler = None
+    if args.profile:
+        profiler = profiling.LoopProfiler(capacity=args.profile_buffer,
+                                          pstats_path=args.profile_output)
+    
     root = tk.Tk()
-    app = FaceRecognitionGUI(root)
-    root.mainloop()
+    app = FaceRecognitionGUI(root, profiler, cfg)
+    try:
+        root.mainloop()
+    finally:
+        app.attendance.close()
+        app.results_log.close()
+        if getattr(app, 'enroller', None) is not None:
+            # Let originals of the last enrollments reach the bucket
+            app.enroller.close()
+        if profiler is not None:
+            profiler.stop()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,56 @@
+"""Person ids: one person, many enrolled faces.
+
+Every face is indexed with its person id as the Rekognition ExternalImageId
+and the id is stored as PersonId on the face's identity record. Searches
+return the ExternalImageId with each match, so matches of several photos
+of one person can be collapsed before any DynamoDB lookup.
+
+A person id is derived from the name (and site) unless one is given at
+enrollment, which is how two different people with the same name are told
+apart:
+
+    John Doe               -> john-doe
+    John Doe at site "hq"  -> hq:john-doe
+"""
+import re
+import unicodedata
+import zlib
+
+# ExternalImageId allows [a-zA-Z0-9_.\-:]+, up to 255 characters
+_INVALID = re.compile(r'[^a-z0-9_.\-:]+')
+
+
+def _slug(text):
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
+    return _INVALID.sub('-', text.strip().lower()).strip('-')
+
+
+def person_id(full_name, site=None, explicit=None):
+    """The person id to enroll a face under."""
+    if explicit:
+        pid = _slug(explicit)
+        if not pid:
+            raise ValueError("Invalid person id: {!r}".format(explicit))
+        return pid[:255]
+    # Names in scripts without an ASCII transliteration still get a stable id
+    pid = _slug(full_name) or 'person-{:08x}'.format(zlib.crc32(full_name.encode('utf-8')))
+    if site:
+        pid = '{}:{}'.format(_slug(site), pid)
+    return pid[:255]
+
+
+def match_person(match):
+    """Person id of a search match, or its face id for faces enrolled without one."""
+    face = match['Face']
+    return face.get('ExternalImageId') or face['FaceId']
+
+
+def collapse(matches):
+    """The best match of each person, best first."""
+    best = {}
+    for match in matches:
+        key = match_person(match)
+        similarity = match.get('Similarity', match['Face']['Confidence'])
+        if key not in best or similarity > best[key][0]:
+            best[key] = (similarity, match)
+    return [match for _, match in sorted(best.values(), key=lambda entry: entry[0], reverse=True)]
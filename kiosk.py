@@ -0,0 +1,362 @@
+"""Headless kiosk daemon.
+
+Runs the recognition pipeline on a camera, video file or stream without a
+display and streams every recognition event as one JSON object per line, on
+stdout or to clients of a local TCP socket.
+
+    python kiosk.py --source 0 --interval 2
+    python kiosk.py --source entrance.mp4 --detect --max-frames 500
+    python kiosk.py --socket 127.0.0.1:9000
+
+With several sources, each stream's capture, local detection and JPEG
+encoding run in a worker process of their own. Recognition requests from
+all streams go through one rate-limited pool of client threads, and
+attendance is written to one shared store:
+
+    python kiosk.py --source 0 --source 1 --source rtsp://door-2/stream --rate 10
+"""
+import argparse
+import json
+import multiprocessing
+import queue
+import signal
+import socket
+import sys
+import threading
+import time
+
+import config
+import metrics
+from camera import CAMERA_SETTINGS, CameraOptions, open_camera
+from encoding import encode_frame
+from engine import ENGINE_SETTINGS, AttendanceStore, FaceDetector, RecognitionEngine
+from ratelimit import TokenBucket
+
+KIOSK_SETTINGS = ('attendance_dir', 'attendance_table', 'request_deadline', 'deferred_dir')
+# Seconds capture processes get to exit after a stop before they are terminated
+SHUTDOWN_TIMEOUT = 10.0
+
+
+class StdoutSink:
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    def emit(self, event):
+        line = json.dumps(event) + "\n"
+        with self.lock:
+            sys.stdout.write(line)
+            sys.stdout.flush()
+
+    def close(self):
+        pass
+
+
+class SocketSink:
+    def __init__(self, host, port):
+        """Broadcast JSONL events to every client connected to host:port."""
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, int(port)))
+        self.server.listen()
+        self.clients = []
+        self.lock = threading.Lock()
+        threading.Thread(target=self._accept, name='kiosk-accept', daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self.server.accept()
+            except OSError:
+                return
+            with self.lock:
+                self.clients.append(client)
+
+    def emit(self, event):
+        line = (json.dumps(event) + "\n").encode('utf-8')
+        with self.lock:
+            for client in list(self.clients):
+                try:
+                    client.sendall(line)
+                except OSError:
+                    # Drop clients that went away
+                    self.clients.remove(client)
+                    client.close()
+
+    def close(self):
+        self.server.close()
+        with self.lock:
+            for client in self.clients:
+                client.close()
+            self.clients = []
+
+
+def next_frame(cap):
+    ret, frame = cap.read()
+    return frame if ret else None
+
+
+class KioskDaemon:
+    def __init__(self, engine, source, sink, interval=2.0, detector=None, max_frames=None, camera=None):
+        """Capture frames continuously and recognize at most one every `interval` seconds.
+
+        camera: CameraOptions for the capture format (probed by default).
+        """
+        self.engine = engine
+        self.source = source
+        self.camera = camera
+        self.sink = sink
+        self.interval = interval
+        self.detector = detector
+        self.max_frames = max_frames
+        self.stopped = threading.Event()
+
+    def stop(self, *args):
+        self.stopped.set()
+
+    def process(self, frame, next_frame=None):
+        """Recognize one frame, returning the event or None if it was skipped.
+
+        next_frame: optional callable returning a fresh frame for a second
+        look at uncertain matches.
+        """
+        if self.detector is not None and not self.detector.detect(frame):
+            metrics.incr('detect.skipped')
+            return None
+        event = {'event': 'recognition', 'source': str(self.source)}
+        event.update(self.engine.recognize_frame(frame, next_frame=next_frame))
+        return event
+
+    def run(self):
+        cap = open_camera(self.source, self.camera)
+        self.sink.emit({'event': 'started', 'source': str(self.source)})
+        frames = 0
+        last_recognition = 0.0
+        try:
+            while not self.stopped.is_set():
+                with metrics.timer('camera.capture'):
+                    ret, frame = cap.read()
+                if not ret or frame is None:
+                    # End of a file source, or the camera dropped out
+                    self.sink.emit({'event': 'source_ended', 'source': str(self.source)})
+                    break
+                frames += 1
+                if self.max_frames and frames >= self.max_frames:
+                    self.stopped.set()
+
+                now = time.monotonic()
+                if now - last_recognition < self.interval:
+                    continue
+                last_recognition = now
+
+                event = self.process(frame, lambda: next_frame(cap))
+                if event is not None:
+                    self.sink.emit(event)
+        finally:
+            cap.release()
+            self.sink.emit({'event': 'stopped', 'source': str(self.source), 'frames': frames})
+
+
+def replay_deferred(engine, sink, stopped, interval=5.0):
+    """Recognize frames queued while the service was down, once it answers again."""
+    while not stopped.wait(interval):
+        for result in engine.recognize_deferred():
+            event = {'event': 'recognition', 'source': 'deferred'}
+            event.update(result)
+            sink.emit(event)
+
+
+def capture_worker(source, requests, events, stop, interval, detect, max_frames, camera=None):
+    """Per-stream process: capture, detect locally and hand encoded frames to the pool."""
+    # The parent owns shutdown; ignore Ctrl+C here and wait for `stop`
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    source = str(source)
+    try:
+        cap = open_camera(source, camera)
+    except Exception as e:
+        events.put({'event': 'error', 'source': source, 'error': str(e)})
+        return
+
+    detector = FaceDetector() if detect else None
+    events.put({'event': 'started', 'source': source})
+    frames = 0
+    dropped = 0
+    last_request = 0.0
+    try:
+        while not stop.is_set():
+            ret, frame = cap.read()
+            if not ret or frame is None:
+                events.put({'event': 'source_ended', 'source': source})
+                break
+            frames += 1
+            if max_frames and frames >= max_frames:
+                break
+
+            now = time.monotonic()
+            if now - last_request < interval:
+                continue
+            if detector is not None and not detector.detect(frame):
+                continue
+            last_request = now
+
+            try:
+                requests.put_nowait((source, encode_frame(frame), time.time()))
+            except queue.Full:
+                # The pool is saturated; a newer frame will come along
+                dropped += 1
+    finally:
+        cap.release()
+        events.put({'event': 'stopped', 'source': source, 'frames': frames, 'dropped': dropped})
+
+
+class MultiStreamKiosk:
+    def __init__(self, engine, sources, sink, interval=2.0, detect=False,
+                 workers=4, rate=5.0, max_frames=None, camera=None):
+        """Run one capture process per source feeding a shared recognition pool.
+
+        workers: client threads issuing recognition requests
+        rate:    recognition requests per second across all streams
+        camera:  CameraOptions every stream is opened with
+        """
+        self.engine = engine
+        self.sources = [str(source) for source in sources]
+        self.sink = sink
+        self.interval = interval
+        self.detect = detect
+        self.workers = workers
+        self.limiter = TokenBucket(rate)
+        self.max_frames = max_frames
+        self.camera = camera
+
+        # Bounded so a slow service sheds stale frames instead of queueing them
+        self.requests = multiprocessing.Queue(maxsize=max(2, workers * 2))
+        self.events = multiprocessing.Queue()
+        self.stopped = multiprocessing.Event()
+
+    def stop(self, *args):
+        self.stopped.set()
+
+    def recognize_loop(self):
+        while True:
+            item = self.requests.get()
+            if item is None:
+                return
+            source, image_bytes, captured_at = item
+            self.limiter.acquire()
+            event = {'event': 'recognition', 'source': source,
+                     'queue_ms': round((time.time() - captured_at) * 1000.0, 1)}
+            event.update(self.engine.recognize_bytes(image_bytes))
+            self.sink.emit(event)
+
+    def drain_events(self, timeout):
+        try:
+            self.sink.emit(self.events.get(timeout=timeout))
+            while True:
+                self.sink.emit(self.events.get_nowait())
+        except queue.Empty:
+            pass
+
+    def run(self):
+        processes = [
+            multiprocessing.Process(
+                target=capture_worker,
+                args=(source, self.requests, self.events, self.stopped,
+                      self.interval, self.detect, self.max_frames, self.camera),
+                name='capture-{}'.format(i),
+                daemon=True
+            )
+            for i, source in enumerate(self.sources)
+        ]
+        threads = [threading.Thread(target=self.recognize_loop, name='recognize-{}'.format(i), daemon=True)
+                   for i in range(self.workers)]
+        for process in processes:
+            process.start()
+        for thread in threads:
+            thread.start()
+
+        try:
+            while any(process.is_alive() for process in processes):
+                self.drain_events(0.2)
+        finally:
+            self.stopped.set()
+            # A process only exits once what it queued is flushed, so keep draining while it stops
+            deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+            while any(process.is_alive() for process in processes) and time.monotonic() < deadline:
+                self.drain_events(0.1)
+            for process in processes:
+                process.join(timeout=0.5)
+                if process.is_alive():
+                    process.terminate()
+                    process.join(timeout=0.5)
+            # Let the pool finish what was already captured, then stop it
+            for _ in threads:
+                self.requests.put(None)
+            for thread in threads:
+                thread.join()
+            self.drain_events(0.1)
+
+
+def parse_address(value):
+    host, _, port = value.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless face recognition kiosk')
+    parser.add_argument('--source', action='append',
+                        help='Camera index, video file or stream URL (repeat for several streams)')
+    parser.add_argument('--interval', type=float, default=2.0,
+                        help='Minimum seconds between recognition requests')
+    parser.add_argument('--detect', action='store_true',
+                        help='Only call Rekognition when a face is detected locally')
+    parser.add_argument('--cooldown', type=float,
+                        help='Seconds before the same person is marked present again (default: kiosk_cooldown)')
+    parser.add_argument('--socket', help='Serve events on HOST:PORT instead of stdout')
+    parser.add_argument('--max-frames', type=int, help='Stop after this many frames per stream')
+    parser.add_argument('--workers', type=int,
+                        help='Recognition client threads shared by all streams (default: kiosk_workers)')
+    parser.add_argument('--rate', type=float,
+                        help='Recognition requests per second across all streams, 0 for no limit '
+                             '(default: kiosk_rate)')
+    config.add_arguments(parser, *ENGINE_SETTINGS, *KIOSK_SETTINGS, *CAMERA_SETTINGS)
+    args = parser.parse_args()
+    sources = args.source or ['0']
+
+    cfg = config.from_args(args, *ENGINE_SETTINGS, *KIOSK_SETTINGS, *CAMERA_SETTINGS)
+    cfg.configure_metrics()
+    camera = CameraOptions.from_config(cfg)
+    cooldown = cfg.kiosk_cooldown if args.cooldown is None else args.cooldown
+    workers = cfg.kiosk_workers if args.workers is None else args.workers
+    rate = cfg.kiosk_rate if args.rate is None else args.rate
+
+    engine = RecognitionEngine.from_config(
+        cfg,
+        cfg.client('rekognition', max_pool_connections=max(cfg.max_pool_connections, workers)),
+        cfg.client('dynamodb'),
+        AttendanceStore.from_config(cfg),
+        cooldown=cooldown
+    )
+    sink = SocketSink(*parse_address(args.socket)) if args.socket else StdoutSink()
+    if len(sources) > 1:
+        daemon = MultiStreamKiosk(engine, sources, sink, args.interval, args.detect,
+                                  workers, rate, args.max_frames, camera)
+    else:
+        detector = FaceDetector() if args.detect else None
+        daemon = KioskDaemon(engine, sources[0], sink, args.interval, detector, args.max_frames, camera)
+    if engine.deferred is not None:
+        threading.Thread(target=replay_deferred, args=(engine, sink, daemon.stopped),
+                         name='kiosk-replay', daemon=True).start()
+    signal.signal(signal.SIGINT, daemon.stop)
+    signal.signal(signal.SIGTERM, daemon.stop)
+
+    try:
+        daemon.run()
+    except Exception as e:
+        print(f"Kiosk error: {str(e)}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        sink.close()
+        engine.attendance.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,40 +1,239 @@
 from __future__ import print_function
 
-import boto3
 from decimal import Decimal
 import json
 import urllib
+import config
+import enrollment
+import identity
+import metrics
+import shards
+from enrollment import EnrollmentRejected, identity_item
 
 print('Loading function')
 
-dynamodb = boto3.client('dynamodb')
-s3 = boto3.client('s3')
-rekognition = boto3.client('rekognition')
+# Settings come from the function's environment (FACE_*, or the
+# COLLECTION_ID/DYNAMODB_TABLE names the CloudFormation stack sets)
+CONFIG = config.get()
+
+dynamodb = CONFIG.client('dynamodb')
+s3 = CONFIG.client('s3')
+rekognition = CONFIG.client('rekognition')
+
+CONFIG.configure_metrics()
+
+TABLE_NAME = CONFIG.table
+
+# Auto-orient, downscale and re-encode uploads before indexing them
+NORMALIZE_IMAGES = CONFIG.normalize_images
+if NORMALIZE_IMAGES:
+    # Needs Pillow, which is only packaged with the function when it normalizes
+    import normalize
+
+# Faces are routed to collections by site and name
+SHARD_MAP = shards.ShardMap.from_config(CONFIG)
+
+# Enrollment quality gates; Quality scores are 0-100, pose angles in degrees
+QUALITY_FILTER = CONFIG.quality_filter
+MIN_SHARPNESS = CONFIG.min_sharpness
+MIN_BRIGHTNESS = CONFIG.min_brightness
+MAX_YAW = CONFIG.max_yaw
+MAX_PITCH = CONFIG.max_pitch
 
 
 # --------------- Helper Functions ------------------
 
-def index_faces(bucket, key):
+@metrics.timed('rekognition.index_faces')
+def index_faces(bucket, key, collectionId=SHARD_MAP.base, personId=None):
 
-    response = rekognition.index_faces(
+    kwargs = dict(
         Image={"S3Object":
             {"Bucket": bucket,
             "Name": key}},
-            CollectionId="famouspersons")
+            CollectionId=collectionId,
+            MaxFaces=1,
+            QualityFilter=QUALITY_FILTER,
+            DetectionAttributes=['DEFAULT'])
+    if personId:
+        # Returned with every match, so searches can group faces by person
+        kwargs['ExternalImageId'] = personId
+    try:
+        response = rekognition.index_faces(**kwargs)
+    except rekognition.exceptions.ResourceNotFoundException:
+        # First face routed to a new shard
+        rekognition.create_collection(CollectionId=collectionId)
+        response = rekognition.index_faces(**kwargs)
     return response
-    
-def update_index(tableName,faceId, fullName):
+
+def rejection_reason(response):
+    """Why an IndexFaces response should not be enrolled, or None if it is usable."""
+    return enrollment.rejection_reason(response, MIN_SHARPNESS, MIN_BRIGHTNESS, MAX_YAW, MAX_PITCH)
+
+@metrics.timed('dynamodb.put_item')
+def update_index(tableName,faceId, fullName, bucket=None, key=None, collectionId=None, site=None, personId=None):
+    item = identity_item(faceId, fullName, personId, collectionId, site, bucket, key)
     response = dynamodb.put_item(
         TableName=tableName,
-        Item={
-            'RekognitionId': {'S': faceId},
-            'FullName': {'S': fullName}
-            }
-        ) 
-    
+        Item=item
+        )
+
+@metrics.timed('lambda.normalize')
+def normalize_object(bucket, key, metadata):
+    """Write a normalized copy of an upload under normalized/ and return its key.
+
+    The original is streamed into a spool file, so large photos are not held
+    in memory. Objects that are already upright JPEGs within the limits are
+    indexed as they are.
+    """
+    spool, size = normalize.spool_object(s3, bucket, key)
+    with spool:
+        if not normalize.needs_normalization(spool, size):
+            metrics.incr('lambda.normalize_skipped')
+            return key
+        body = normalize.normalize_image(spool)
+
+    target = normalize.normalized_key(key)
+    # 'origin' marks copies this function indexes itself, so the S3 event
+    # for the copy is ignored rather than indexing the face twice
+    s3.put_object(
+        Bucket=bucket,
+        Key=target,
+        Body=body,
+        ContentType='image/jpeg',
+        Metadata=dict(metadata, origin='lambda', source=key)
+    )
+    print("Normalized {} ({} bytes) to {} ({} bytes)".format(key, size, target, len(body)))
+    return target
+
+@metrics.timed('lambda.process_object')
+def process_object(bucket, key):
+    """Index the face in one S3 object and record its owner in DynamoDB."""
+
+    with metrics.timer('s3.head_object'):
+        ret = s3.head_object(Bucket=bucket,Key=key)
+    metadata = ret['Metadata']
+
+    if metadata.get('origin') == 'lambda':
+        print("Skipping {}: already indexed when it was normalized".format(key))
+        return None
+    if metadata.get('origin') == enrollment.DIRECT_ORIGIN:
+        # Archived after `main.py enroll` indexed it from the bytes
+        print("Skipping {}: enrolled directly as {}".format(key, metadata.get('faceid')))
+        return None
+    fullName = metadata.get('fullname')
+    if not fullName:
+        raise EnrollmentRejected("Rejected {}: no 'fullname' metadata".format(key))
+
+    index_key = key
+    if NORMALIZE_IMAGES and not key.startswith(normalize.NORMALIZED_PREFIX):
+        index_key = normalize_object(bucket, key, metadata)
+
+    # Calls Amazon Rekognition IndexFaces API to detect faces in S3 object
+    # to index faces into specified collection
+
+    site = metadata.get('site')
+    try:
+        # Every photo of one person is attached to the same person id
+        personId = identity.person_id(fullName, site, metadata.get('personid'))
+    except ValueError as e:
+        raise EnrollmentRejected("Rejected {}: {}".format(key, e))
+    collectionId = SHARD_MAP.collection_for(fullName, site)
+    response = index_faces(bucket, index_key, collectionId, personId)
+
+    # Commit faceId and full name object metadata to DynamoDB
+
+    if response['ResponseMetadata']['HTTPStatusCode'] == 200:
+        reason = rejection_reason(response)
+        if reason:
+            # Do not leave a poor face in the collection to cause bad matches
+            rejected = [record['Face']['FaceId'] for record in response['FaceRecords']]
+            if rejected:
+                rekognition.delete_faces(CollectionId=collectionId, FaceIds=rejected)
+            metrics.incr('lambda.rejected_faces')
+            raise EnrollmentRejected("Rejected {}: {}".format(key, reason))
+
+        faceId = response['FaceRecords'][0]['Face']['FaceId']
+
+        update_index(TABLE_NAME,faceId,fullName,bucket,index_key,collectionId,site,personId)
+
+    # Print response to console
+    print(response)
+
+    return response
+
+def s3_records_from_message(message):
+    """Extract the S3 records carried in the body of one SQS message."""
+    body = json.loads(message['body'])
+
+    # S3 sends a one-off s3:TestEvent when the notification is first configured
+    if body.get('Event') == 's3:TestEvent':
+        return []
+
+    return body.get('Records', [])
+
+def make_sqs_event(bucket, keys):
+    """Build a synthetic SQS event wrapping S3 notifications, for local runs."""
+    records = []
+    for i, key in enumerate(keys):
+        s3_event = {
+            'Records': [{
+                'eventSource': 'aws:s3',
+                'eventName': 'ObjectCreated:Put',
+                's3': {
+                    'bucket': {'name': bucket},
+                    'object': {'key': key}
+                }
+            }]
+        }
+        records.append({
+            'messageId': 'local-{}'.format(i),
+            'eventSource': 'aws:sqs',
+            'body': json.dumps(s3_event)
+        })
+    return {'Records': records}
+
 # --------------- Main handler ------------------
 
+def sqs_handler(event, context):
+    """Consume a batch of queued S3 notifications.
+
+    Each message is processed independently; failed ones are reported in
+    ``batchItemFailures`` so the event source mapping only retries those.
+    """
+    failures = []
+
+    for message in event['Records']:
+        try:
+            for record in s3_records_from_message(message):
+                bucket = record['s3']['bucket']['name']
+                key = record['s3']['object']['key']
+                print("Key: ",key)
+                try:
+                    process_object(bucket, key)
+                except EnrollmentRejected as e:
+                    # Retrying a rejected image would fail the same way
+                    print(e)
+        except Exception as e:
+            print(e)
+            print("Error processing message {}".format(message.get('messageId')))
+            metrics.incr('lambda.failed_messages')
+            failures.append({'itemIdentifier': message['messageId']})
+
+    return {'batchItemFailures': failures}
+
 def lambda_handler(event, context):
+    try:
+        with metrics.timer('lambda.handler'):
+            return handle_event(event, context)
+    finally:
+        # The execution environment may be frozen right after we return
+        metrics.flush()
+
+def handle_event(event, context):
+
+    # Queue-buffered deployments deliver batches of SQS messages instead
+    if event['Records'] and event['Records'][0].get('eventSource') == 'aws:sqs':
+        return sqs_handler(event, context)
 
     # Get the object from the event
     bucket = event['Records'][0]['s3']['bucket']['name']
@@ -45,27 +244,12 @@ def lambda_handler(event, context):
     # key = urllib.parse.unquote_plus(key)
 
     try:
-
-        # Calls Amazon Rekognition IndexFaces API to detect faces in S3 object 
-        # to index faces into specified collection
-        
-        response = index_faces(bucket, key)
-        
-        # Commit faceId and full name object metadata to DynamoDB
-        
-        if response['ResponseMetadata']['HTTPStatusCode'] == 200:
-            faceId = response['FaceRecords'][0]['Face']['FaceId']
-
-            ret = s3.head_object(Bucket=bucket,Key=key)
-            personFullName = ret['Metadata']['fullname']
-
-            update_index('face_recognition',faceId,personFullName)
-
-        # Print response to console
-        print(response)
-
-        return response
+        return process_object(bucket, key)
+    except EnrollmentRejected as e:
+        # Returning normally stops S3 from retrying the invocation
+        print(e)
+        return {'rejected': key, 'reason': str(e)}
     except Exception as e:
         print(e)
         print("Error processing object {} from bucket {}. ".format(key, bucket))
-        raise e
\ No newline at end of file
+        raise e
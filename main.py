@@ -1,44 +1,89 @@
-import boto3
 import os
 import sys
+import uuid
 from botocore.exceptions import ClientError
 import argparse
+import io
+import config
+import enrollment
+import identity
+import metrics
+import migrate
+import normalize
+import quality
+import shards
+from engine import FaceDetector
 
 class FaceRecognitionSystem:
-    def __init__(self, bucket_name=None, table_name=None):
+    def __init__(self, bucket_name=None, table_name=None, cfg=None):
         """Initialize the face recognition system with AWS services."""
-        self.s3 = boto3.client('s3')
-        self.dynamodb = boto3.client('dynamodb')
-        self.rekognition = boto3.client('rekognition')
+        self.config = cfg or config.get()
+        self.s3 = self.config.client('s3')
+        self.dynamodb = self.config.client('dynamodb')
+        self.rekognition = self.config.client('rekognition')
         
-        # Get bucket and table names from environment or parameters
-        self.bucket_name = bucket_name or os.getenv('FACE_RECOGNITION_BUCKET')
-        self.table_name = table_name or os.getenv('FACE_RECOGNITION_TABLE') or 'facerecognition'
-        self.collection_id = 'facerecognition_collection'
+        # Get bucket and table names from parameters or configuration
+        self.bucket_name = bucket_name or self.config.bucket
+        self.table_name = table_name or self.config.table
+        self.shard_map = shards.ShardMap.from_config(self.config)
+        self.collection_id = self.shard_map.base
+        self.detector = None
+        self.enroller = None
         
         if not self.bucket_name:
-            raise ValueError("Bucket name must be provided either as parameter or environment variable")
+            raise ValueError("Bucket name must be provided either as parameter or in the configuration")
 
-    def upload_face(self, image_path, full_name):
-        """Upload an image with metadata to S3."""
+    @metrics.timed('system.upload_face')
+    def upload_face(self, image_path, full_name, normalize_image=False, check_quality=True, site=None,
+                    person_id=None):
+        """Upload an image with metadata to S3.
+
+        With normalize_image, the photo is auto-oriented, downscaled and
+        re-encoded locally and uploaded under normalized/, which the enrollment
+        Lambda indexes as-is. With check_quality, images without a usable face
+        are rejected before upload. `site` routes the face to that site's
+        shards of a sharded gallery. Every photo is attached to a person:
+        `person_id` when given (to tell apart people with the same name),
+        otherwise the id derived from the name and site.
+        """
         try:
             # Check if file exists
             if not os.path.exists(image_path):
                 raise FileNotFoundError(f"Image file not found: {image_path}")
             
+            if check_quality:
+                if self.detector is None:
+                    self.detector = FaceDetector(min_size=quality.MIN_FACE_SIZE)
+                _, reasons = quality.check_image(image_path, self.detector)
+                if reasons:
+                    print(f"Image rejected: {', '.join(reasons)}")
+                    return False
+            
             # Extract filename from path
             filename = os.path.basename(image_path)
             
-            print(f"Uploading {filename} for {full_name}...")
+            print(f"Uploading {filename} for {full_name} "
+                  f"({identity.person_id(full_name, site, person_id)})...")
+            
+            metadata = {'fullname': full_name}
+            if site:
+                metadata['site'] = site
+            if person_id:
+                metadata['personid'] = identity.person_id(full_name, site, person_id)
             
             # Upload to S3 with metadata
             with open(image_path, 'rb') as image:
+                if normalize_image:
+                    body = normalize.normalize_image(image)
+                    print(f"Normalized {os.path.getsize(image_path)} bytes to {len(body)} bytes")
+                    image = io.BytesIO(body)
+                    filename = normalize.normalized_key(filename)
                 self.s3.upload_fileobj(
                     image,
                     self.bucket_name,
                     filename,
                     ExtraArgs={
-                        'Metadata': {'fullname': full_name}
+                        'Metadata': metadata
                     }
                 )
             
@@ -52,6 +97,69 @@ class FaceRecognitionSystem:
             print(f"Unexpected error: {str(e)}")
             return False
 
+    @metrics.timed('system.enroll')
+    def enroll(self, image_path, full_name, site=None, person_id=None, check_quality=True):
+        """Enroll a face directly, without waiting for the bucket's Lambda.
+
+        The image is indexed from its bytes and the identity recorded before
+        this returns, so the person is recognized at once; the original is
+        uploaded to the bucket in the background. Returns the FaceId, or None
+        if the image was rejected.
+        """
+        try:
+            if not os.path.exists(image_path):
+                raise FileNotFoundError(f"Image file not found: {image_path}")
+
+            if check_quality:
+                if self.detector is None:
+                    self.detector = FaceDetector(min_size=quality.MIN_FACE_SIZE)
+                _, reasons = quality.check_image(image_path, self.detector)
+                if reasons:
+                    print(f"Image rejected: {', '.join(reasons)}")
+                    return None
+
+            with open(image_path, 'rb') as image:
+                original = image.read()
+            body = original
+            with io.BytesIO(original) as image:
+                # IndexFaces takes at most 5 MB of bytes
+                if normalize.needs_normalization(image, len(original)):
+                    body = normalize.normalize_image(image)
+                    print(f"Normalized {len(original)} bytes to {len(body)} bytes")
+
+            if self.enroller is None:
+                self.enroller = enrollment.DirectEnroller.from_config(
+                    self.config, self.shard_map, self.rekognition, self.dynamodb, self.s3)
+            try:
+                pid = identity.person_id(full_name, site, person_id)
+            except ValueError as e:
+                raise enrollment.EnrollmentRejected(str(e))
+            # A key of its own, so another person's photo.jpg can't replace this original
+            extension = os.path.splitext(image_path)[1].lower() or '.jpg'
+            key = f"enroll/{pid}/{uuid.uuid4()}{extension}"
+            face_id = self.enroller.enroll(body, full_name, key, site, pid, original)
+            print(f"Enrolled {full_name} ({pid}) as {face_id}; original archived as {key}")
+            return face_id
+
+        except enrollment.EnrollmentRejected as e:
+            print(f"Image rejected: {str(e)}")
+            return None
+        except ClientError as e:
+            print(f"Error enrolling image: {str(e)}")
+            return None
+        except Exception as e:
+            print(f"Unexpected error: {str(e)}")
+            return None
+
+    def close(self):
+        """Wait for background uploads of enrolled originals."""
+        if self.enroller is not None:
+            failed = self.enroller.close()
+            self.enroller = None
+            if failed:
+                print(f"{failed} originals could not be archived; their faces are enrolled")
+
+    @metrics.timed('system.list_faces')
     def list_faces(self):
         """List all faces stored in DynamoDB."""
         try:
@@ -62,10 +170,17 @@ class FaceRecognitionSystem:
             if 'Items' in response:
                 print("\nRecognized Faces:")
                 print("-----------------")
+                people = set()
                 for item in response['Items']:
                     print(f"Name: {item['FullName']['S']}")
                     print(f"Face ID: {item['RekognitionId']['S']}")
+                    if 'PersonId' in item:
+                        print(f"Person: {item['PersonId']['S']}")
+                    if 'CollectionId' in item:
+                        print(f"Collection: {item['CollectionId']['S']}")
                     print("-----------------")
+                    people.add(item.get('PersonId', item['FullName'])['S'])
+                print(f"{len(response['Items'])} faces of {len(people)} people")
                 return response['Items']
             else:
                 print("No faces found in the database.")
@@ -75,12 +190,20 @@ class FaceRecognitionSystem:
             print(f"Error listing faces: {str(e)}")
             return None
 
+    @metrics.timed('system.delete_face')
     def delete_face(self, face_id):
         """Delete a face from both Rekognition collection and DynamoDB."""
         try:
+            # Sharded faces record the collection they were indexed into
+            item = self.dynamodb.get_item(
+                TableName=self.table_name,
+                Key={'RekognitionId': {'S': face_id}}
+            ).get('Item', {})
+            collection_id = item.get('CollectionId', {}).get('S', self.collection_id)
+            
             # Delete from Rekognition collection
             self.rekognition.delete_faces(
-                CollectionId=self.collection_id,
+                CollectionId=collection_id,
                 FaceIds=[face_id]
             )
             
@@ -97,10 +220,90 @@ class FaceRecognitionSystem:
             print(f"Error deleting face: {str(e)}")
             return False
 
+    @metrics.timed('system.rebalance')
+    def rebalance(self, shard_count, apply=False, workers=None, rate=5.0):
+        """Move faces into the shards a new shard count assigns them to."""
+        target = shards.ShardMap(self.shard_map.base, shard_count, self.shard_map.sites)
+        try:
+            moves = shards.plan_rebalance(self.dynamodb, self.table_name, target, self.collection_id)
+        except ClientError as e:
+            print(f"Error reading faces: {str(e)}")
+            return None
+        
+        print(f"{len(moves)} faces to move into {shard_count} shard(s) per site")
+        per_target = {}
+        for _, _, collection_id in moves:
+            per_target[collection_id] = per_target.get(collection_id, 0) + 1
+        for collection_id, count in sorted(per_target.items()):
+            print(f"  {collection_id}: {count}")
+        
+        if not apply or not moves:
+            if moves:
+                print("Dry run; pass --apply to move them")
+            return {'planned': len(moves)}
+        
+        rebalancer = shards.Rebalancer(self.rekognition, self.dynamodb, self.table_name,
+                                       workers or self.config.workers, rate)
+        counts = rebalancer.run(moves)
+        print(f"Moved {counts['moved']}, skipped {counts['skipped']}, failed {counts['failed']}")
+        if counts['moved']:
+            print(f"Set FACE_SHARDS={shard_count} for every entry point and the enrollment Lambda")
+        return counts
+
+    @metrics.timed('system.migrate')
+    def migrate(self, target, prefix='', shard_count=None, target_table=None, workers=None, rate=10.0,
+                checkpoint_path=None, resume=False):
+        """Re-index every enrollment image in the bucket into the `target` collection(s).
+
+        New face ids are recorded in `target_table` (the configured table by
+        default). Progress is checkpointed; with resume, a previous run into
+        the same target carries on where it stopped.
+        """
+        target_map = shards.ShardMap(target, shard_count or self.shard_map.shards, self.shard_map.sites)
+        if target_map.base == self.collection_id and target_map.shards == self.shard_map.shards:
+            print(f"Target {target} is the collection already in use; pick a new one")
+            return None
+        workers = workers or self.config.workers
+        checkpoint_path = checkpoint_path or f"migrate-{target}.checkpoint"
+        if not resume and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        
+        # Adaptive retries back off when IndexFaces or the table throttles
+        client_options = {
+            'retries': {'max_attempts': max(10, self.config.max_attempts), 'mode': 'adaptive'},
+            'max_pool_connections': max(self.config.max_pool_connections, workers),
+        }
+        try:
+            checkpoint = migrate.MigrationCheckpoint(checkpoint_path, target, resume)
+            migrator = migrate.Migrator(
+                self.config.client('s3', **client_options),
+                self.config.client('rekognition', **client_options),
+                self.config.client('dynamodb', **client_options),
+                self.bucket_name, target_table or self.table_name, target_map, checkpoint,
+                workers, rate, self.config.quality_filter
+            )
+            if checkpoint.after:
+                print(f"Resuming after {checkpoint.after} ({checkpoint.counts})")
+            counts = migrator.run(prefix)
+        except KeyboardInterrupt:
+            print(f"Interrupted; progress saved to {checkpoint_path}, rerun with --resume to continue")
+            return None
+        except (ClientError, ValueError) as e:
+            print(f"Error migrating faces: {str(e)}")
+            return None
+        
+        print(f"Done: {counts}")
+        if counts.get('failed'):
+            print(f"Rerun with --resume to retry the {counts['failed']} failed image(s)")
+        else:
+            print(f"Point every entry point and the enrollment Lambda at collection {target}")
+        return counts
+
 def main():
     parser = argparse.ArgumentParser(description='Face Recognition System CLI')
     parser.add_argument('--bucket', help='S3 bucket name')
     parser.add_argument('--table', help='DynamoDB table name')
+    config.add_arguments(parser)
     
     subparsers = parser.add_subparsers(dest='command', help='Commands')
     
@@ -108,6 +311,23 @@ def main():
     upload_parser = subparsers.add_parser('upload', help='Upload a face image')
     upload_parser.add_argument('image_path', help='Path to the image file')
     upload_parser.add_argument('full_name', help='Full name of the person')
+    upload_parser.add_argument('--normalize', action='store_true',
+                               help='Auto-orient, downscale and re-encode the image before uploading')
+    upload_parser.add_argument('--force', action='store_true',
+                               help='Upload even if the local quality check fails')
+    upload_parser.add_argument('--site', help='Site or tenant the person belongs to')
+    upload_parser.add_argument('--person-id',
+                               help='Person to attach the photo to (default: derived from the name and site)')
+    
+    # Enroll command
+    enroll_parser = subparsers.add_parser('enroll', help='Index a face image now and archive it in the background')
+    enroll_parser.add_argument('image_path', help='Path to the image file')
+    enroll_parser.add_argument('full_name', help='Full name of the person')
+    enroll_parser.add_argument('--force', action='store_true',
+                               help='Enroll even if the local quality check fails')
+    enroll_parser.add_argument('--site', help='Site or tenant the person belongs to')
+    enroll_parser.add_argument('--person-id',
+                               help='Person to attach the photo to (default: derived from the name and site)')
     
     # List command
     subparsers.add_parser('list', help='List all recognized faces')
@@ -116,17 +336,49 @@ def main():
     delete_parser = subparsers.add_parser('delete', help='Delete a face')
     delete_parser.add_argument('face_id', help='Face ID to delete')
     
+    # Rebalance command
+    rebalance_parser = subparsers.add_parser('rebalance', help='Move faces to match a new shard count')
+    rebalance_parser.add_argument('shards', type=int, help='Hash shards per site')
+    rebalance_parser.add_argument('--apply', action='store_true', help='Move faces (default is a dry run)')
+    rebalance_parser.add_argument('--workers', type=int, help='Concurrent moves (default: workers setting)')
+    rebalance_parser.add_argument('--rate', type=float, default=5.0, help='Rekognition calls per second')
+    
+    # Migrate command
+    migrate_parser = subparsers.add_parser('migrate', help='Re-index every enrolled image into a new collection')
+    migrate_parser.add_argument('target', help='Collection to index into (the base name when sharded)')
+    migrate_parser.add_argument('--prefix', default='', help='Only migrate keys under this prefix')
+    migrate_parser.add_argument('--shards', type=int, help='Hash shards per site in the target (default: shards setting)')
+    migrate_parser.add_argument('--target-table', help='Table for the new face ids (default: table setting)')
+    migrate_parser.add_argument('--workers', type=int, help='Concurrent IndexFaces calls (default: workers setting)')
+    migrate_parser.add_argument('--rate', type=float, default=10.0,
+                                help='IndexFaces calls per second; keep under the account quota')
+    migrate_parser.add_argument('--checkpoint', help='Progress file (default: migrate-<target>.checkpoint)')
+    migrate_parser.add_argument('--resume', action='store_true', help='Continue a previous run into the same target')
+    
     args = parser.parse_args()
     
     try:
-        system = FaceRecognitionSystem(args.bucket, args.table)
+        cfg = config.from_args(args, 'bucket', 'table')
+        cfg.configure_metrics()
+        system = FaceRecognitionSystem(cfg=cfg)
         
         if args.command == 'upload':
-            system.upload_face(args.image_path, args.full_name)
+            system.upload_face(args.image_path, args.full_name, args.normalize, not args.force, args.site,
+                               args.person_id)
+        elif args.command == 'enroll':
+            try:
+                system.enroll(args.image_path, args.full_name, args.site, args.person_id, not args.force)
+            finally:
+                system.close()
         elif args.command == 'list':
             system.list_faces()
         elif args.command == 'delete':
             system.delete_face(args.face_id)
+        elif args.command == 'rebalance':
+            system.rebalance(args.shards, args.apply, args.workers, args.rate)
+        elif args.command == 'migrate':
+            system.migrate(args.target, args.prefix, args.shards, args.target_table, args.workers,
+                           args.rate, args.checkpoint, args.resume)
         else:
             parser.print_help()
             
@@ -138,6 +390,7 @@ def main():
         print("\nOr set environment variables:")
         print("  FACE_RECOGNITION_BUCKET")
         print("  FACE_RECOGNITION_TABLE")
+        print(f"\nOr set bucket and table in {config.DEFAULT_PATH} (see python config.py)")
         sys.exit(1)
 
 if __name__ == "__main__":
@@ -0,0 +1,275 @@
+"""Lightweight latency timers, counters and histograms.
+
+Instrumentation is off unless a sink is configured, in which case timings are
+aggregated in memory and flushed periodically by a background thread:
+
+    FACE_METRICS=prom:/var/lib/node_exporter/face.prom   Prometheus text file
+    FACE_METRICS=statsd:127.0.0.1:8125                   StatsD over UDP
+    FACE_METRICS_INTERVAL=10                             flush period in seconds
+
+When disabled, timer() hands back a shared no-op context manager and incr()
+returns immediately, so call sites can stay in hot paths.
+"""
+import atexit
+import bisect
+import functools
+import os
+import socket
+import tempfile
+import threading
+import time
+
+# Bucket upper bounds in seconds, from a cached lookup up to a stalled API call
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = None
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        # Raw timings since the last flush, for sinks that want every sample
+        self.pending = []
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+            self.pending.append((name, seconds))
+
+    def incr(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def drain(self):
+        """Return (counters, histograms, pending timings) and reset pending."""
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {}
+            for name, h in self.histograms.items():
+                copy = Histogram(h.buckets)
+                copy.counts, copy.sum, copy.count = list(h.counts), h.sum, h.count
+                histograms[name] = copy
+            pending, self.pending = self.pending, []
+        return counters, histograms, pending
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ('registry', 'name', 'start')
+
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.registry.observe(self.name, time.perf_counter() - self.start)
+        if exc_type is not None:
+            self.registry.incr(self.name + '.errors')
+        return False
+
+
+def enabled():
+    return _registry is not None
+
+
+def timer(name):
+    """Context manager recording the duration of the block under `name`."""
+    registry = _registry
+    if registry is None:
+        return _NULL_TIMER
+    return _Timer(registry, name)
+
+
+def incr(name, value=1):
+    registry = _registry
+    if registry is not None:
+        registry.incr(name, value)
+
+
+def timed(name):
+    """Decorator form of timer()."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            registry = _registry
+            if registry is None:
+                return fn(*args, **kwargs)
+            with _Timer(registry, name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# --------------- Sinks ------------------
+
+def _prom_name(name):
+    return 'face_' + ''.join(c if c.isalnum() else '_' for c in name)
+
+
+class PrometheusFileSink:
+    def __init__(self, path):
+        """Write the registry in Prometheus text format for node_exporter's textfile collector."""
+        self.path = os.path.abspath(path)
+
+    def flush(self, counters, histograms, pending):
+        lines = []
+        for name in sorted(counters):
+            metric = _prom_name(name) + '_total'
+            lines.append('# TYPE {} counter'.format(metric))
+            lines.append('{} {}'.format(metric, counters[name]))
+        for name in sorted(histograms):
+            h = histograms[name]
+            metric = _prom_name(name) + '_seconds'
+            lines.append('# TYPE {} histogram'.format(metric))
+            cumulative = 0
+            for bound, count in zip(h.buckets, h.counts):
+                cumulative += count
+                lines.append('{}_bucket{{le="{}"}} {}'.format(metric, bound, cumulative))
+            lines.append('{}_bucket{{le="+Inf"}} {}'.format(metric, h.count))
+            lines.append('{}_sum {}'.format(metric, round(h.sum, 6)))
+            lines.append('{}_count {}'.format(metric, h.count))
+
+        # Write then rename so the collector never reads a half-written file
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.metrics-')
+        with os.fdopen(fd, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, self.path)
+
+
+class StatsDSink:
+    # Stay under a typical path MTU so packets are not fragmented
+    MAX_PACKET = 1400
+
+    def __init__(self, host, port, prefix='face.'):
+        """Send timings and counter deltas to a StatsD daemon over UDP."""
+        self.address = (host, int(port))
+        self.prefix = prefix
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.last_counters = {}
+
+    def flush(self, counters, histograms, pending):
+        lines = []
+        for name, value in counters.items():
+            delta = value - self.last_counters.get(name, 0)
+            if delta:
+                lines.append('{}{}:{}|c'.format(self.prefix, name, delta))
+        self.last_counters = counters
+        for name, seconds in pending:
+            lines.append('{}{}:{:.3f}|ms'.format(self.prefix, name, seconds * 1000.0))
+
+        packet = []
+        size = 0
+        for line in lines:
+            if packet and size + len(line) + 1 > self.MAX_PACKET:
+                self._send(packet)
+                packet, size = [], 0
+            packet.append(line)
+            size += len(line) + 1
+        if packet:
+            self._send(packet)
+
+    def _send(self, lines):
+        try:
+            self.sock.sendto('\n'.join(lines).encode('utf-8'), self.address)
+        except OSError:
+            # Metrics must never take the kiosk down
+            pass
+
+
+def parse_sink(spec):
+    """Build a sink from 'prom:<path>' or 'statsd:<host>:<port>'."""
+    kind, _, target = spec.partition(':')
+    if kind == 'prom' and target:
+        return PrometheusFileSink(target)
+    if kind == 'statsd':
+        host, _, port = target.rpartition(':')
+        return StatsDSink(host or '127.0.0.1', port or 8125)
+    raise ValueError("Unknown metrics sink: {}".format(spec))
+
+
+class _Flusher(threading.Thread):
+    def __init__(self, registry, sink, interval):
+        super().__init__(name='metrics-flusher', daemon=True)
+        self.registry = registry
+        self.sink = sink
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.flush()
+
+    def flush(self):
+        try:
+            self.sink.flush(*self.registry.drain())
+        except Exception as e:
+            print(f"Error flushing metrics: {str(e)}")
+
+    def stop(self):
+        self.stopped.set()
+        self.flush()
+
+
+_flusher = None
+
+
+def configure(sink=None, interval=10.0):
+    """Enable metrics with the given sink spec, or disable them if sink is None."""
+    global _registry, _flusher
+    if _flusher is not None:
+        _flusher.stop()
+        _flusher = None
+    if not sink:
+        _registry = None
+        return None
+    registry = Registry()
+    _flusher = _Flusher(registry, parse_sink(sink), interval)
+    _flusher.start()
+    _registry = registry
+    return registry
+
+
+def flush():
+    """Flush immediately, e.g. before a Lambda invocation is frozen."""
+    if _flusher is not None:
+        _flusher.flush()
+
+
+@atexit.register
+def _shutdown():
+    if _flusher is not None:
+        _flusher.stop()
@@ -0,0 +1,291 @@
+"""Bulk re-indexing of enrolled images into another collection.
+
+Moving to a new collection (a new face model version, another region, a new
+shard layout, or the collection name the clients actually search) means
+running IndexFaces over every enrolled image again. The bucket listing is
+streamed a page at a time; each enrollment image is indexed into its target
+collection by a bounded, rate-limited pool; and the new face id records are
+written to DynamoDB 25 at a time with batch_write_item.
+
+Progress is checkpointed as a watermark (every key up to it is finished)
+plus the few keys finished beyond it, so a run over a million images can be
+interrupted and resumed without listing or indexing the finished part again.
+"""
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from botocore.exceptions import ClientError
+
+import identity
+import metrics
+import normalize
+from ratelimit import TokenBucket
+
+# batch_write_item accepts at most 25 put requests per call
+BATCH_SIZE = 25
+CHECKPOINT_INTERVAL = 5.0
+MAX_WRITE_ATTEMPTS = 8
+
+
+def list_keys(s3, bucket, prefix='', start_after=None):
+    """Every key under `prefix` after `start_after`, following listing pagination."""
+    kwargs = {'Bucket': bucket, 'Prefix': prefix}
+    if start_after:
+        kwargs['StartAfter'] = start_after
+    while True:
+        response = s3.list_objects_v2(**kwargs)
+        for obj in response.get('Contents', []):
+            yield obj['Key']
+        if not response.get('IsTruncated'):
+            return
+        kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+
+class MigrationCheckpoint:
+    def __init__(self, path, target, resume=False):
+        """Progress of a migration into `target`, saved as JSON at `path`.
+
+        Keys are finished out of order by the pool; `after` only advances
+        past a key once every key listed before it is finished too.
+        """
+        self.path = path
+        self.target = target
+        self.after = None
+        self.done = set()
+        self.failed = set()
+        self.counts = {}
+        if resume and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                state = json.load(f)
+            if state['target'] != target:
+                raise ValueError("Checkpoint {} is for a migration into {}, not {}".format(
+                    path, state['target'], target))
+            self.after = state['after']
+            self.done = set(state['done'])
+            self.failed = set(state['failed'])
+            self.counts = state['counts']
+        # Keys listed but not yet below the watermark, in listing order
+        self.order = deque()
+        self.finished = set()
+        self.saved_at = time.monotonic()
+
+    def start(self, key):
+        self.order.append(key)
+
+    def finish(self, key, status, retry=False):
+        """Record a key's outcome; retried keys are already below the watermark."""
+        if retry:
+            if status != 'failed':
+                self.failed.discard(key)
+                self.counts['failed'] = self.counts.get('failed', 1) - 1
+                self.counts[status] = self.counts.get(status, 0) + 1
+            return
+        if status is not None:
+            self.counts[status] = self.counts.get(status, 0) + 1
+        if status == 'failed':
+            self.failed.add(key)
+        self.finished.add(key)
+        while self.order and self.order[0] in self.finished:
+            key = self.order.popleft()
+            self.finished.discard(key)
+            self.done.discard(key)
+            self.after = key
+
+    def save(self, force=False):
+        if not force and time.monotonic() - self.saved_at < CHECKPOINT_INTERVAL:
+            return
+        state = {
+            'target': self.target,
+            'after': self.after,
+            'done': sorted(self.done | self.finished),
+            'failed': sorted(self.failed),
+            'counts': self.counts,
+        }
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self.saved_at = time.monotonic()
+
+
+class Migrator:
+    def __init__(self, s3, rekognition, dynamodb, bucket, table_name, shard_map, checkpoint,
+                 workers=8, rate=10.0, quality_filter='AUTO'):
+        """Index every enrollment image in `bucket` into the collections of `shard_map`."""
+        self.s3 = s3
+        self.rekognition = rekognition
+        self.dynamodb = dynamodb
+        self.bucket = bucket
+        self.table_name = table_name
+        self.shard_map = shard_map
+        self.checkpoint = checkpoint
+        self.workers = workers
+        self.limiter = TokenBucket(rate)
+        self.quality_filter = quality_filter
+        self.created = set()
+        self.lock = threading.Lock()
+        self.batch = []
+        self.reported = 0
+
+    def ensure_collection(self, collection_id):
+        with self.lock:
+            if collection_id in self.created:
+                return
+            try:
+                self.rekognition.create_collection(CollectionId=collection_id)
+                print(f"Created collection {collection_id}")
+            except self.rekognition.exceptions.ResourceAlreadyExistsException:
+                pass
+            self.created.add(collection_id)
+
+    def lambda_copy(self, key):
+        """The normalized copy the enrollment Lambda indexed instead of `key`, if there is one."""
+        copy_key = normalize.normalized_key(key)
+        try:
+            head = self.s3.head_object(Bucket=self.bucket, Key=copy_key)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+        return copy_key if head['Metadata'].get('origin') == 'lambda' else None
+
+    def index(self, key):
+        """Index one object, returning (status, identity item or reason)."""
+        metadata = self.s3.head_object(Bucket=self.bucket, Key=key)['Metadata']
+        if 'fullname' not in metadata:
+            return 'skipped', "no fullname metadata"
+        if metadata.get('origin') == 'lambda':
+            return 'skipped', "normalized copy, indexed with its original"
+
+        index_key = key
+        if not key.startswith(normalize.NORMALIZED_PREFIX):
+            index_key = self.lambda_copy(key) or key
+
+        site = metadata.get('site')
+        try:
+            person_id = identity.person_id(metadata['fullname'], site, metadata.get('personid'))
+        except ValueError as e:
+            return 'skipped', str(e)
+        collection_id = self.shard_map.collection_for(metadata['fullname'], site)
+        self.ensure_collection(collection_id)
+        self.limiter.acquire()
+        with metrics.timer('rekognition.index_faces'):
+            try:
+                response = self.rekognition.index_faces(
+                    CollectionId=collection_id,
+                    Image={'S3Object': {'Bucket': self.bucket, 'Name': index_key}},
+                    ExternalImageId=person_id,
+                    MaxFaces=1,
+                    QualityFilter=self.quality_filter,
+                    DetectionAttributes=['DEFAULT']
+                )
+            except self.rekognition.exceptions.InvalidParameterException:
+                return 'rejected', "no face detected"
+        if not response['FaceRecords']:
+            reasons = sorted(set(reason for face in response.get('UnindexedFaces', [])
+                                 for reason in face.get('Reasons', [])))
+            return 'rejected', ', '.join(reasons) or "no face detected"
+
+        item = {
+            'RekognitionId': {'S': response['FaceRecords'][0]['Face']['FaceId']},
+            'FullName': {'S': metadata['fullname']},
+            'PersonId': {'S': person_id},
+            'CollectionId': {'S': collection_id},
+            'ImageBucket': {'S': self.bucket},
+            'ImageKey': {'S': index_key},
+        }
+        if site:
+            item['Site'] = {'S': site}
+        return 'indexed', item
+
+    def _index(self, key, retry):
+        try:
+            status, result = self.index(key)
+        except Exception as e:
+            status, result = 'failed', str(e)
+        return key, retry, status, result
+
+    def flush(self):
+        """Write buffered identity records, then mark their keys finished."""
+        if not self.batch:
+            return
+        batch, self.batch = self.batch, []
+        requests = [{'PutRequest': {'Item': item}} for _, _, item in batch]
+        try:
+            for attempt in range(MAX_WRITE_ATTEMPTS):
+                with metrics.timer('dynamodb.batch_write_item'):
+                    response = self.dynamodb.batch_write_item(RequestItems={self.table_name: requests})
+                requests = response.get('UnprocessedItems', {}).get(self.table_name, [])
+                if not requests:
+                    break
+                time.sleep(random.uniform(0, min(10.0, 0.1 * 2 ** attempt)))
+            else:
+                raise RuntimeError(f"{len(requests)} records still unprocessed")
+        except Exception as e:
+            # The faces are indexed but unrecorded; a resumed run indexes them again
+            print(f"Error writing {len(batch)} records: {str(e)}")
+            for key, retry, _ in batch:
+                self.checkpoint.finish(key, 'failed', retry)
+            return
+        for key, retry, _ in batch:
+            self.checkpoint.finish(key, 'indexed', retry)
+
+    def collect(self, futures):
+        for future in futures:
+            key, retry, status, result = future.result()
+            if status == 'indexed':
+                self.batch.append((key, retry, result))
+                if len(self.batch) >= BATCH_SIZE:
+                    self.flush()
+                continue
+            if status in ('failed', 'rejected'):
+                print(f"{key}: {status}, {result}")
+            self.checkpoint.finish(key, status, retry)
+        total = sum(self.checkpoint.counts.values())
+        if total >= self.reported + 1000:
+            self.reported = total
+            print(f"Processed {total} objects {self.checkpoint.counts}")
+        self.checkpoint.save()
+
+    def keys(self, prefix=''):
+        """(key, retry): failures from an earlier run first, then the rest of the listing."""
+        for key in sorted(self.checkpoint.failed):
+            yield key, True
+        for key in list_keys(self.s3, self.bucket, prefix, self.checkpoint.after):
+            yield key, False
+
+    def run(self, prefix=''):
+        """Migrate every key under `prefix`, returning the status counts (including earlier runs)."""
+        in_flight = set()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                for key, retry in self.keys(prefix):
+                    if not retry:
+                        self.checkpoint.start(key)
+                        if key in self.checkpoint.done:
+                            # Finished by an earlier run beyond its watermark
+                            self.checkpoint.finish(key, None)
+                            continue
+                    in_flight.add(pool.submit(self._index, key, retry))
+                    # Bounded so the listing stays only a little ahead of the pool
+                    if len(in_flight) >= self.workers * 2:
+                        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        self.collect(done)
+                while in_flight:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    self.collect(done)
+        finally:
+            # Record whatever finished, including on Ctrl+C, so a resume skips it
+            for future in in_flight:
+                if future.done() and not future.cancelled():
+                    self.collect([future])
+            self.flush()
+            self.checkpoint.save(force=True)
+        return self.checkpoint.counts
@@ -0,0 +1,94 @@
+"""Enrollment image normalization.
+
+Phone photos arrive as 10+ MB JPEGs, EXIF-rotated, or as PNGs converted from
+HEIC. Before indexing, images are auto-oriented, downscaled to a bounded size
+and re-encoded as JPEG. Images that are already upright JPEGs within the
+limits are left alone.
+
+This module only needs Pillow, so it can be packaged with the Lambda.
+"""
+import io
+import tempfile
+
+from PIL import Image, ImageOps
+
+# Rekognition limits for images passed as raw bytes
+MAX_IMAGE_BYTES = 5 * 1024 * 1024
+MAX_IMAGE_DIMENSION = 4096
+MIN_IMAGE_DIMENSION = 80
+
+# Normalized enrollment images are written under this prefix
+NORMALIZED_PREFIX = 'normalized/'
+# Longest side of a normalized image; plenty for a face that fills the frame
+NORMALIZED_DIMENSION = 1920
+NORMALIZED_QUALITY = 90
+
+EXIF_ORIENTATION = 0x0112
+
+# Objects up to this size are spooled in memory, larger ones on disk
+SPOOL_MEMORY_LIMIT = 8 * 1024 * 1024
+CHUNK_SIZE = 1024 * 1024
+
+
+def within_limits(image, size_bytes, formats=('JPEG', 'PNG'), max_dimension=MAX_IMAGE_DIMENSION):
+    """True if an opened (not yet decoded) image can be used without re-encoding."""
+    width, height = image.size
+    return (image.format in formats
+            and size_bytes <= MAX_IMAGE_BYTES
+            and MIN_IMAGE_DIMENSION <= min(width, height)
+            and max(width, height) <= max_dimension
+            and image.getexif().get(EXIF_ORIENTATION, 1) == 1)
+
+
+def normalize_image(fileobj, max_dimension=NORMALIZED_DIMENSION, quality=NORMALIZED_QUALITY):
+    """Auto-orient, downscale and re-encode an image, returning JPEG bytes."""
+    image = Image.open(fileobj)
+    # For JPEGs, let libjpeg decode at a reduced scale (1/2, 1/4, 1/8) so a
+    # 48 MP photo is never fully expanded in memory
+    image.draft('RGB', (max_dimension, max_dimension))
+    image = ImageOps.exif_transpose(image)
+    if image.mode != 'RGB':
+        # Flatten transparency from PNGs onto white rather than black
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.split()[-1])
+            image = background
+        else:
+            image = image.convert('RGB')
+    image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=quality, optimize=True)
+    return output.getvalue()
+
+
+def needs_normalization(fileobj, size_bytes, max_dimension=NORMALIZED_DIMENSION):
+    """Check only the image header; the stream is rewound afterwards."""
+    position = fileobj.tell()
+    try:
+        with Image.open(fileobj) as image:
+            return not within_limits(image, size_bytes, formats=('JPEG',), max_dimension=max_dimension)
+    except Exception:
+        # Let normalize_image surface a proper error for unreadable files
+        return True
+    finally:
+        fileobj.seek(position)
+
+
+def normalized_key(key):
+    """normalized/<key without extension>.jpg"""
+    stem = key.rsplit('.', 1)[0] if '.' in key.rsplit('/', 1)[-1] else key
+    return NORMALIZED_PREFIX + stem + '.jpg'
+
+
+def spool_object(s3, bucket, key):
+    """Stream an S3 object into a seekable spool file without holding it all in memory."""
+    body = s3.get_object(Bucket=bucket, Key=key)['Body']
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_LIMIT)
+    size = 0
+    for chunk in iter(lambda: body.read(CHUNK_SIZE), b''):
+        spool.write(chunk)
+        size += len(chunk)
+    spool.seek(0)
+    return spool, size
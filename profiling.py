@@ -0,0 +1,167 @@
+"""Event-loop profiling for the Tk GUI.
+
+LoopProfiler measures how long each scheduled callback blocks the Tk main
+loop, how late the loop services timers (event-loop lag) and how long frames
+take to render. Samples go into fixed-size ring buffers so a kiosk can run
+with profiling on all day. A live overlay shows the current numbers, and on
+exit the profiler writes a cProfile pstats dump plus a text summary.
+"""
+import cProfile
+import io
+import pstats
+import time
+import tkinter as tk
+from collections import defaultdict, deque
+from contextlib import contextmanager, nullcontext
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(pct / 100.0 * len(ordered)))]
+
+
+class NullProfiler:
+    """Stand-in used when profiling is off; every hook is a no-op."""
+
+    def wrap(self, name, fn):
+        return fn
+
+    def timer(self, name):
+        return nullcontext()
+
+    def start(self, root):
+        pass
+
+    def attach_overlay(self, widget):
+        pass
+
+    def stop(self):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class LoopProfiler:
+    def __init__(self, capacity=2000, probe_interval_ms=50, overlay_interval_ms=500,
+                 pstats_path='gui_profile.pstats'):
+        self.capacity = capacity
+        self.probe_interval_ms = probe_interval_ms
+        self.overlay_interval_ms = overlay_interval_ms
+        self.pstats_path = pstats_path
+
+        # name -> ring buffer of durations in seconds
+        self.samples = defaultdict(lambda: deque(maxlen=self.capacity))
+        self.lag = deque(maxlen=capacity)
+        self.frame_times = deque(maxlen=120)
+
+        self.root = None
+        self.overlay = None
+        self.profile = cProfile.Profile()
+        self.running = False
+
+    def wrap(self, name, fn):
+        """Return fn instrumented to record its duration under `name`."""
+        samples = self.samples[name]
+
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                samples.append(time.perf_counter() - start)
+        wrapper.__name__ = getattr(fn, '__name__', name)
+        return wrapper
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.samples[name].append(end - start)
+            if name == 'frame_render':
+                self.frame_times.append(end)
+
+    def start(self, root):
+        self.root = root
+        self.running = True
+        self.profile.enable()
+        self._schedule_probe()
+        self._schedule_overlay()
+
+    def _schedule_probe(self):
+        expected = time.perf_counter() + self.probe_interval_ms / 1000.0
+        self.root.after(self.probe_interval_ms, self._probe, expected)
+
+    def _probe(self, expected):
+        # How late the loop got around to a timer that was due at `expected`
+        self.lag.append(max(0.0, time.perf_counter() - expected))
+        if self.running:
+            self._schedule_probe()
+
+    def attach_overlay(self, widget):
+        """Float a live stats label over the top-left corner of `widget`."""
+        self.overlay = tk.Label(widget, bg='#000000', fg='#00FF00',
+                                font=('Consolas', 9), justify=tk.LEFT, anchor=tk.NW)
+        self.overlay.place(x=4, y=4)
+
+    def _schedule_overlay(self):
+        if self.running:
+            self.root.after(self.overlay_interval_ms, self._refresh_overlay)
+
+    def _fps(self):
+        frames = list(self.frame_times)
+        if len(frames) < 2 or frames[-1] == frames[0]:
+            return 0.0
+        return (len(frames) - 1) / (frames[-1] - frames[0])
+
+    def _refresh_overlay(self):
+        if self.overlay is not None:
+            lines = ["fps {:5.1f}   lag p95 {:6.1f}ms  max {:6.1f}ms".format(
+                self._fps(), _percentile(self.lag, 95) * 1000.0, max(self.lag, default=0.0) * 1000.0)]
+            for name in sorted(self.samples):
+                values = self.samples[name]
+                if values:
+                    lines.append("{:<22} last {:6.1f}ms  p95 {:6.1f}ms".format(
+                        name, values[-1] * 1000.0, _percentile(values, 95) * 1000.0))
+            self.overlay.configure(text="\n".join(lines))
+            self.overlay.lift()
+        self._schedule_overlay()
+
+    def summary(self):
+        """Text report of everything currently in the ring buffers."""
+        out = io.StringIO()
+        out.write("{:<24}{:>8}{:>11}{:>11}{:>11}{:>11}\n".format(
+            'callback', 'count', 'mean ms', 'p95 ms', 'p99 ms', 'max ms'))
+        rows = [('event_loop_lag', self.lag)] + sorted(self.samples.items())
+        for name, values in rows:
+            values = list(values)
+            if not values:
+                continue
+            out.write("{:<24}{:>8}{:>11.2f}{:>11.2f}{:>11.2f}{:>11.2f}\n".format(
+                name, len(values), sum(values) / len(values) * 1000.0,
+                _percentile(values, 95) * 1000.0, _percentile(values, 99) * 1000.0,
+                max(values) * 1000.0))
+        out.write("frames/s (recent): {:.1f}\n".format(self._fps()))
+        return out.getvalue()
+
+    def stop(self):
+        """Stop sampling and write the pstats dump and summary."""
+        if not self.running:
+            return
+        self.running = False
+        self.profile.disable()
+
+        print("\nGUI event loop profile (last {} samples per callback):".format(self.capacity))
+        print(self.summary())
+        try:
+            self.profile.dump_stats(self.pstats_path)
+            print("cProfile stats written to {}".format(self.pstats_path))
+            stats = pstats.Stats(self.profile).sort_stats('cumulative')
+            stats.print_stats(25)
+        except Exception as e:
+            print(f"Error writing profile: {str(e)}")
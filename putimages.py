@@ -1,6 +1,13 @@
+import sys
 import boto3
+import config
 
-s3 = boto3.resource('s3')
+CONFIG = config.get()
+if not CONFIG.bucket:
+    print("Set the bucket in the configuration (FACE_RECOGNITION_BUCKET or facerecognition.ini)")
+    sys.exit(1)
+
+s3 = boto3.resource('s3', region_name=CONFIG.region)
 
 # Get list of objects for indexing
 images=[('rajiv.jpg','Rajiv Upadhyay'),
@@ -14,6 +21,6 @@ images=[('rajiv.jpg','Rajiv Upadhyay'),
 # Iterate through list to upload objects to S3   
 for image in images:
     file = open(image[0],'rb')
-    object = s3.Object('famouspersons-facerecognition-123xyz','index/'+ image[0])
+    object = s3.Object(CONFIG.bucket,'index/'+ image[0])
     ret = object.put(Body=file,
                     Metadata={'FullName':image[1]})
\ No newline at end of file
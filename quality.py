@@ -0,0 +1,161 @@
+"""Local face image quality scoring for enrollment.
+
+A burst of frames is scored in one vectorized NumPy pass: face crops are
+resized to a common size and stacked, so sharpness, exposure and symmetry are
+computed for the whole burst at once. The best frames are enrolled; files
+that fail the minimums are rejected before they are uploaded.
+"""
+import cv2
+import numpy as np
+from PIL import Image
+
+# Face crops are compared at this size so scores do not depend on distance
+CROP_SIZE = 128
+
+# Variance of the Laplacian on a CROP_SIZE face crop
+MIN_SHARPNESS = 30.0
+GOOD_SHARPNESS = 300.0
+# Mean grey level (0-255)
+MIN_BRIGHTNESS = 50.0
+MAX_BRIGHTNESS = 210.0
+# Standard deviation of grey levels
+MIN_CONTRAST = 20.0
+# Symmetry is compared on a coarse grid so hair and texture do not dominate
+SYMMETRY_GRID = 32
+# Smallest face side in pixels that Rekognition matches reliably
+MIN_FACE_SIZE = 80
+
+WEIGHTS = {'sharpness': 0.5, 'exposure': 0.25, 'symmetry': 0.25}
+
+
+def _crops(frames, boxes):
+    """Stack grey CROP_SIZE x CROP_SIZE crops of each frame (or its face box)."""
+    crops = np.empty((len(frames), CROP_SIZE, CROP_SIZE), dtype=np.float32)
+    for i, (frame, box) in enumerate(zip(frames, boxes)):
+        grey = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if box is not None:
+            x, y, w, h = box
+            grey = grey[y:y + h, x:x + w]
+        crops[i] = cv2.resize(grey, (CROP_SIZE, CROP_SIZE), interpolation=cv2.INTER_AREA)
+    return crops
+
+
+def score_frames(frames, boxes=None):
+    """Score a burst of BGR frames, returning one dict per frame.
+
+    boxes: optional (x, y, w, h) face box per frame; whole frames are scored
+    when it is missing or None.
+    """
+    if not len(frames):
+        return []
+    boxes = boxes if boxes is not None else [None] * len(frames)
+    crops = _crops(frames, boxes)
+
+    # 4-neighbour Laplacian over the interior of every crop at once
+    laplacian = (crops[:, :-2, 1:-1] + crops[:, 2:, 1:-1] + crops[:, 1:-1, :-2]
+                 + crops[:, 1:-1, 2:] - 4.0 * crops[:, 1:-1, 1:-1])
+    sharpness = laplacian.var(axis=(1, 2))
+    brightness = crops.mean(axis=(1, 2))
+    contrast = crops.std(axis=(1, 2))
+
+    # A turned head breaks left/right symmetry: correlate the left half of a
+    # coarse copy of each crop with the mirrored right half
+    step = CROP_SIZE // SYMMETRY_GRID
+    coarse = crops.reshape(len(crops), SYMMETRY_GRID, step, SYMMETRY_GRID, step).mean(axis=(2, 4))
+    half = SYMMETRY_GRID // 2
+    left = coarse[:, :, :half]
+    right = coarse[:, :, half:][:, :, ::-1]
+    left = left - left.mean(axis=(1, 2), keepdims=True)
+    right = right - right.mean(axis=(1, 2), keepdims=True)
+    norm = np.sqrt((left * left).sum(axis=(1, 2)) * (right * right).sum(axis=(1, 2)))
+    symmetry = np.clip((left * right).sum(axis=(1, 2)) / np.maximum(norm, 1e-6), 0.0, 1.0)
+
+    exposure = np.clip(1.0 - np.abs(brightness - 128.0) / 128.0, 0.0, 1.0)
+    sharp = np.clip(sharpness / GOOD_SHARPNESS, 0.0, 1.0)
+    score = (WEIGHTS['sharpness'] * sharp + WEIGHTS['exposure'] * exposure
+             + WEIGHTS['symmetry'] * symmetry)
+
+    results = []
+    for i, box in enumerate(boxes):
+        face_size = min(box[2], box[3]) if box is not None else min(frames[i].shape[:2])
+        results.append({
+            'sharpness': round(float(sharpness[i]), 1),
+            'brightness': round(float(brightness[i]), 1),
+            'contrast': round(float(contrast[i]), 1),
+            'symmetry': round(float(symmetry[i]), 3),
+            'face_size': int(face_size),
+            'score': round(float(score[i]), 3),
+        })
+    return results
+
+
+def rejection_reasons(quality):
+    """Human-readable reasons a scored frame is not good enough to enroll."""
+    reasons = []
+    if quality['face_size'] < MIN_FACE_SIZE:
+        reasons.append("face too small ({}px, need {}px)".format(quality['face_size'], MIN_FACE_SIZE))
+    if quality['sharpness'] < MIN_SHARPNESS:
+        reasons.append("image is blurry (sharpness {:.0f})".format(quality['sharpness']))
+    if quality['brightness'] < MIN_BRIGHTNESS:
+        reasons.append("image is too dark")
+    elif quality['brightness'] > MAX_BRIGHTNESS:
+        reasons.append("image is overexposed")
+    if quality['contrast'] < MIN_CONTRAST:
+        reasons.append("image has too little contrast")
+    # Symmetry only ranks frames: side lighting lowers it as much as a turned
+    # head does, so pose is checked by Rekognition at enrollment instead
+    return reasons
+
+
+def largest_face(detector, frame):
+    """The largest face box in the frame, or None."""
+    if detector is None:
+        return None
+    boxes = detector.detect(frame)
+    if not len(boxes):
+        return None
+    return tuple(int(v) for v in max(boxes, key=lambda b: b[2] * b[3]))
+
+
+def select_best(frames, k=3, detector=None):
+    """Pick the k best frames of a burst as (frame, quality) pairs, best first.
+
+    With a detector, frames without a face are dropped and the largest face is
+    scored; frames that fail the minimums are never selected.
+    """
+    boxes = [largest_face(detector, frame) for frame in frames]
+    if detector is not None:
+        candidates = [(f, b) for f, b in zip(frames, boxes) if b is not None]
+    else:
+        candidates = list(zip(frames, boxes))
+    if not candidates:
+        return []
+
+    scores = score_frames([f for f, _ in candidates], [b for _, b in candidates])
+    ranked = sorted(zip(candidates, scores), key=lambda item: item[1]['score'], reverse=True)
+    return [(frame, quality) for (frame, _), quality in ranked if not rejection_reasons(quality)][:k]
+
+
+def check_image(path, detector=None):
+    """Score an image file, returning (quality, reasons); reasons is empty if it is usable."""
+    # Large photos are decoded at 1/2 or 1/4 scale by libjpeg; crops are
+    # scored at CROP_SIZE anyway, so only the face size needs scaling back
+    factor, flag = 1, cv2.IMREAD_COLOR
+    try:
+        with Image.open(path) as image:
+            longest = max(image.size)
+        if longest >= 4096:
+            factor, flag = 4, cv2.IMREAD_REDUCED_COLOR_4
+        elif longest >= 2048:
+            factor, flag = 2, cv2.IMREAD_REDUCED_COLOR_2
+    except Exception:
+        pass
+    frame = cv2.imread(path, flag)
+    if frame is None:
+        return None, ["could not decode image"]
+    box = largest_face(detector, frame)
+    if detector is not None and box is None:
+        return None, ["no face detected"]
+    quality = score_frames([frame], [box])[0]
+    quality['face_size'] *= factor
+    return quality, rejection_reasons(quality)
@@ -0,0 +1,46 @@
+"""Token-bucket rate limiting for AWS API calls shared across threads."""
+import threading
+import time
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        """Allow `rate` calls per second on average, with bursts up to `burst`.
+
+        A rate of 0 or None disables limiting.
+        """
+        self.rate = rate
+        self.capacity = float(burst if burst is not None else max(1, rate or 1))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens=1):
+        """Take tokens if available right now; never blocks."""
+        if not self.rate:
+            return True
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens=1):
+        """Block until `tokens` are available, returning the time spent waiting."""
+        if not self.rate:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self.lock:
+                self._refill(time.monotonic())
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return waited
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
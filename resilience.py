@@ -0,0 +1,244 @@
+"""Tail-latency and failure handling for the calls on the recognition path.
+
+Hedger runs a read-only call and, if it has not answered by the recent p95
+latency, sends an identical second request and takes whichever answers
+first. Every call also has a deadline, so a person at the door waits for
+that long at most instead of for botocore's full retry cycle.
+
+CircuitBreaker counts consecutive service failures (throttling, 5xx,
+connection errors, deadlines) and, once open, fails calls immediately until
+a probe call after `reset_timeout` succeeds. Client errors such as "no face
+in the image" are answers, not failures, and never trip it.
+
+DeferredQueue spools images that could not be recognized while the service
+was unavailable, so they can be recognized once it recovers.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+
+import metrics
+
+# Error codes that describe the request rather than the health of the service
+CLIENT_ERRORS = {
+    'InvalidParameterException', 'InvalidImageFormatException', 'ImageTooLargeException',
+    'InvalidS3ObjectException', 'ResourceNotFoundException', 'AccessDeniedException',
+    'ValidationException', 'ConditionalCheckFailedException',
+}
+
+
+def is_failure(error):
+    """True if `error` says the service is unhealthy rather than the request is wrong."""
+    code = (getattr(error, 'response', None) or {}).get('Error', {}).get('Code')
+    return code not in CLIENT_ERRORS
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling a service whose breaker is open."""
+
+
+class LatencyTracker:
+    def __init__(self, window=200, min_samples=20):
+        """Rolling window of recent call latencies in seconds."""
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.lock = threading.Lock()
+
+    def add(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, quantile, default=None):
+        """The `quantile` latency, or `default` until enough calls have been seen."""
+        with self.lock:
+            if len(self.samples) < self.min_samples:
+                return default
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(quantile * len(ordered)))]
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        """Open after `failure_threshold` consecutive failures; probe again after `reset_timeout` s."""
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self.lock:
+            if self.opened_at is None:
+                return 'closed'
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                return 'half_open'
+            return 'open'
+
+    def allow(self):
+        """Whether a call may go ahead; only one probe is let through when half open."""
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout or self.probing:
+                return False
+            self.probing = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                print(f"Circuit {self.name} closed")
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    print(f"Circuit {self.name} opened after {self.failures} failures")
+                    metrics.incr('circuit.{}.opened'.format(self.name))
+                # A failed probe waits out another full reset timeout
+                self.opened_at = time.monotonic()
+
+
+class Hedger:
+    def __init__(self, name, breaker=None, quantile=0.95, min_delay=0.05, deadline=5.0, workers=32):
+        """Run calls with a hedged duplicate after the `quantile` latency and an overall deadline.
+
+        quantile: 0 disables hedging.
+        deadline: seconds a caller waits in total (0 for no limit).
+        """
+        self.name = name
+        self.breaker = breaker
+        self.quantile = quantile
+        self.min_delay = min_delay
+        self.deadline = deadline
+        self.latency = LatencyTracker()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name + '-call')
+
+    def _timed(self, fn, args, kwargs):
+        started = time.monotonic()
+        result = fn(*args, **kwargs)
+        self.latency.add(time.monotonic() - started)
+        return result
+
+    def hedge_delay(self):
+        if not self.quantile:
+            return None
+        # Until the tracker has warmed up, hedge half way to the deadline
+        default = self.deadline / 2.0 if self.deadline else None
+        delay = self.latency.percentile(self.quantile, default)
+        return None if delay is None else max(self.min_delay, delay)
+
+    def _run(self, fn, args, kwargs):
+        """First successful answer of the primary and the hedge; raises if both fail."""
+        started = time.monotonic()
+        deadline = started + self.deadline if self.deadline else None
+        delay = self.hedge_delay()
+        hedge_at = started + delay if delay is not None else None
+        primary = self.pool.submit(self._timed, fn, args, kwargs)
+        futures = [primary]
+        error = None
+        while futures:
+            wake_at = [t for t in (hedge_at, deadline) if t is not None]
+            timeout = max(0.0, min(wake_at) - time.monotonic()) if wake_at else None
+            done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                futures.remove(future)
+                if future.exception() is None:
+                    if future is not primary:
+                        metrics.incr('{}.hedge_won'.format(self.name))
+                    return future.result()
+                error = future.exception()
+                if not is_failure(error):
+                    raise error  # The hedge would get the same answer
+                hedge_at = None  # Don't hedge a request that already failed
+            now = time.monotonic()
+            if futures and deadline is not None and now >= deadline:
+                metrics.incr('{}.deadline'.format(self.name))
+                raise TimeoutError(f"{self.name} did not answer within {self.deadline:g}s")
+            if futures and hedge_at is not None and now >= hedge_at:
+                # The primary is slower than usual: send a duplicate
+                metrics.incr('{}.hedged'.format(self.name))
+                futures.append(self.pool.submit(self._timed, fn, args, kwargs))
+                hedge_at = None
+        raise error
+
+    def call(self, fn, *args, **kwargs):
+        """fn(*args, **kwargs) through the breaker, hedge and deadline."""
+        if self.breaker is not None and not self.breaker.allow():
+            metrics.incr('{}.rejected'.format(self.name))
+            raise CircuitOpen(f"{self.name} is unavailable; retrying in at most "
+                              f"{self.breaker.reset_timeout:g}s")
+        try:
+            result = self._run(fn, args, kwargs)
+        except Exception as e:
+            if self.breaker is not None:
+                if is_failure(e):
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+            raise
+        if self.breaker is not None:
+            self.breaker.record_success()
+        return result
+
+
+class DeferredQueue:
+    def __init__(self, directory, max_items=1000):
+        """Images spooled to `directory` for recognition once the service is back."""
+        self.directory = os.path.abspath(directory)
+        self.max_items = max_items
+        self.lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def pending(self):
+        """Spooled image paths, oldest first."""
+        return sorted(os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                      if name.endswith('.json'))
+
+    def put(self, image_bytes, date=None, mark=True):
+        """Spool an image; returns its id, or None when the queue is full."""
+        with self.lock:
+            if len(self.pending()) >= self.max_items:
+                metrics.incr('deferred.dropped')
+                return None
+            captured = datetime.now()
+            item_id = '{}-{}'.format(captured.strftime('%Y%m%dT%H%M%S%f'), uuid.uuid4().hex[:8])
+            base = os.path.join(self.directory, item_id)
+            with open(base + '.jpg', 'wb') as f:
+                f.write(image_bytes)
+            # The metadata file is what marks an item complete
+            with open(base + '.json.tmp', 'w', encoding='utf-8') as f:
+                json.dump({'captured': captured.isoformat(timespec='seconds'),
+                           'date': date.strftime('%Y-%m-%d') if date else captured.strftime('%Y-%m-%d'),
+                           'mark': mark}, f)
+            os.replace(base + '.json.tmp', base + '.json')
+        metrics.incr('deferred.queued')
+        return item_id
+
+    def load(self, meta_path):
+        """(image_bytes, date, mark, captured) for a spooled item."""
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+        with open(meta_path[:-len('.json')] + '.jpg', 'rb') as f:
+            image_bytes = f.read()
+        return image_bytes, datetime.strptime(meta['date'], '%Y-%m-%d'), meta['mark'], meta['captured']
+
+    def remove(self, meta_path):
+        for path in (meta_path, meta_path[:-len('.json')] + '.jpg'):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
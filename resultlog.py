@@ -0,0 +1,159 @@
+"""Bounded results log for the GUI.
+
+The results panel used to be a Text widget that every message was inserted
+into and scrolled to, so after a day at the door it held tens of thousands
+of lines and each insert cost more to lay out and redraw. ResultLog keeps
+the newest `capacity` lines in a ring buffer and appends every message to a
+rotating log file, which is where the full history lives. LogView shows a
+ResultLog in a Text widget that only ever holds the rows on screen, and
+coalesces appends into at most one redraw per frame.
+"""
+import logging
+import logging.handlers
+import os
+import threading
+import tkinter as tk
+import tkinter.font as tkfont
+from collections import deque
+from itertools import islice
+
+import metrics
+
+# Redraws are coalesced to at most one per display frame
+FRAME_MS = 16
+WHEEL_LINES = 3
+
+
+class ResultLog:
+    def __init__(self, capacity=1000, path=None, max_bytes=5 * 1024 * 1024, backups=5):
+        """The newest `capacity` lines in memory; every line also goes to `path`, rotated at `max_bytes`."""
+        self.lines = deque(maxlen=capacity)
+        self.total = 0  # Lines ever appended, so positions survive eviction
+        self.version = 0
+        self.lock = threading.Lock()
+        self.handler = None
+        self.logger = None
+        if path:
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+            self.handler = logging.handlers.RotatingFileHandler(
+                path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8', delay=True)
+            self.handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+            self.logger = logging.getLogger('facerecognition.results.{}'.format(os.path.abspath(path)))
+            self.logger.propagate = False
+            self.logger.setLevel(logging.INFO)
+            self.logger.addHandler(self.handler)
+
+    def append(self, message):
+        lines = message.split('\n')
+        with self.lock:
+            self.lines.extend(lines)
+            self.total += len(lines)
+            self.version += 1
+        if self.logger is not None:
+            with metrics.timer('gui.results_log'):
+                self.logger.info(message)
+
+    @property
+    def first(self):
+        """Position of the oldest line still in memory."""
+        return self.total - len(self.lines)
+
+    def window(self, start, count):
+        """Up to `count` lines from position `start` (as counted by `total`)."""
+        with self.lock:
+            offset = max(0, start - (self.total - len(self.lines)))
+            return list(islice(self.lines, offset, offset + count))
+
+    def close(self):
+        if self.handler is not None:
+            self.logger.removeHandler(self.handler)
+            self.handler.close()
+            self.handler = None
+
+
+class LogView:
+    def __init__(self, parent, log, **text_options):
+        """A read-only Text showing the rows of `log` that fit, following the newest line.
+
+        Scrolling back stops following; scrolling to the bottom resumes it.
+        """
+        self.log = log
+        self.frame = tk.Frame(parent, bg=text_options.get('bg'))
+        self.scrollbar = tk.Scrollbar(self.frame, command=self.on_scroll)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.text = tk.Text(self.frame, wrap=tk.WORD, state=tk.DISABLED, **text_options)
+        self.text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.line_height = tkfont.Font(font=self.text.cget('font')).metrics('linespace')
+        self.top = 0
+        self.follow = True
+        self.drawn = None
+        self.pending = False
+
+        self.text.bind('<Configure>', lambda event: self.schedule())
+        # The Text only holds the visible rows, so the wheel scrolls the log instead
+        self.text.bind('<MouseWheel>', self.on_wheel)
+        self.text.bind('<Button-4>', lambda event: self.on_wheel(event, -WHEEL_LINES))
+        self.text.bind('<Button-5>', lambda event: self.on_wheel(event, WHEEL_LINES))
+
+    def pack(self, **options):
+        self.frame.pack(**options)
+
+    def rows(self):
+        height = self.text.winfo_height() - 2 * int(self.text.winfo_fpixels(self.text.cget('pady')))
+        return max(1, height // self.line_height)
+
+    def append(self, message):
+        self.log.append(message)
+        self.schedule()
+
+    def schedule(self):
+        if not self.pending:
+            self.pending = True
+            self.text.after(FRAME_MS, self.flush)
+
+    def flush(self):
+        """Redraw now if anything changed since the last draw."""
+        self.pending = False
+        rows = self.rows()
+        first, total = self.log.first, self.log.total
+        if self.follow:
+            self.top = total - rows
+        self.top = max(first, min(self.top, total - rows))
+        state = (self.log.version, self.top, rows)
+        if state == self.drawn:
+            return
+        self.drawn = state
+        lines = self.log.window(self.top, rows)
+        self.text.configure(state=tk.NORMAL)
+        self.text.delete('1.0', tk.END)
+        self.text.insert(tk.END, '\n'.join(lines))
+        if self.follow:
+            # Wrapped lines take more than one row; keep the newest in view
+            self.text.see(tk.END)
+        self.text.configure(state=tk.DISABLED)
+        size = total - first
+        if size:
+            self.scrollbar.set((self.top - first) / size, (self.top - first + len(lines)) / size)
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def scroll_by(self, lines):
+        self.top += lines
+        self.follow = self.top >= self.log.total - self.rows()
+        self.schedule()
+
+    def on_scroll(self, action, amount, unit=None):
+        if action == 'moveto':
+            first = self.log.first
+            self.top = first + int(float(amount) * (self.log.total - first))
+            self.follow = self.top >= self.log.total - self.rows()
+            self.schedule()
+        elif action == 'scroll':
+            self.scroll_by(int(amount) * (self.rows() if unit == 'pages' else 1))
+
+    def on_wheel(self, event, lines=None):
+        if lines is None:
+            lines = -WHEEL_LINES if event.delta > 0 else WHEEL_LINES
+        self.scroll_by(lines)
+        return 'break'
@@ -0,0 +1,205 @@
+"""Sharded Rekognition collections.
+
+A single collection gets slow to search, and hits per-collection limits, as
+the gallery grows towards millions of faces. Faces are routed to one of
+several collections instead: per site (or tenant) when one is given, then by
+a stable hash of the person's name, so every face of a person lands in the
+same shard:
+
+    facerecognition_collection              1 shard, no sites (the original layout)
+    facerecognition_collection-03           hash shard 3 of N
+    facerecognition_collection-hq-03        hash shard 3 of N for site "hq"
+
+Searches fan out to every shard in scope in parallel and the matches are
+merged by similarity. Each identity record stores the collection its face is
+in, and `rebalance` moves faces when the layout changes.
+"""
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import identity
+import metrics
+from ratelimit import TokenBucket
+
+
+class ShardMap:
+    def __init__(self, base='facerecognition_collection', shards=1, sites=()):
+        """Route faces to `shards` hash collections per site under `base`."""
+        if shards < 1:
+            raise ValueError("shards must be at least 1")
+        self.base = base
+        self.shards = shards
+        self.sites = tuple(sites)
+
+    @classmethod
+    def from_config(cls, cfg):
+        """The layout described by the collection, shards and sites settings."""
+        return cls(cfg.collection, cfg.shards, cfg.sites)
+
+    def sharded(self, site=None):
+        """False when everything lives in the single base collection."""
+        return self.shards > 1 or bool(site) or bool(self.sites)
+
+    def _name(self, site, shard):
+        parts = [self.base]
+        if site:
+            parts.append(site)
+        if self.shards > 1:
+            parts.append('{:02d}'.format(shard))
+        return '-'.join(parts)
+
+    def shard_of(self, key):
+        # crc32 is stable across processes, unlike hash()
+        return zlib.crc32(key.strip().lower().encode('utf-8')) % self.shards
+
+    def collection_for(self, key, site=None):
+        """Collection that faces of the person identified by `key` belong in."""
+        return self._name(site, self.shard_of(key))
+
+    def collections(self, site=None):
+        """Collections a search covers: one site's shards, or without a site the
+        unsited shards plus those of every site in `sites`. Faces enrolled under
+        a site missing from `sites` are only found by searches for that site.
+        """
+        sites = [site] if site else [None] + list(self.sites)
+        return [self._name(s, shard) for s in sites for shard in range(self.shards)]
+
+
+class ShardedSearcher:
+    def __init__(self, rekognition, shard_map, site=None, workers=None):
+        """Search every shard in scope concurrently and merge the matches."""
+        self.rekognition = rekognition
+        self.shard_map = shard_map
+        self.site = site
+        self.collections = shard_map.collections(site)
+        self.pool = ThreadPoolExecutor(max_workers=workers or min(16, len(self.collections)),
+                                       thread_name_prefix='shard-search')
+
+    def _search_one(self, collection_id, image_bytes, max_faces, threshold):
+        with metrics.timer('rekognition.search_shard'):
+            try:
+                response = self.rekognition.search_faces_by_image(
+                    CollectionId=collection_id,
+                    Image={'Bytes': image_bytes},
+                    MaxFaces=max_faces,
+                    FaceMatchThreshold=threshold
+                )
+            except self.rekognition.exceptions.ResourceNotFoundException:
+                # A shard nobody has enrolled into yet
+                return []
+        for match in response['FaceMatches']:
+            match['CollectionId'] = collection_id
+        return response['FaceMatches']
+
+    def search(self, image_bytes, max_faces, threshold):
+        """Same shape as search_faces_by_image, with CollectionId on every match.
+
+        A failure on any shard fails the whole search: partial results could
+        miss the right person and accept someone else.
+        """
+        if len(self.collections) == 1:
+            matches = self._search_one(self.collections[0], image_bytes, max_faces, threshold)
+        else:
+            futures = [self.pool.submit(self._search_one, collection_id, image_bytes, max_faces, threshold)
+                       for collection_id in self.collections]
+            matches = [match for future in futures for match in future.result()]
+        matches.sort(key=lambda m: m.get('Similarity', 0), reverse=True)
+        return {'FaceMatches': matches[:max_faces]}
+
+
+def scan_items(dynamodb, table_name):
+    """Every identity record in the table, following scan pagination."""
+    kwargs = {'TableName': table_name}
+    while True:
+        response = dynamodb.scan(**kwargs)
+        for item in response.get('Items', []):
+            yield item
+        if 'LastEvaluatedKey' not in response:
+            return
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def plan_rebalance(dynamodb, table_name, shard_map, default_collection):
+    """[(item, current, target)] for every face that is not in its target shard."""
+    moves = []
+    for item in scan_items(dynamodb, table_name):
+        current = item.get('CollectionId', {}).get('S', default_collection)
+        site = item.get('Site', {}).get('S')
+        target = shard_map.collection_for(item['FullName']['S'], site)
+        if current != target:
+            moves.append((item, current, target))
+    return moves
+
+
+class Rebalancer:
+    def __init__(self, rekognition, dynamodb, table_name, workers=4, rate=5.0):
+        """Move faces between shards by re-indexing their enrollment images."""
+        self.rekognition = rekognition
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+        self.workers = workers
+        self.limiter = TokenBucket(rate)
+        self.created = set()
+        self.lock = threading.Lock()
+
+    def ensure_collection(self, collection_id):
+        with self.lock:
+            if collection_id in self.created:
+                return
+            try:
+                self.rekognition.create_collection(CollectionId=collection_id)
+            except self.rekognition.exceptions.ResourceAlreadyExistsException:
+                pass
+            self.created.add(collection_id)
+
+    def move(self, item, current, target):
+        """Index the face into `target`, repoint its record, then drop the old face."""
+        if 'ImageKey' not in item:
+            return 'skipped', "no enrollment image recorded"
+        self.ensure_collection(target)
+        # Faces enrolled before person ids get one on the way
+        person_id = item['PersonId']['S'] if 'PersonId' in item else identity.person_id(
+            item['FullName']['S'], item.get('Site', {}).get('S'))
+        self.limiter.acquire()
+        response = self.rekognition.index_faces(
+            CollectionId=target,
+            Image={'S3Object': {'Bucket': item['ImageBucket']['S'], 'Name': item['ImageKey']['S']}},
+            ExternalImageId=person_id,
+            MaxFaces=1,
+            DetectionAttributes=['DEFAULT']
+        )
+        if not response['FaceRecords']:
+            return 'failed', "no face indexed from {}".format(item['ImageKey']['S'])
+
+        old_face_id = item['RekognitionId']['S']
+        new_item = dict(item)
+        new_item['RekognitionId'] = {'S': response['FaceRecords'][0]['Face']['FaceId']}
+        new_item['CollectionId'] = {'S': target}
+        new_item['PersonId'] = {'S': person_id}
+        # Write the new record before removing the old one, so the person is
+        # recognizable throughout the move
+        self.dynamodb.put_item(TableName=self.table_name, Item=new_item)
+        self.dynamodb.delete_item(TableName=self.table_name, Key={'RekognitionId': {'S': old_face_id}})
+        self.limiter.acquire()
+        self.rekognition.delete_faces(CollectionId=current, FaceIds=[old_face_id])
+        return 'moved', None
+
+    def run(self, moves):
+        """Apply a plan, returning {'moved': n, 'skipped': n, 'failed': n}."""
+        counts = {'moved': 0, 'skipped': 0, 'failed': 0}
+
+        def apply(move):
+            item = move[0]
+            try:
+                status, reason = self.move(*move)
+            except Exception as e:
+                status, reason = 'failed', str(e)
+            if reason:
+                print(f"{item['FullName']['S']} ({item['RekognitionId']['S']}): {status}, {reason}")
+            return status
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for status in pool.map(apply, moves):
+                counts[status] += 1
+        return counts
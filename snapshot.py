@@ -0,0 +1,396 @@
+"""Versioned identity snapshots in S3, kept current on kiosks by deltas.
+
+Every recognized face used to cost a get_item on the identity table (one per
+TTL per kiosk with the name cache), so a site full of kiosks multiplies the
+read load of a table that rarely changes. A publisher scans the table once
+and writes a compact snapshot of the identities a site can match. Each
+kiosk downloads that snapshot at startup and then polls a small manifest
+for the deltas since its version, so recognition reads no DynamoDB at all.
+Faces enrolled since the last publish are still looked up live.
+
+Under `<prefix><site or "all">/` in identity_snapshot_bucket, a bucket of its
+own: every object written to the enrollment bucket invokes the Lambda.
+
+    manifest.json          version, its snapshot and the recent deltas
+    snapshot-<N>.jsonl.gz  every identity at version N, sorted by face id
+    delta-<N>.json.gz      rows upserted and face ids deleted from N-1 to N
+
+Publish on a schedule (or after bulk enrollments):
+
+    python snapshot.py publish --site hq
+    python snapshot.py publish --watch 60
+"""
+import gzip
+import io
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+import metrics
+from shards import scan_items
+
+FORMAT = 1
+MANIFEST = 'manifest.json'
+# Identity attributes carried by a snapshot row, after the face id
+FIELDS = ('FullName', 'PersonId', 'CollectionId', 'Site', 'ImageBucket', 'ImageKey')
+# Deltas listed in the manifest; kiosks further behind download the snapshot
+KEEP_DELTAS = 100
+MAX_BACKOFF = 300.0
+
+
+def row_of(item):
+    """A snapshot row (face id first, then FIELDS, '' when absent) from a DynamoDB item."""
+    return (item['RekognitionId']['S'],) + tuple(item.get(field, {}).get('S', '') for field in FIELDS)
+
+
+def item_of(row):
+    """The DynamoDB-shaped identity record for a snapshot row."""
+    item = {'RekognitionId': {'S': row[0]}}
+    for field, value in zip(FIELDS, row[1:]):
+        if value:
+            item[field] = {'S': value}
+    return item
+
+
+def site_prefix(prefix, site=None):
+    return '{}{}/'.format(prefix, site or 'all')
+
+
+class IdentitySnapshot:
+    def __init__(self, version=0, rows=()):
+        """Identity rows at one version, sorted by face id for binary search.
+
+        Deltas build new lists and swap them in, so lookups take no lock.
+        """
+        rows = sorted(tuple(row) for row in rows)
+        self.version = version
+        self.state = ([row[0] for row in rows], rows)
+
+    def __len__(self):
+        return len(self.state[0])
+
+    def get(self, face_id):
+        """The identity record of `face_id`, or None if it is not in the snapshot."""
+        ids, rows = self.state
+        i = bisect_left(ids, face_id)
+        if i < len(ids) and ids[i] == face_id:
+            return item_of(rows[i])
+        return None
+
+    def rows(self):
+        return list(self.state[1])
+
+    def apply(self, delta):
+        """Apply a delta from this version to the next; False if it does not follow on."""
+        if delta['from'] != self.version:
+            return False
+        ids, rows = list(self.state[0]), list(self.state[1])
+        for face_id in delta['delete']:
+            i = bisect_left(ids, face_id)
+            if i < len(ids) and ids[i] == face_id:
+                del ids[i], rows[i]
+        for row in delta['upsert']:
+            row = tuple(row)
+            i = bisect_left(ids, row[0])
+            if i < len(ids) and ids[i] == row[0]:
+                rows[i] = row
+            else:
+                ids.insert(i, row[0])
+                rows.insert(i, row)
+        self.state = (ids, rows)
+        self.version = delta['to']
+        return True
+
+    def dumps(self, site=None):
+        """Gzipped JSON lines: a header, then one row per face."""
+        buffer = io.BytesIO()
+        # mtime=0 keeps identical snapshots byte-identical
+        with gzip.GzipFile(fileobj=buffer, mode='wb', mtime=0) as f:
+            header = {'format': FORMAT, 'version': self.version, 'site': site or '',
+                      'fields': list(FIELDS), 'count': len(self)}
+            f.write((json.dumps(header) + '\n').encode('utf-8'))
+            for row in self.state[1]:
+                f.write((json.dumps(row, ensure_ascii=False) + '\n').encode('utf-8'))
+        return buffer.getvalue()
+
+    @classmethod
+    def loads(cls, data):
+        lines = gzip.decompress(data).decode('utf-8').splitlines()
+        header = json.loads(lines[0])
+        if header.get('format') != FORMAT or header.get('fields') != list(FIELDS):
+            raise ValueError("Unsupported identity snapshot format {!r}".format(header.get('format')))
+        rows = [json.loads(line) for line in lines[1:] if line]
+        if len(rows) != header['count']:
+            raise ValueError("Truncated identity snapshot: {} of {} rows".format(len(rows), header['count']))
+        return cls(header['version'], rows)
+
+
+def diff(old_rows, new_rows, version):
+    """The delta that takes `old_rows` at `version` to `new_rows`."""
+    old = {row[0]: row for row in old_rows}
+    new = {row[0]: row for row in new_rows}
+    return {
+        'format': FORMAT,
+        'from': version,
+        'to': version + 1,
+        'upsert': sorted(row for face_id, row in new.items() if old.get(face_id) != row),
+        'delete': sorted(face_id for face_id in old if face_id not in new),
+    }
+
+
+class SnapshotStore:
+    def __init__(self, s3, bucket, prefix='snapshots/', site=None):
+        """The manifest, snapshots and deltas of one site in S3."""
+        self.s3 = s3
+        self.bucket = bucket
+        self.site = site or None
+        self.prefix = site_prefix(prefix, site)
+
+    def read(self, name):
+        with metrics.timer('s3.get_object'):
+            return self.s3.get_object(Bucket=self.bucket, Key=self.prefix + name)['Body'].read()
+
+    def write(self, name, body, content_type):
+        with metrics.timer('s3.put_object'):
+            self.s3.put_object(Bucket=self.bucket, Key=self.prefix + name, Body=body,
+                               ContentType=content_type)
+
+    def manifest(self):
+        """The current manifest, or None if nothing was published yet."""
+        try:
+            return json.loads(self.read(MANIFEST).decode('utf-8'))
+        except self.s3.exceptions.NoSuchKey:
+            return None
+
+    def snapshot(self, manifest):
+        return IdentitySnapshot.loads(self.read(manifest['snapshot']))
+
+    def delta(self, entry):
+        return json.loads(gzip.decompress(self.read(entry['key'])).decode('utf-8'))
+
+
+class SnapshotPublisher:
+    def __init__(self, dynamodb, table_name, store):
+        """Scan `table_name` and publish what changed to `store`."""
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+        self.store = store
+
+    def scan(self):
+        rows = []
+        for item in scan_items(self.dynamodb, self.table_name):
+            # A site's kiosks only search that site's shards
+            if self.store.site and item.get('Site', {}).get('S') != self.store.site:
+                continue
+            rows.append(row_of(item))
+        return rows
+
+    def publish(self):
+        """Publish a new version if the table changed; returns (version, delta or None)."""
+        with metrics.timer('snapshot.publish'):
+            rows = self.scan()
+            manifest = self.store.manifest()
+            previous = self.store.snapshot(manifest) if manifest else IdentitySnapshot()
+            delta = diff(previous.rows(), rows, previous.version)
+            if manifest and not delta['upsert'] and not delta['delete']:
+                return previous.version, None
+
+            version = delta['to']
+            snapshot = IdentitySnapshot(version, rows)
+            deltas = (manifest or {}).get('deltas', [])
+            self.store.write('snapshot-{}.jsonl.gz'.format(version), snapshot.dumps(self.store.site),
+                             'application/gzip')
+            if manifest:
+                self.store.write('delta-{}.json.gz'.format(version),
+                                 gzip.compress(json.dumps(delta).encode('utf-8'), mtime=0), 'application/gzip')
+                deltas = deltas + [{'from': delta['from'], 'to': version, 'key': 'delta-{}.json.gz'.format(version)}]
+            # The manifest goes last: readers never see a version before its objects
+            self.store.write(MANIFEST, json.dumps({
+                'format': FORMAT,
+                'version': version,
+                'snapshot': 'snapshot-{}.jsonl.gz'.format(version),
+                'count': len(snapshot),
+                'published': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'deltas': deltas[-KEEP_DELTAS:],
+            }, indent=2).encode('utf-8'), 'application/json')
+            self.prune(manifest, deltas[:-KEEP_DELTAS])
+            metrics.incr('snapshot.published')
+        return version, delta
+
+    def prune(self, manifest, dropped):
+        """Delete deltas no longer listed and snapshots two versions old."""
+        names = [entry['key'] for entry in dropped]
+        if manifest and manifest['version'] > 1:
+            # The previous snapshot stays for kiosks that read the old manifest
+            names.append('snapshot-{}.jsonl.gz'.format(manifest['version'] - 1))
+        for name in names:
+            try:
+                self.store.s3.delete_object(Bucket=self.store.bucket, Key=self.store.prefix + name)
+            except Exception as e:
+                print(f"Error pruning {name}: {str(e)}")
+
+
+class SnapshotSync:
+    def __init__(self, store, interval=30.0, cache_path=None):
+        """Keep an IdentitySnapshot of `store` current, checking every `interval` seconds.
+
+        cache_path: local copy of the last snapshot, used when S3 can't be
+        reached at startup.
+        """
+        self.store = store
+        self.interval = interval
+        self.cache_path = cache_path
+        self.snapshot = None
+        self.stopping = threading.Event()
+        self.refresh_lock = threading.Lock()
+        self.thread = None
+
+    @classmethod
+    def from_config(cls, cfg, s3=None):
+        store = SnapshotStore(s3 or cfg.client('s3'), cfg.identity_snapshot_bucket, cfg.identity_snapshot, cfg.site)
+        return cls(store, cfg.identity_snapshot_interval, cfg.identity_snapshot_cache or None)
+
+    @property
+    def version(self):
+        return self.snapshot.version if self.snapshot is not None else 0
+
+    def get(self, face_id):
+        """The identity record of `face_id`, or None if unknown or not loaded yet."""
+        snapshot = self.snapshot
+        if snapshot is None:
+            return None
+        item = snapshot.get(face_id)
+        metrics.incr('snapshot.identity_hit' if item is not None else 'snapshot.identity_miss')
+        return item
+
+    def load_cache(self):
+        if not self.cache_path:
+            return None
+        try:
+            with open(self.cache_path, 'rb') as f:
+                return IdentitySnapshot.loads(f.read())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"Ignoring identity snapshot cache {self.cache_path}: {str(e)}")
+            return None
+
+    def save_cache(self, snapshot):
+        if not self.cache_path:
+            return
+        tmp_path = '{}.{}.tmp'.format(self.cache_path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(snapshot.dumps(self.store.site))
+        os.replace(tmp_path, self.cache_path)
+
+    def refresh(self):
+        """Catch up with the published version; returns the version now held."""
+        with self.refresh_lock, metrics.timer('snapshot.refresh'):
+            if self.snapshot is None:
+                self.snapshot = self.load_cache()
+            manifest = self.store.manifest()
+            if manifest is None or manifest['version'] == self.version:
+                return self.version
+
+            current = self.snapshot
+            entries = [entry for entry in manifest['deltas'] if entry['to'] > self.version]
+            if current is not None and entries and entries[0]['from'] == current.version:
+                # Deltas are applied to a copy, so lookups never see half of one
+                updated = IdentitySnapshot(current.version, current.rows())
+                for entry in entries:
+                    if not updated.apply(self.store.delta(entry)):
+                        updated = None
+                        break
+                if updated is not None:
+                    self.snapshot = updated
+                    metrics.incr('snapshot.deltas', len(entries))
+            if self.version != manifest['version']:
+                # New kiosk, too far behind, or a broken chain: take the whole snapshot
+                self.snapshot = self.store.snapshot(manifest)
+                metrics.incr('snapshot.full')
+            self.save_cache(self.snapshot)
+            return self.version
+
+    def run(self):
+        failures = 0
+        while not self.stopping.is_set():
+            try:
+                self.refresh()
+                failures = 0
+                delay = self.interval
+            except Exception as e:
+                # Keep serving the snapshot held; misses still go to DynamoDB
+                failures += 1
+                delay = min(MAX_BACKOFF, self.interval * 2 ** failures)
+                metrics.incr('snapshot.refresh_error')
+                print(f"Identity snapshot refresh failed, retrying in {delay:.0f}s: {str(e)}")
+            self.stopping.wait(delay)
+
+    def start(self):
+        """Load and follow the snapshot in the background; lookups fall back to DynamoDB until then."""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='identity-snapshot', daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        if self.thread is not None:
+            self.stopping.set()
+            self.thread.join(timeout)
+            self.thread = None
+
+
+def main():
+    import argparse
+    import config
+
+    parser = argparse.ArgumentParser(description='Publish identity snapshots for kiosks')
+    parser.add_argument('command', choices=['publish', 'show'],
+                        help='publish: write a new version if the table changed; show: print the manifest')
+    parser.add_argument('--watch', type=float, default=0,
+                        help='Publish again every this many seconds instead of once')
+    config.add_arguments(parser, 'identity_snapshot_bucket', 'table', 'site', 'identity_snapshot')
+    args = parser.parse_args()
+    try:
+        cfg = config.from_args(args, 'identity_snapshot_bucket', 'table', 'site', 'identity_snapshot')
+    except ValueError as e:
+        print(f"Configuration error: {str(e)}")
+        raise SystemExit(1)
+    if not cfg.identity_snapshot_bucket or not cfg.identity_snapshot:
+        print("Set identity_snapshot_bucket and identity_snapshot "
+              "(or FACE_IDENTITY_SNAPSHOT_BUCKET and FACE_IDENTITY_SNAPSHOT) first")
+        raise SystemExit(1)
+    if cfg.identity_snapshot_bucket == cfg.bucket:
+        # Each publish would invoke the enrollment Lambda on objects that aren't faces
+        print("identity_snapshot_bucket must not be the enrollment bucket")
+        raise SystemExit(1)
+    cfg.configure_metrics()
+
+    store = SnapshotStore(cfg.client('s3'), cfg.identity_snapshot_bucket, cfg.identity_snapshot, cfg.site)
+    if args.command == 'show':
+        print(json.dumps(store.manifest(), indent=2))
+        return
+
+    publisher = SnapshotPublisher(cfg.client('dynamodb'), cfg.table, store)
+    while True:
+        try:
+            version, delta = publisher.publish()
+            if delta is None:
+                print(f"{store.prefix}: unchanged at version {version}")
+            else:
+                print(f"{store.prefix}: published version {version} "
+                      f"({len(delta['upsert'])} upserted, {len(delta['delete'])} deleted)")
+        except Exception as e:
+            print(f"Error publishing identity snapshot: {str(e)}")
+            if not args.watch:
+                raise SystemExit(1)
+        if not args.watch:
+            break
+        time.sleep(args.watch)
+    metrics.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,46 @@
-import boto3
-import io
-from PIL import Image
-
-rekognition = boto3.client('rekognition', region_name='us-east-1')
-dynamodb = boto3.client('dynamodb', region_name='us-east-1')
-
-image_path = input("Enter path of the image to check: ")
-
-image = Image.open(image_path)
-stream = io.BytesIO()
-image.save(stream,format="JPEG")
-image_binary = stream.getvalue()
-
-
-response = rekognition.search_faces_by_image(
-        CollectionId='facerecognition_collection',
-        Image={'Bytes':image_binary}                                       
-        )
-
-found = False
-for match in response['FaceMatches']:
-    print (match['Face']['FaceId'],match['Face']['Confidence'])
-        
-    face = dynamodb.get_item(
-        TableName='facerecognition',  
-        Key={'RekognitionId': {'S': match['Face']['FaceId']}}
-        )
-    
-    if 'Item' in face:
-        print ("Found Person: ",face['Item']['FullName']['S'])
-        found = True
-
-if not found:
-    print("Person cannot be recognized")
\ No newline at end of file
+import config
+import metrics
+import encoding
+
+CONFIG = config.get()
+rekognition = CONFIG.client('rekognition')
+dynamodb = CONFIG.client('dynamodb')
+
+def load_image_bytes(image_path):
+    """Read an image from disk, re-encoding it only if Rekognition would reject it."""
+    return encoding.load_image_bytes(image_path)
+
+def recognize(image_binary, rekognition=rekognition, dynamodb=dynamodb):
+    """Search the collection for the image and return (face_id, confidence, name) matches."""
+    with metrics.timer('rekognition.search_faces_by_image'):
+        response = rekognition.search_faces_by_image(
+                CollectionId=CONFIG.collection,
+                Image={'Bytes':image_binary}
+                )
+
+    matches = []
+    for match in response['FaceMatches']:
+        with metrics.timer('dynamodb.get_item'):
+            face = dynamodb.get_item(
+                TableName=CONFIG.table,
+                Key={'RekognitionId': {'S': match['Face']['FaceId']}}
+                )
+
+        name = face['Item']['FullName']['S'] if 'Item' in face else None
+        matches.append((match['Face']['FaceId'], match['Face']['Confidence'], name))
+    return matches
+
+if __name__ == "__main__":
+    CONFIG.configure_metrics()
+    image_path = input("Enter path of the image to check: ")
+
+    found = False
+    for face_id, confidence, name in recognize(load_image_bytes(image_path)):
+        print (face_id,confidence)
+
+        if name is not None:
+            print ("Found Person: ",name)
+            found = True
+
+    if not found:
+        print("Person cannot be recognized")